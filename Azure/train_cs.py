@@ -17,16 +17,14 @@ import pandas as pd
 import xarray as xr
 from datetime import datetime
 from DLWP.model import DLWPFunctional, ArrayDataGenerator, tf_data_generator
+from DLWP.model.distribute import get_strategy, worker_shard, global_batch_size
 from DLWP.model.preprocessing import get_constants, prepare_data_array
 from DLWP.util import save_model
 from tensorflow.keras.callbacks import TensorBoard
 from azureml.core import Run
 
-from tensorflow.keras.layers import Input, UpSampling3D, AveragePooling3D, concatenate, ReLU, Reshape, Concatenate, \
-    Permute
-from DLWP.custom import CubeSpherePadding2D, CubeSphereConv2D, RNNResetStates, EarlyStoppingMin, \
-    RunHistory, SaveWeightsOnEpoch, GeneratorEpochEnd
-from tensorflow.keras.models import Model
+from DLWP.model.zoo import cube_sphere_model
+from DLWP.custom import RNNResetStates, EarlyStoppingMin, RunHistory, SaveWeightsOnEpoch, GeneratorEpochEnd
 from tensorflow.keras.optimizers import Adam
 
 import tensorflow as tf
@@ -103,8 +101,11 @@ data_interval = 2
 # Add incoming solar radiation forcing
 add_solar = True
 
-# Use multiple GPUs, if available
-n_gpu = 1
+# Distribute training over the local GPUs, or over the workers of a cluster defined by TF_CONFIG, e.g. several local
+# processes started with `python -m DLWP.model.distribute --workers 4 -- python train_cs.py ...`. The batch_size above
+# is then the number of samples per replica, and each worker generates only its own shard of the training samples.
+strategy = get_strategy('auto')
+shard = worker_shard()
 
 # Optimize the optimizer for GPU tensor cores by using mixed precision
 use_mp_optimizer = True
@@ -159,11 +160,12 @@ train_array, input_ind, output_ind, sol = prepare_data_array(train_data, input_s
 generator = ArrayDataGenerator(dlwp, train_array, rank=3, input_slice=input_ind, output_slice=output_ind,
                                input_time_steps=io_time_steps, output_time_steps=io_time_steps,
                                sequence=integration_steps, interval=data_interval, insolation_array=sol,
-                               batch_size=batch_size, shuffle=shuffle, constants=constants, channels_last=True,
-                               drop_remainder=True)
+                               batch_size=global_batch_size(batch_size, strategy), shuffle=shuffle,
+                               constants=constants, channels_last=True, drop_remainder=True, shard=shard)
 input_names = ['main_input'] + ['solar_%d' % i for i in range(1, integration_steps)] + \
               (['constants'] if has_constants else [])
-tf_train_data = tf_data_generator(generator, batch_size=batch_size, input_names=input_names)
+tf_train_data = tf_data_generator(generator, batch_size=global_batch_size(batch_size, strategy),
+                                  input_names=input_names)
 if validation_data is not None:
     print('Loading validation data to memory...')
     val_array, input_ind, output_ind, sol = prepare_data_array(validation_data, input_sel=io_selection,
@@ -171,7 +173,8 @@ if validation_data is not None:
     val_generator = ArrayDataGenerator(dlwp, val_array, rank=3, input_slice=input_ind, output_slice=output_ind,
                                        input_time_steps=io_time_steps, output_time_steps=io_time_steps,
                                        sequence=integration_steps, interval=data_interval, insolation_array=sol,
-                                       batch_size=batch_size, shuffle=False, constants=constants, channels_last=True)
+                                       batch_size=global_batch_size(batch_size, strategy), shuffle=False,
+                                       constants=constants, channels_last=True, shard=shard)
     tf_val_data = tf_data_generator(val_generator, input_names=input_names)
 else:
     tf_val_data = None
@@ -182,243 +185,16 @@ print('Time to load data: %d m %0.2f s' % (np.floor(total_time / 60), total_time
 
 #%% Compile the model structure with some generator data information
 
-# Up-sampling convolutional network or U-net
+# Up-sampling convolutional network or U-net from the DLWP model zoo
 cs = generator.convolution_shape
 cso = generator.output_convolution_shape
 input_solar = (integration_steps > 1 and (isinstance(add_solar, str) or add_solar))
 
-# Define layers. Must be defined outside of model function so we use the same weights at each integration step.
-main_input = Input(shape=cs, name='main_input')
-if input_solar:
-    solar_inputs = [Input(shape=generator.insolation_shape, name='solar_%d' % d) for d in range(1, integration_steps)]
-if has_constants:
-    constant_input = Input(shape=(6, 48, 48, 2), name='constants')
-cube_padding_1 = CubeSpherePadding2D(1, data_format='channels_last')
-pooling_2 = AveragePooling3D((1, 2, 2), data_format='channels_last')
-up_sampling_2 = UpSampling3D((1, 2, 2), data_format='channels_last')
-relu = ReLU(negative_slope=0.1, max_value=10.)
-conv_kwargs = {
-    'dilation_rate': 1,
-    'padding': 'valid',
-    'activation': 'linear',
-    'data_format': 'channels_last',
-    'independent_north_pole': independent_north_pole,
-    'flip_north_pole': not independent_north_pole
-}
-skip_connections = 'unet' in cnn_model_name.lower()
-conv_2d_1 = CubeSphereConv2D(base_filter_number, 3, **conv_kwargs)
-conv_2d_1_2 = CubeSphereConv2D(base_filter_number, 3, **conv_kwargs)
-conv_2d_1_3 = CubeSphereConv2D(base_filter_number, 3, **conv_kwargs)
-conv_2d_2 = CubeSphereConv2D(base_filter_number * 2, 3, **conv_kwargs)
-conv_2d_2_2 = CubeSphereConv2D(base_filter_number * 2, 3, **conv_kwargs)
-conv_2d_2_3 = CubeSphereConv2D(base_filter_number * 2, 3, **conv_kwargs)
-conv_2d_3 = CubeSphereConv2D(base_filter_number * 4, 3, **conv_kwargs)
-conv_2d_3_2 = CubeSphereConv2D(base_filter_number * 4, 3, **conv_kwargs)
-conv_2d_4 = CubeSphereConv2D(base_filter_number * 4 if skip_connections else base_filter_number * 8, 3, **conv_kwargs)
-conv_2d_4_2 = CubeSphereConv2D(base_filter_number * 8, 3, **conv_kwargs)
-conv_2d_5 = CubeSphereConv2D(base_filter_number * 2 if skip_connections else base_filter_number * 4, 3, **conv_kwargs)
-conv_2d_5_2 = CubeSphereConv2D(base_filter_number * 4, 3, **conv_kwargs)
-conv_2d_5_3 = CubeSphereConv2D(base_filter_number * 4, 3, **conv_kwargs)
-conv_2d_6 = CubeSphereConv2D(base_filter_number if skip_connections else base_filter_number * 2, 3, **conv_kwargs)
-conv_2d_6_2 = CubeSphereConv2D(base_filter_number * 2, 3, **conv_kwargs)
-conv_2d_6_3 = CubeSphereConv2D(base_filter_number * 2, 3, **conv_kwargs)
-conv_2d_7 = CubeSphereConv2D(base_filter_number, 3, **conv_kwargs)
-conv_2d_7_2 = CubeSphereConv2D(base_filter_number, 3, **conv_kwargs)
-conv_2d_7_3 = CubeSphereConv2D(base_filter_number, 3, **conv_kwargs)
-conv_2d_8 = CubeSphereConv2D(cso[-1], 1, name='output', **conv_kwargs)
-
-
-# Define the model functions.
-
-def basic(x):
-    x = cube_padding_1(x)
-    x = relu(conv_2d_1(x))
-    x = pooling_2(x)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_2(x))
-    x = pooling_2(x)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_3(x))
-    x = up_sampling_2(x)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_6(x))
-    x = up_sampling_2(x)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7_2(x))
-    x = conv_2d_8(x)
-    return x
-
-
-def unet(x):
-    x0 = cube_padding_1(x)
-    x0 = relu(conv_2d_1(x0))
-    x1 = pooling_2(x0)
-    x1 = cube_padding_1(x1)
-    x1 = relu(conv_2d_2(x1))
-    x2 = pooling_2(x1)
-    x2 = cube_padding_1(x2)
-    x2 = relu(conv_2d_3(x2))
-    x2 = up_sampling_2(x2)
-    x = concatenate([x2, x1], axis=-1)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_6(x))
-    x = up_sampling_2(x)
-    x = concatenate([x, x0], axis=-1)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7_2(x))
-    x = conv_2d_8(x)
-    return x
-
-
-def unet2(x):
-    x0 = cube_padding_1(x)
-    x0 = relu(conv_2d_1(x0))
-    x0 = cube_padding_1(x0)
-    x0 = relu(conv_2d_1_2(x0))
-    x1 = pooling_2(x0)
-    x1 = cube_padding_1(x1)
-    x1 = relu(conv_2d_2(x1))
-    x1 = cube_padding_1(x1)
-    x1 = relu(conv_2d_2_2(x1))
-    x2 = pooling_2(x1)
-    x2 = cube_padding_1(x2)
-    x2 = relu(conv_2d_5_2(x2))
-    x2 = cube_padding_1(x2)
-    x2 = relu(conv_2d_5(x2))
-    x2 = up_sampling_2(x2)
-    x = concatenate([x2, x1], axis=-1)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_6_2(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_6(x))
-    x = up_sampling_2(x)
-    x = concatenate([x, x0], axis=-1)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7_2(x))
-    x = conv_2d_8(x)
-    return x
-
-
-def unet3(x):
-    x0 = cube_padding_1(x)
-    x0 = relu(conv_2d_1(x0))
-    x0 = cube_padding_1(x0)
-    x0 = relu(conv_2d_1_2(x0))
-    x0 = cube_padding_1(x0)
-    x0 = relu(conv_2d_1_3(x0))
-    x1 = pooling_2(x0)
-    x1 = cube_padding_1(x1)
-    x1 = relu(conv_2d_2(x1))
-    x1 = cube_padding_1(x1)
-    x1 = relu(conv_2d_2_2(x1))
-    x1 = cube_padding_1(x1)
-    x1 = relu(conv_2d_2_3(x1))
-    x2 = pooling_2(x1)
-    x2 = cube_padding_1(x2)
-    x2 = relu(conv_2d_5_3(x2))
-    x2 = cube_padding_1(x2)
-    x2 = relu(conv_2d_5_2(x2))
-    x2 = cube_padding_1(x2)
-    x2 = relu(conv_2d_5(x2))
-    x2 = up_sampling_2(x2)
-    x = concatenate([x2, x1], axis=-1)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_6_3(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_6_2(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_6(x))
-    x = up_sampling_2(x)
-    x = concatenate([x, x0], axis=-1)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7_2(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7_3(x))
-    x = conv_2d_8(x)
-    return x
-
-
-def unet4(x):
-    x0 = cube_padding_1(x)
-    x0 = relu(conv_2d_1(x0))
-    x0 = cube_padding_1(x0)
-    x0 = relu(conv_2d_1_2(x0))
-    x1 = pooling_2(x0)
-    x1 = cube_padding_1(x1)
-    x1 = relu(conv_2d_2(x1))
-    x1 = cube_padding_1(x1)
-    x1 = relu(conv_2d_2_2(x1))
-    x2 = pooling_2(x1)
-    x2 = cube_padding_1(x2)
-    x2 = relu(conv_2d_3_2(x2))
-    x2 = cube_padding_1(x2)
-    x2 = relu(conv_2d_3(x2))
-    x3 = pooling_2(x2)
-    x3 = cube_padding_1(x3)
-    x3 = relu(conv_2d_4_2(x3))
-    x3 = cube_padding_1(x3)
-    x3 = relu(conv_2d_4(x3))
-    x3 = up_sampling_2(x3)
-    x = concatenate([x3, x2], axis=-1)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_5_2(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_5(x))
-    x = up_sampling_2(x)
-    x = concatenate([x, x1], axis=-1)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_6_2(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_6(x))
-    x = up_sampling_2(x)
-    x = concatenate([x, x0], axis=-1)
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7(x))
-    x = cube_padding_1(x)
-    x = relu(conv_2d_7_2(x))
-    x = conv_2d_8(x)
-    return x
-
-
-def complete_model(x_in):
-    outputs = []
-    model_function = globals()[cnn_model_name]
-    is_seq = isinstance(x_in, (list, tuple))
-    xi = x_in[0] if is_seq else x_in
-    if is_seq and has_constants:
-        xi = Concatenate(axis=-1)([xi, x_in[-1]])
-    outputs.append(model_function(xi))
-    for step in range(1, integration_steps):
-        xo = outputs[step - 1]
-        if is_seq and input_solar:
-            xo = Reshape(cs[:-1] + (io_time_steps, -1))(xo)
-            xo = Concatenate(axis=-1)([xo, Permute((2, 3, 4, 1, 5))(x_in[step])])
-            xo = Reshape(cs)(xo)
-        if is_seq and has_constants:
-            xo = Concatenate(axis=-1)([xo, x_in[-1]])
-        outputs.append(model_function(xo))
-
-    return outputs
-
-
-# Build the model with inputs and outputs
-if not input_solar and not has_constants:
-    inputs = main_input
-else:
-    inputs = [main_input]
-    if input_solar:
-        inputs = inputs + solar_inputs
-    if has_constants:
-        inputs = inputs + [constant_input]
-model = Model(inputs=inputs, outputs=complete_model(inputs))
+# Layers are shared between integration steps so that each step uses the same weights
+model = cube_sphere_model(cnn_model_name, cs, cso[-1], base_filter_number=base_filter_number,
+                          integration_steps=integration_steps, time_steps=io_time_steps, insolation=input_solar,
+                          constants=constants.shape[0] if has_constants else 0, data_format='channels_last',
+                          independent_north_pole=independent_north_pole)
 
 # No weighted loss available for cube sphere at the moment, but we can weight each integration sequence
 loss_function = 'mse'
@@ -427,7 +203,8 @@ if loss_by_step is None:
 
 # Build the DLWP model
 opt = tf.train.experimental.enable_mixed_precision_graph_rewrite(Adam()) if use_mp_optimizer else Adam()
-dlwp.build_model(model, loss=loss_function, loss_weights=loss_by_step, optimizer=opt, metrics=['mae'], gpus=n_gpu)
+dlwp.build_model(model, loss=loss_function, loss_weights=loss_by_step, optimizer=opt, metrics=['mae'],
+                 strategy=strategy)
 print(dlwp.base_model.summary())
 
 
@@ -18,7 +18,7 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 from datetime import datetime
-from DLWP.model import DLWPNeuralNet, SeriesDataGenerator
+from DLWP.model import DLWPNeuralNet, SeriesDataGenerator, generator_moments
 from DLWP.util import save_model, train_test_split_ind
 from DLWP.custom import RNNResetStates, EarlyStoppingMin, latitude_weighted_loss, RunHistory, anomaly_correlation_loss
 
@@ -344,12 +344,11 @@ layers = (
 
 # Example custom loss function: pass to loss= in build_model()
 if acc_loss:
-    # Generate the data to fit the scaler. The generator will by default apply scaling because it is necessary
-    # to automate its use in the Keras fit_generator method, so disable it when dealing with data to fit the scaler
+    # Stream the unscaled targets through the generator one batch at a time, so that the training set never needs to
+    # be in memory at once, to find the mean of each target feature
     print('Finding climatology for ACC loss...')
-    p_fit, t_fit = generator.generate([], scale_and_impute=False)
-    climo = t_fit.mean(axis=0, keepdims=True)
-    p_fit, t_fit = (None, None)
+    _, t_moments = generator_moments(generator, predictors=False, n_jobs=4)
+    climo = t_moments.mean.reshape((1,) + t_moments.shape).astype(np.float32)
     loss_function = anomaly_correlation_loss(climo, regularize_mean='mse', reverse=True)
 else:
     loss_function = mean_squared_error
@@ -0,0 +1,136 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Benchmark the accuracy and cost of the time integrators of DLWP.barotropic.BarotropicModel.
+
+The model is initialized with a wavenumber-4 Rossby-Haurwitz wave (the model's z is the field whose spectral Laplacian
+is the relative vorticity, so the wave is given as a streamfunction) or with the first field of a netCDF file, and run
+for `--hours` with every combination of integrator and time step. Each forecast is compared with a reference forecast
+made with RK4 and a small time step. The script reports, for each run:
+
+    - the wall-clock time per simulated day
+    - the RMSE and maximum error of z against the reference at the end of the run
+    - whether the run remained stable (finite)
+
+Plotting the error against the cost gives the accuracy-vs-cost frontier of the integrators. Run from the repository
+root:
+
+    python Benchmarks/barotropic.py --integrators leapfrog rk3 rk4 --dts 900 1800 3600 --output barotropic.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DLWP.barotropic import BarotropicModel
+
+
+#%% Parse user arguments
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--integrators', nargs='+', choices=['leapfrog', 'rk3', 'rk4'], default=['leapfrog', 'rk3', 'rk4'],
+                    help='Time integrators to benchmark')
+parser.add_argument('--dts', nargs='+', type=float, default=[600., 1200., 1800., 3600., 5400.],
+                    help='Time steps in seconds')
+parser.add_argument('--hours', type=float, default=72.,
+                    help='Length of the forecasts in hours; must be a multiple of every time step')
+parser.add_argument('--reference-dt', type=float, dest='reference_dt', default=150.,
+                    help='Time step of the RK4 reference forecast')
+parser.add_argument('--nlat', type=int, default=73,
+                    help='Number of latitudes of the regular model grid')
+parser.add_argument('--truncation', type=int, default=None,
+                    help='Spectral truncation (default: nlon // 3)')
+parser.add_argument('--input', type=str, default=None,
+                    help='netCDF file with a (lat, lon) field, or a (time, lat, lon) field of which the first is used, '
+                         'as initial condition instead of the Rossby-Haurwitz wave')
+parser.add_argument('--variable', type=str, default='z',
+                    help='Variable in the input file')
+parser.add_argument('--output', type=str, default=None,
+                    help='Write the results as JSON to this file')
+args = parser.parse_args()
+
+
+#%% Initial condition
+
+def rossby_haurwitz(nlat, nlon, radius=6371200., omega=7.848e-6, amplitude=7.848e-6, wavenumber=4):
+    lat = np.deg2rad(np.linspace(90., -90., nlat))[:, np.newaxis]
+    lon = np.deg2rad(np.arange(0., 360., 360. / nlon))[np.newaxis, :]
+    return radius ** 2. * (-omega * np.sin(lat) + amplitude * np.cos(lat) ** wavenumber * np.sin(lat) *
+                           np.cos(wavenumber * lon))
+
+
+if args.input is not None:
+    import xarray as xr
+    with xr.open_dataset(args.input) as ds:
+        z0 = ds[args.variable]
+        while z0.ndim > 2:
+            z0 = z0[0]
+        z0 = z0.values.astype(np.float64)
+else:
+    z0 = rossby_haurwitz(args.nlat, 2 * (args.nlat - 1))
+nlat, nlon = z0.shape
+truncation = args.truncation or nlon // 3
+seconds = args.hours * 3600.
+start = datetime(2000, 1, 1)
+
+
+def run(integrator, dt, engine=None):
+    n_steps = int(round(seconds / dt))
+    if abs(n_steps * dt - seconds) > 1e-6:
+        raise ValueError('--hours must be a multiple of the time step %s' % dt)
+    model = BarotropicModel(z0, truncation, dt, start, integrator=integrator, engine=engine)
+    begin = time.perf_counter()
+    with np.errstate(all='ignore'):
+        for _ in range(n_steps):
+            model.step_forward()
+    elapsed = time.perf_counter() - begin
+    return model, elapsed
+
+
+#%% Run the benchmark
+
+reference, _ = run('rk4', args.reference_dt)
+engine = reference.engine
+z_reference = reference.z_grid.copy()
+scale = np.sqrt(np.mean((z_reference - np.mean(z_reference)) ** 2.))
+
+results = []
+print('grid %dx%d, truncation T%d, %g hours, reference RK4 dt=%g s' % (nlat, nlon, truncation, args.hours,
+                                                                       args.reference_dt))
+for integrator in args.integrators:
+    for dt in args.dts:
+        model, elapsed = run(integrator, dt, engine=engine)
+        error = model.z_grid - z_reference
+        stable = bool(np.all(np.isfinite(model.z_grid)))
+        result = {
+            'integrator': integrator,
+            'dt': dt,
+            'steps': int(round(seconds / dt)),
+            'seconds_per_day': elapsed * 86400. / seconds,
+            'rmse': float(np.sqrt(np.mean(error ** 2.))) if stable else None,
+            'max_error': float(np.max(np.abs(error))) if stable else None,
+            'relative_rmse': float(np.sqrt(np.mean(error ** 2.)) / scale) if stable else None,
+            'stable': stable,
+        }
+        results.append(result)
+        if stable:
+            print('%-8s dt=%6g s  %8.3f s/day  rmse %10.4g  max %10.4g  relative %8.2e' % (
+                integrator, dt, result['seconds_per_day'], result['rmse'], result['max_error'],
+                result['relative_rmse']))
+        else:
+            print('%-8s dt=%6g s  %8.3f s/day  unstable' % (integrator, dt, result['seconds_per_day']))
+
+if args.output is not None:
+    with open(args.output, 'w') as f:
+        json.dump({'python': sys.version, 'grid': [nlat, nlon], 'truncation': truncation, 'hours': args.hours,
+                   'reference_dt': args.reference_dt, 'results': results}, f, indent=2)
@@ -0,0 +1,324 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Benchmark the throughput and memory use of the DLWP data generators on synthetic predictor datasets.
+
+Predictor files are synthesised in both the lat-lon layout (varlev, lat, lon) and the cubed-sphere layout (varlev, face,
+height, width) at CS24, CS48 and CS96 resolution, written to netCDF in a temporary directory and read back by the
+generators exactly as a training script would. Every configuration runs in a fresh interpreter so that the peak
+resident memory reported for it is not polluted by earlier runs. For each configuration the script reports:
+
+    - batches/sec and samples/sec, timed over a full pass of `--batches` batches after one warm-up batch
+    - peak resident set size (RSS) of the process
+    - peak bytes allocated by Python/NumPy while generating one batch (via tracemalloc), averaged over a few batches
+
+By default one option at a time is varied from a baseline configuration (lat-lon, load='required', no sequence,
+insolation or constants, channels first); use --full for the complete cross product. Run from the repository root:
+
+    python Benchmarks/generators.py --grids latlon cs48 --output generators.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+#%% Options
+
+grid_options = ['latlon', 'cs24', 'cs48', 'cs96']
+generator_options = ['SeriesDataGenerator', 'ArrayDataGenerator', 'DataGenerator', 'tf_data_generator']
+load_options = ['full', 'required', 'minimal', 'none']
+baseline = {
+    'grid': 'latlon',
+    'generator': 'SeriesDataGenerator',
+    'load': 'required',
+    'channels_last': False,
+    'sequence': None,
+    'add_insolation': False,
+    'constants': False,
+}
+variations = {
+    'load': load_options,
+    'channels_last': [True],
+    'sequence': [2],
+    'add_insolation': [True],
+    'constants': [True],
+}
+
+
+#%% Synthetic data
+
+def synthetic_dataset(grid, n_sample, n_varlev, latlon_shape=(91, 180)):
+    """
+    Create a predictor dataset of random data in the layout written by DLWP.model.Preprocessor (lat-lon) or
+    DLWP.remap.CubeSphereRemap (cubed sphere).
+
+    :param grid: str: 'latlon' or 'csN' for a cubed sphere with N x N points per face
+    :param n_sample: int: number of time steps
+    :param n_varlev: int: number of variable/level pairs
+    :param latlon_shape: tuple: (lat, lon) size of the lat-lon grid
+    :return: xarray Dataset, rank of the spatial dimensions
+    """
+    import numpy as np
+    import xarray as xr
+
+    rng = np.random.RandomState(0)
+    times = np.datetime64('2000-01-01T00') + np.arange(n_sample) * np.timedelta64(6, 'h')
+    varlev = ['VAR%d/%d' % (v, 500) for v in range(n_varlev)]
+    if grid == 'latlon':
+        lat = np.linspace(90., -90., latlon_shape[0])
+        lon = np.linspace(0., 360., latlon_shape[1], endpoint=False)
+        spatial_dims = ['lat', 'lon']
+        shape = (n_sample, n_varlev) + tuple(latlon_shape)
+        coords = {'lat': lat, 'lon': lon}
+    elif grid.startswith('cs'):
+        n = int(grid[2:])
+        # Approximate equiangular face coordinates; only the shapes matter for the generators
+        alpha = np.linspace(-45., 45., n)
+        lon_face = np.broadcast_to(alpha[None, :], (n, n))
+        lat_face = np.broadcast_to(alpha[:, None], (n, n))
+        lat = np.stack([lat_face] * 4 + [lat_face * 0.5 - 67.5, 67.5 - lat_face * 0.5])
+        lon = np.stack([(lon_face + 90. * f) % 360. for f in range(4)] + [lon_face % 360.] * 2)
+        spatial_dims = ['face', 'height', 'width']
+        shape = (n_sample, n_varlev, 6, n, n)
+        coords = {'face': np.arange(6), 'height': np.arange(n), 'width': np.arange(n)}
+    else:
+        raise ValueError("unknown grid '%s'" % grid)
+
+    data = rng.standard_normal(shape).astype(np.float32)
+    ds = xr.Dataset({'predictors': (['sample', 'varlev'] + spatial_dims, data)},
+                    coords=dict(coords, sample=times, varlev=varlev))
+    if grid != 'latlon':
+        ds['lat'] = (spatial_dims, lat.astype(np.float32))
+        ds['lon'] = (spatial_dims, lon.astype(np.float32))
+    return ds, len(spatial_dims)
+
+
+#%% Single configuration, run in a child process
+
+class PassThroughModel(object):
+    """
+    Stands in for DLWPFunctional, which does no scaling or imputing, without building a Keras model.
+    """
+    is_convolutional = True
+    is_recurrent = False
+    impute = False
+
+    def scaler_transform(self, X, y=None):
+        if y is not None:
+            return X, y
+        else:
+            return X
+
+
+def run_single(config, options):
+    import resource
+    import time
+    import tracemalloc
+    import numpy as np
+    import xarray as xr
+    from DLWP.model.generators import DataGenerator, SeriesDataGenerator, ArrayDataGenerator, tf_data_generator
+    from DLWP.util import insolation
+
+    ds, rank = synthetic_dataset(config['grid'], options['samples'], options['varlev'])
+    work_dir = tempfile.mkdtemp(prefix='dlwp_bench_')
+    file = os.path.join(work_dir, 'predictors.nc')
+    ds.to_netcdf(file)
+    del ds
+
+    if config['load'] == 'none':
+        ds = xr.open_dataset(file, chunks={'sample': options['chunk']})
+    else:
+        ds = xr.open_dataset(file)
+    spatial_shape = ds.predictors.shape[2:]
+    constants = np.ones((2,) + spatial_shape, dtype=np.float32) if config['constants'] else None
+    model = PassThroughModel()
+    batch_size = options['batch_size']
+    start = time.perf_counter()
+
+    if config['generator'] in ['SeriesDataGenerator', 'tf_data_generator']:
+        load = config['load'] if config['load'] != 'none' else False
+        generator = SeriesDataGenerator(model, ds, rank=rank, input_time_steps=2, output_time_steps=2,
+                                        sequence=config['sequence'], add_insolation=config['add_insolation'],
+                                        batch_size=batch_size, load=load, constants=constants,
+                                        channels_last=config['channels_last'],
+                                        cache_chunks=options['cache_chunks'] if not load else None)
+    elif config['generator'] == 'ArrayDataGenerator':
+        if config['load'] == 'none':
+            import netCDF4 as nc
+            array = nc.Dataset(file).variables['predictors']
+        else:
+            array = ds.predictors.values
+        insol = None
+        if config['add_insolation']:
+            insol = insolation(ds.sample.values, ds.lat.values, ds.lon.values)
+        generator = ArrayDataGenerator(model, array, rank=rank, batch_size=batch_size, input_time_steps=2,
+                                       output_time_steps=2, sequence=config['sequence'], insolation_array=insol,
+                                       constants=constants, channels_last=config['channels_last'])
+    elif config['generator'] == 'DataGenerator':
+        # DataGenerator takes samples that are already paired; build them as Preprocessor.data_to_samples would
+        if config['load'] != 'none':
+            ds.load()
+        samples = xr.Dataset({
+            'predictors': ds.predictors.isel(sample=slice(0, -1)),
+            'targets': ds.predictors.isel(sample=slice(1, None)).assign_coords(
+                sample=ds.sample.values[:-1]),
+        })
+        generator = DataGenerator(model, samples, batch_size=batch_size)
+    else:
+        raise ValueError("unknown generator '%s'" % config['generator'])
+    setup_seconds = time.perf_counter() - start
+    n_batches = min(options['batches'], len(generator))
+
+    # Timing pass; tf_data_generator iterates a tf.data.Dataset, the others index the Sequence
+    if config['generator'] == 'tf_data_generator':
+        dataset = iter(tf_data_generator(generator))
+        next(dataset)
+        start = time.perf_counter()
+        for b in range(n_batches):
+            next(dataset)
+        elapsed = time.perf_counter() - start
+    else:
+        generator[0]
+        start = time.perf_counter()
+        for b in range(n_batches):
+            generator[b]
+        elapsed = time.perf_counter() - start
+
+    # Allocation pass
+    alloc = []
+    if config['generator'] != 'tf_data_generator':
+        tracemalloc.start()
+        for b in range(min(options['alloc_batches'], n_batches)):
+            tracemalloc.clear_traces()
+            base = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            generator[b]
+            alloc.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+
+    # ru_maxrss is in kB on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+
+    ds.close()
+    try:
+        os.remove(file)
+        os.rmdir(work_dir)
+    except OSError:
+        pass
+
+    return {
+        'setup_seconds': setup_seconds,
+        'batches': n_batches,
+        'batches_per_second': n_batches / elapsed,
+        'samples_per_second': n_batches * batch_size / elapsed,
+        'peak_rss_mb': max_rss / 1024. ** 2,
+        'alloc_peak_mb_per_batch': float(np.mean(alloc)) / 1024. ** 2 if len(alloc) > 0 else None,
+    }
+
+
+#%% Parse user arguments
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--grids', nargs='+', choices=grid_options, default=['latlon', 'cs24', 'cs48', 'cs96'],
+                    help='Data layouts/resolutions to benchmark')
+parser.add_argument('--generators', nargs='+', choices=generator_options, default=generator_options[:3],
+                    help='Generators to benchmark. tf_data_generator wraps a SeriesDataGenerator.')
+parser.add_argument('--full', action='store_true',
+                    help='Benchmark the full cross product of options instead of one option at a time')
+parser.add_argument('--samples', type=int, default=512,
+                    help='Number of time steps in the synthetic dataset')
+parser.add_argument('--varlev', type=int, default=4,
+                    help='Number of variable/level pairs in the synthetic dataset')
+parser.add_argument('--batch-size', type=int, dest='batch_size', default=32,
+                    help='Batch size')
+parser.add_argument('--batches', type=int, default=10,
+                    help='Number of batches to time for each configuration')
+parser.add_argument('--alloc-batches', type=int, dest='alloc_batches', default=3,
+                    help='Number of batches to trace allocations for each configuration')
+parser.add_argument('--chunk', type=int, default=64,
+                    help='Sample chunk size when the data are not loaded to memory')
+parser.add_argument('--cache-chunks', type=int, dest='cache_chunks', default=4,
+                    help='Number of chunks cached by SeriesDataGenerator when the data are not loaded to memory')
+parser.add_argument('--output', type=str, default=None,
+                    help='Write the results as JSON to this file')
+parser.add_argument('--single', type=str, default=None,
+                    help=argparse.SUPPRESS)
+args = parser.parse_args()
+options = {k: getattr(args, k) for k in ['samples', 'varlev', 'batch_size', 'batches', 'alloc_batches', 'chunk',
+                                         'cache_chunks']}
+
+if args.single is not None:
+    print(json.dumps(run_single(json.loads(args.single), options)))
+    sys.exit(0)
+
+
+#%% Build the list of configurations
+
+configs = []
+for grid, generator in itertools.product(args.grids, args.generators):
+    if args.full:
+        for values in itertools.product(*[[baseline[k]] + variations[k] for k in variations]):
+            configs.append(dict(baseline, grid=grid, generator=generator, **dict(zip(variations.keys(), values))))
+    else:
+        configs.append(dict(baseline, grid=grid, generator=generator))
+        for key, values in variations.items():
+            for value in values:
+                if value != baseline[key]:
+                    configs.append(dict(baseline, grid=grid, generator=generator, **{key: value}))
+
+# DataGenerator has no sequence, insolation, constants or layout options
+configs = [c for c in configs if c['generator'] != 'DataGenerator' or
+           (c['sequence'] is None and not c['add_insolation'] and not c['constants'] and not c['channels_last'])]
+# ArrayDataGenerator and DataGenerator only distinguish in-memory from on-disk data
+for c in configs:
+    if c['generator'] in ['ArrayDataGenerator', 'DataGenerator'] and c['load'] != 'none':
+        c['load'] = 'full'
+# Remove duplicates left by the filters
+configs = [dict(t) for t in dict.fromkeys(tuple(sorted(c.items())) for c in configs)]
+
+
+#%% Run the benchmark
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+env = dict(os.environ)
+env['PYTHONPATH'] = os.pathsep.join([repo_root] + [p for p in [env.get('PYTHONPATH')] if p])
+
+results = []
+for config in configs:
+    command = [sys.executable, os.path.abspath(__file__), '--single', json.dumps(config)]
+    for key, value in options.items():
+        command += ['--%s' % key.replace('_', '-'), str(value)]
+    proc = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = dict(config)
+    if proc.returncode == 0:
+        result.update(json.loads(proc.stdout.decode().strip().split('\n')[-1]))
+        result['error'] = None
+    else:
+        result['error'] = proc.stderr.decode().strip().split('\n')[-1]
+    results.append(result)
+    label = '%-20s %-7s load=%-8s cl=%-5s seq=%-4s insol=%-5s const=%-5s' % (
+        config['generator'], config['grid'], config['load'], config['channels_last'], config['sequence'],
+        config['add_insolation'], config['constants'])
+    if result['error'] is None:
+        alloc = result['alloc_peak_mb_per_batch']
+        print('%s %8.2f batch/s  rss %8.1f MB  alloc/batch %s' % (
+            label, result['batches_per_second'], result['peak_rss_mb'],
+            '%8.1f MB' % alloc if alloc is not None else '       -'))
+    else:
+        print('%s  [%s]' % (label, result['error']))
+
+if args.output is not None:
+    with open(args.output, 'w') as f:
+        json.dump({'python': sys.version, 'options': options, 'results': results}, f, indent=2)
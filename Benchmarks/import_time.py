@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Benchmark the cold-start import time of the DLWP sub-packages.
+
+Each import is timed in a fresh interpreter, so the numbers reflect what a short-lived verification or preprocessing
+process pays at start-up. The script also reports which heavy backends (TensorFlow, PyTorch, netCDF4, ...) each
+import pulls in. Run from the repository root:
+
+    python Benchmarks/import_time.py --repeat 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+#%% Parse user arguments
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--repeat', type=int, default=5,
+                    help='Number of fresh interpreters to launch per import statement')
+parser.add_argument('--output', type=str, default=None,
+                    help='Write the results as JSON to this file')
+args = parser.parse_args()
+
+statements = [
+    'import DLWP',
+    'import DLWP.util',
+    'import DLWP.verify',
+    'import DLWP.model',
+    'from DLWP.model import Preprocessor',
+    'import DLWP.data',
+    'import DLWP.remap',
+    'from DLWP.model import SeriesDataGenerator',
+]
+backends = ['tensorflow', 'torch', 'netCDF4', 'xarray', 'pandas', 'cdsapi', 'pygrib', 'matplotlib']
+
+# Code executed in each child interpreter: time the statement and list the heavy modules it imported
+child_code = """
+import sys, time, json
+start = time.perf_counter()
+error = None
+try:
+    exec(%r)
+except Exception as e:
+    error = '%%s: %%s' %% (type(e).__name__, e)
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'error': error, 'loaded': [b for b in %r if b in sys.modules]}))
+"""
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+env = dict(os.environ)
+env['PYTHONPATH'] = os.pathsep.join([repo_root] + [p for p in [env.get('PYTHONPATH')] if p])
+
+
+#%% Run the benchmark
+
+results = []
+for statement in statements:
+    times = []
+    info = {}
+    for r in range(args.repeat):
+        out = subprocess.check_output([sys.executable, '-c', child_code % (statement, backends)], env=env)
+        info = json.loads(out.decode().strip().split('\n')[-1])
+        times.append(info['seconds'])
+    times.sort()
+    result = {
+        'statement': statement,
+        'median_seconds': times[len(times) // 2],
+        'min_seconds': times[0],
+        'backends_loaded': info['loaded'],
+        'error': info['error'],
+    }
+    results.append(result)
+    print('%-45s %8.3f s (min %8.3f s)  loads: %s%s' % (statement, result['median_seconds'], result['min_seconds'],
+                                                       ', '.join(info['loaded']) or '-',
+                                                       '  [%s]' % info['error'] if info['error'] else ''))
+
+if args.output is not None:
+    with open(args.output, 'w') as f:
+        json.dump({'python': sys.version, 'repeat': args.repeat, 'results': results}, f, indent=2)
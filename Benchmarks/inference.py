@@ -0,0 +1,216 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Benchmark the CPU inference latency, throughput and memory of the cubed-sphere architectures in DLWP.model.zoo.
+
+For each combination of backend (Keras or PyTorch), architecture, face size, batch size and data format, a model with
+random weights is built in a fresh interpreter and timed for:
+
+    - a single step: the median time of one forward pass over a batch
+    - an N-step rollout: forward passes fed back into the model, with new insolation added to the inputs at every step
+      as the TimeSeriesEstimator does
+
+The script reports the analytic FLOPs per sample and step, ms/step, samples/sec, achieved GFLOP/s, and the peak
+resident memory of the process. GPUs are hidden from the child processes. The PyTorch models only support
+channels_first data. Run from the repository root:
+
+    python Benchmarks/inference.py --models unet2 unet4 --faces 48 --batch-sizes 1 16 --output inference.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+
+
+#%% Single configuration, run in a child process
+
+def run_single(config, options):
+    import resource
+    import time
+    import numpy as np
+    from DLWP.model.zoo import cube_sphere_complexity
+
+    n = config['face_size']
+    batch_size = config['batch_size']
+    channels_last = config['data_format'] == 'channels_last'
+    time_steps = options['time_steps']
+    variables = options['variables']
+    in_channels = time_steps * (variables + 1)
+    out_channels = time_steps * variables
+    n_constants = options['constants']
+    complexity = cube_sphere_complexity(config['model'], in_channels + n_constants, out_channels, n,
+                                        base_filter_number=options['filters'])
+
+    def layout(a):
+        # Arrays are generated channels_first as (batch, channels, 6, n, n)
+        return np.ascontiguousarray(a.transpose(0, 2, 3, 4, 1)) if channels_last else a
+
+    rng = np.random.RandomState(0)
+    x = layout(rng.standard_normal((batch_size, in_channels, 6, n, n)).astype(np.float32))
+    constants = layout(rng.standard_normal((batch_size, n_constants, 6, n, n)).astype(np.float32))
+    insolation = layout(rng.uniform(size=(batch_size, time_steps, 6, n, n)).astype(np.float32))
+
+    def feedback(out):
+        # Interleave new insolation with each output time step, as the inputs are ordered (time_step, variable)
+        if channels_last:
+            out = out.reshape(out.shape[:-1] + (time_steps, variables))
+            return np.concatenate([out, insolation[..., None]], axis=-1).reshape(out.shape[:-2] + (-1,))
+        out = out.reshape((out.shape[0], time_steps, variables) + out.shape[2:])
+        return np.concatenate([out, insolation[:, :, None]], axis=2).reshape((out.shape[0], -1) + out.shape[3:])
+
+    if config['backend'] == 'keras':
+        import tensorflow as tf
+        from DLWP.model.zoo import cube_sphere_model
+        if options['threads'] is not None:
+            tf.config.threading.set_intra_op_parallelism_threads(options['threads'])
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        model = cube_sphere_model(config['model'], x.shape[1:], out_channels, base_filter_number=options['filters'],
+                                  constants=n_constants, data_format=config['data_format'])
+        call = tf.function(lambda a, c: model([a, c], training=False) if n_constants > 0 else model(a, training=False))
+
+        def step(a):
+            return call(tf.constant(a), tf.constant(constants)).numpy()
+
+    elif config['backend'] == 'torch':
+        import torch
+        from DLWP.model.zoo_torch import TorchCubeSphereNet
+        if options['threads'] is not None:
+            torch.set_num_threads(options['threads'])
+        model = TorchCubeSphereNet(config['model'], in_channels, out_channels, base_filter_number=options['filters'],
+                                   constants=n_constants).eval()
+        constants_tensor = torch.from_numpy(constants)
+
+        def step(a):
+            with torch.no_grad():
+                return model(torch.from_numpy(a), constants_tensor).numpy()
+
+    else:
+        raise ValueError("unknown backend '%s'" % config['backend'])
+
+    # Warm up (graph tracing, memory allocation)
+    step(x)
+    build_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Single step
+    times = []
+    for r in range(options['repeat']):
+        start = time.perf_counter()
+        step(x)
+        times.append(time.perf_counter() - start)
+    single = float(np.median(times))
+
+    # Rollout
+    times = []
+    for r in range(max(1, options['repeat'] // 4)):
+        start = time.perf_counter()
+        a = x
+        for s in range(options['rollout']):
+            a = feedback(step(a))
+        times.append(time.perf_counter() - start)
+    rollout = float(np.median(times)) / options['rollout']
+
+    # ru_maxrss is in kB on Linux and bytes on macOS
+    scale = 1. if sys.platform == 'darwin' else 1024.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'parameters': complexity['parameters'],
+        'gflops_per_sample': complexity['flops'] / 1e9,
+        'single_ms_per_step': single * 1e3,
+        'single_samples_per_second': batch_size / single,
+        'single_gflops_per_second': complexity['flops'] * batch_size / single / 1e9,
+        'rollout_ms_per_step': rollout * 1e3,
+        'rollout_samples_per_second': batch_size / rollout,
+        'peak_rss_mb': max_rss * scale / 1024. ** 2,
+        'warmup_rss_mb': build_rss * scale / 1024. ** 2,
+    }
+
+
+#%% Parse user arguments
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--backends', nargs='+', choices=['keras', 'torch'], default=['keras', 'torch'],
+                    help='Deep learning backends to benchmark')
+parser.add_argument('--models', nargs='+', choices=['basic', 'unet', 'unet2', 'unet3', 'unet4'],
+                    default=['unet', 'unet2', 'unet4'],
+                    help='Architectures from DLWP.model.zoo')
+parser.add_argument('--faces', nargs='+', type=int, default=[24, 48, 96],
+                    help='Number of points along each side of a cube face; must be divisible by 8 for unet4')
+parser.add_argument('--batch-sizes', nargs='+', type=int, dest='batch_sizes', default=[1, 8, 32],
+                    help='Batch sizes')
+parser.add_argument('--data-formats', nargs='+', choices=['channels_first', 'channels_last'], dest='data_formats',
+                    default=['channels_first', 'channels_last'],
+                    help='Data formats; the PyTorch models are only run channels_first')
+parser.add_argument('--filters', type=int, default=32,
+                    help='Base number of filters of the models')
+parser.add_argument('--variables', type=int, default=4,
+                    help='Number of predicted variables')
+parser.add_argument('--time-steps', type=int, dest='time_steps', default=2,
+                    help='Number of input/output time steps of the models')
+parser.add_argument('--constants', type=int, default=2,
+                    help='Number of constant input fields')
+parser.add_argument('--rollout', type=int, default=8,
+                    help='Number of steps in the rollout benchmark')
+parser.add_argument('--repeat', type=int, default=8,
+                    help='Number of timed single steps for each configuration')
+parser.add_argument('--threads', type=int, default=None,
+                    help='Number of intra-op threads for the backend (default: backend default)')
+parser.add_argument('--output', type=str, default=None,
+                    help='Write the results as JSON to this file')
+parser.add_argument('--single', type=str, default=None,
+                    help=argparse.SUPPRESS)
+args = parser.parse_args()
+options = {k: getattr(args, k) for k in ['filters', 'variables', 'time_steps', 'constants', 'rollout', 'repeat',
+                                         'threads']}
+
+if args.single is not None:
+    print(json.dumps(run_single(json.loads(args.single), options)))
+    sys.exit(0)
+
+
+#%% Run the benchmark
+
+configs = [{'backend': b, 'model': m, 'face_size': f, 'batch_size': s, 'data_format': d}
+           for b, m, f, s, d in itertools.product(args.backends, args.models, args.faces, args.batch_sizes,
+                                                  args.data_formats)
+           if not (b == 'torch' and d == 'channels_last')]
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+env = dict(os.environ)
+env['PYTHONPATH'] = os.pathsep.join([repo_root] + [p for p in [env.get('PYTHONPATH')] if p])
+env['CUDA_VISIBLE_DEVICES'] = ''
+env.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+results = []
+for config in configs:
+    command = [sys.executable, os.path.abspath(__file__), '--single', json.dumps(config)]
+    for key, value in options.items():
+        if value is not None:
+            command += ['--%s' % key.replace('_', '-'), str(value)]
+    proc = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = dict(config)
+    if proc.returncode == 0:
+        result.update(json.loads(proc.stdout.decode().strip().split('\n')[-1]))
+        result['error'] = None
+    else:
+        result['error'] = proc.stderr.decode().strip().split('\n')[-1]
+    results.append(result)
+    label = '%-6s %-6s face=%-3d batch=%-4d %-14s' % (config['backend'], config['model'], config['face_size'],
+                                                       config['batch_size'], config['data_format'])
+    if result['error'] is None:
+        print('%s %7.2f GFLOP/sample  step %9.2f ms  rollout %9.2f ms/step  %8.1f samples/s  rss %8.1f MB' % (
+            label, result['gflops_per_sample'], result['single_ms_per_step'], result['rollout_ms_per_step'],
+            result['rollout_samples_per_second'], result['peak_rss_mb']))
+    else:
+        print('%s  [%s]' % (label, result['error']))
+
+if args.output is not None:
+    with open(args.output, 'w') as f:
+        json.dump({'python': sys.version, 'cpu_count': os.cpu_count(), 'options': options, 'results': results}, f,
+                  indent=2)
@@ -1,7 +1,7 @@
 """
 A package for building and running simple atmospheric models.
 The package contains code for a spectral barotropic model, with spectral
-transforms provided by pyspharm. It also provides code for writing model
+transforms provided by pyspharm or, if it is not installed, by NumPy. It also provides code for writing model
 state to NetCDF files.
 """
 # (c) Copyright 2016 Andrew Dawson.
@@ -25,3 +25,5 @@ state to NetCDF files.
 from __future__ import (absolute_import, division, print_function)  #noqa
 
 from .model import BarotropicModel, BarotropicModelPsi
+from .hindcast import run_hindcast
+from .numpy_transforms import NumpyTransformsEngine
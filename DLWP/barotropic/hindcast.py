@@ -0,0 +1,124 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Process-parallel hindcasts with the barotropic model, for baseline forecasts over many initialization dates.
+
+Initialization dates are distributed over a pool of worker processes. Each worker constructs the spectral transforms
+engine once and reuses it for every model it runs. The forecasts are returned, or streamed to handlers such as
+DLWP.model.ForecastWriter or DLWP.verify.OnlineScorer, as DataArrays with the same (f_hour, time, lat, lon) layout as
+the forecasts of DLWP.model.TimeSeriesEstimator, so that they can be verified by the same code.
+"""
+
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .model import BarotropicModel, TransformsEngine
+
+# Transforms engine and model settings of a worker process
+_worker = {}
+
+
+def _init_worker(model_class, nlon, nlat, truncation, model_kwargs):
+    _worker['model_class'] = model_class
+    _worker['engine'] = TransformsEngine(nlon, nlat, truncation)
+    _worker['truncation'] = truncation
+    _worker['model_kwargs'] = model_kwargs
+
+
+def _run_init(args):
+    """
+    Run the model from one initial state and return the height at each snapshot.
+    """
+    z, start_time, dt, n_snapshots, snapshot_interval, dtype = args
+    model = _worker['model_class'](z, _worker['truncation'], dt, start_time, engine=_worker['engine'],
+                                   **_worker['model_kwargs'])
+    result = np.empty((n_snapshots,) + z.shape, dtype=dtype)
+    # Step explicitly, as BarotropicModelPsi has no run_with_snapshots
+    steps_per_snapshot = int(round(snapshot_interval / dt))
+    for n in range(n_snapshots):
+        for _ in range(steps_per_snapshot):
+            model.step_forward()
+        result[n] = model.z_grid
+    return result
+
+
+def run_hindcast(z, forecast_hours, dt, truncation=None, snapshot_interval=6, handlers=None, n_workers=None,
+                 model_class=BarotropicModel, dtype=np.float32, **model_kwargs):
+    """
+    Run barotropic model forecasts from many initial states in parallel processes.
+
+    :param z: DataArray: initial height fields with dimensions ('time' or 'sample', 'lat', 'lon'), on the global
+        regular grid of the model (latitudes from north to south)
+    :param forecast_hours: int: length of the forecasts in hours
+    :param dt: float: model time step in seconds
+    :param truncation: int: spectral truncation of the model; defaults to nlon // 3
+    :param snapshot_interval: int: interval in hours between forecast outputs; must be a multiple of dt
+    :param handlers: callable or list of callables: if given, stream the forecasts instead of returning them. Each
+        handler is called with the DataArray of each forecast, with dimensions (f_hour, time, lat, lon) and a time
+        dimension of length 1, in order of initialization time.
+    :param n_workers: int: number of worker processes; defaults to the number of CPUs. If 0, run in this process.
+    :param model_class: class: BarotropicModel or BarotropicModelPsi
+    :param dtype: data type of the output
+    :param model_kwargs: passed to model_class, e.g. robert_coefficient, damping_coefficient
+    :return: DataArray: forecasts with dimensions (f_hour, time, lat, lon), or None if handlers are given
+    """
+    if not isinstance(z, xr.DataArray):
+        raise TypeError("'z' must be an xarray DataArray")
+    time_dim = 'sample' if 'sample' in z.dims else 'time'
+    if tuple(z.dims) != (time_dim, 'lat', 'lon'):
+        raise ValueError("'z' must have dimensions ('time' or 'sample', 'lat', 'lon'); got %s" % (z.dims,))
+    if snapshot_interval * 3600. % dt != 0:
+        raise ValueError("'snapshot_interval' must be a multiple of the time step 'dt'")
+    n_snapshots = int(forecast_hours // snapshot_interval)
+    if n_snapshots < 1:
+        raise ValueError("'forecast_hours' must be at least 'snapshot_interval'")
+    if handlers is not None and not isinstance(handlers, (list, tuple)):
+        handlers = [handlers]
+    nlat, nlon = z.sizes['lat'], z.sizes['lon']
+    truncation = truncation or nlon // 3
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+
+    init_times = z[time_dim].values
+    f_hour = np.arange(1, n_snapshots + 1) * float(snapshot_interval)
+    tasks = ((z.isel(**{time_dim: t}).values.astype(np.float64), pd.Timestamp(init_times[t]).to_pydatetime(), dt,
+              n_snapshots, snapshot_interval * 3600., dtype) for t in range(len(init_times)))
+    init_args = (model_class, nlon, nlat, truncation, model_kwargs)
+
+    if n_workers == 0:
+        _init_worker(*init_args)
+        pool = None
+        results = map(_run_init, tasks)
+    else:
+        pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=init_args)
+        results = pool.imap(_run_init, tasks)
+
+    forecasts = []
+    try:
+        for t, result in enumerate(results):
+            forecast = xr.DataArray(
+                result[:, np.newaxis],
+                coords=[f_hour, init_times[t:t + 1], z.lat, z.lon],
+                dims=['f_hour', 'time', 'lat', 'lon'],
+                name='forecast'
+            )
+            forecast.f_hour.attrs['units'] = 'hours'
+            if handlers is None:
+                forecasts.append(forecast)
+            else:
+                for handler in handlers:
+                    handler(forecast)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if handlers is None:
+        return xr.concat(forecasts, dim='time')
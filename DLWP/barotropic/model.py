@@ -20,7 +20,13 @@ import math
 
 import numpy as np
 
-from .pyspharm_transforms import TransformsEngine
+from ..timing import profiler
+
+try:
+    from .pyspharm_transforms import TransformsEngine
+except ImportError:
+    # Without pyspharm, use the pure-NumPy transforms
+    from .numpy_transforms import NumpyTransformsEngine as TransformsEngine
 
 
 class BarotropicModel(object):
@@ -34,7 +40,7 @@ class BarotropicModel(object):
 
     def __init__(self, z, truncation, dt, start_time,
                  robert_coefficient=0.04, damping_coefficient=1e-4,
-                 damping_order=4):
+                 damping_order=4, engine=None, integrator='leapfrog'):
         """
         Initialize a barotropic model.
         Arguments:
@@ -57,14 +63,39 @@ class BarotropicModel(object):
             The coefficient for the damping term.
         * damping_order : default 4 (hyperdiffusion)
             The order of the damping.
+        * engine : default None
+            An existing spectral transforms engine for the same grid and
+            truncation, which is expensive to construct. By default a new
+            TransformsEngine is created, using pyspharm if it is installed
+            and NumpyTransformsEngine otherwise.
+        * integrator : default 'leapfrog'
+            The time integration scheme. One of:
+            'leapfrog': leapfrog with a Robert filter and semi-implicit
+                damping (the original scheme)
+            'rk3': Kutta's 3rd-order Runge-Kutta
+            'rk4': classical 4th-order Runge-Kutta
+            The Runge-Kutta schemes treat the damping exactly with an
+            integrating factor, and permit larger time steps than the
+            leapfrog scheme for the same accuracy. The Robert filter is
+            not used by them.
         """
+        if integrator not in ['leapfrog', 'rk3', 'rk4']:
+            raise ValueError("'integrator' must be 'leapfrog', 'rk3', or "
+                             "'rk4'")
+        self.integrator = integrator
         # Model grid size:
         self.nlat, self.nlon = z.shape
         # Filtering properties:
         self.robert_coefficient = robert_coefficient
         # Initialize the spectral transforms engine:
         self.truncation = truncation
-        self.engine = TransformsEngine(self.nlon, self.nlat, truncation)
+        if engine is None:
+            engine = TransformsEngine(self.nlon, self.nlat, truncation)
+        elif (engine.nlon, engine.nlat, engine.truncation) != \
+                (self.nlon, self.nlat, truncation):
+            raise ValueError('the transforms engine does not match the grid '
+                             'and truncation of the model')
+        self.engine = engine
         # Initialize constants for spectral damping:
         m, n = self.engine.wavenumbers
         el = (m + n) * (m + n + 1) / float(self.engine.radius) ** 2
@@ -77,6 +108,16 @@ class BarotropicModel(object):
         nspec = (truncation + 1) * (truncation + 2) // 2
         self.vrt_spec = np.zeros([nspec], dtype=np.complex128)
         self.vrt_spec_prev = np.zeros([nspec], dtype=np.complex128)
+        # Pre-allocate the zero divergence and the work arrays of the
+        # time integration:
+        self._zero_spec = np.zeros([nspec], dtype=np.complex128)
+        self._stage_spec = np.zeros([nspec], dtype=np.complex128)
+        self._tend_spec = np.zeros([nspec], dtype=np.complex128)
+        self._sum_spec = np.zeros([nspec], dtype=np.complex128)
+        self._absvrt_grid = np.zeros([self.nlat, self.nlon], dtype=np.float64)
+        self._dudt_grid = np.zeros([self.nlat, self.nlon], dtype=np.float64)
+        self._dvdt_grid = np.zeros([self.nlat, self.nlon], dtype=np.float64)
+        self._coefficients_dt = None
         # Set the initial state:
         self.set_state(z)  # @jweyn
         # Pre-compute the Coriolis parameter on the model grid:
@@ -118,22 +159,72 @@ class BarotropicModel(object):
         # Compute the wind components from the spectral vorticity, assuming
         # no divergence:
         self.u_grid[:], self.v_grid[:] = self.engine.uv_grid_from_vrtdiv_spec(
-            self.vrt_spec, np.zeros_like(self.vrt_spec))
+            self.vrt_spec, self._zero_spec)
         # Set the spectral vorticity at the previous time to the current time,
         # which makes sure damping works properly:
         self.vrt_spec_prev[:] = self.vrt_spec
 
+    def _update_coefficients(self):
+        """
+        Pre-compute the damping coefficients for the current time-step.
+        They are only re-computed if the time-step changes.
+        """
+        if self._coefficients_dt == self.dt:
+            return
+        # Semi-implicit damping of the leapfrog scheme:
+        self._damping_coeffs = 1. / (1. + self.damping * self.dt)
+        # Integrating factors exp(-damping * t) of the Runge-Kutta schemes:
+        self._if_half = np.exp(-0.5 * self.damping * self.dt)
+        self._if_full = self._if_half ** 2
+        self._if_inverse_half = 1. / self._if_half
+        self._coefficients_dt = self.dt
+
+    def _tendency(self, vrt_spec, out, state_grids=False):
+        """
+        Compute the spectral vorticity tendency of the advection terms
+        (without damping) into out. If state_grids is True, use the
+        current grid vorticity and winds, which correspond to vrt_spec.
+        """
+        if state_grids:
+            vrt_grid, u_grid, v_grid = self.vrt_grid, self.u_grid, self.v_grid
+        else:
+            vrt_grid = self.engine.spec_to_grid(vrt_spec)
+            u_grid, v_grid = self.engine.uv_grid_from_vrtdiv_spec(
+                vrt_spec, self._zero_spec)
+        np.add(self.f, vrt_grid, out=self._absvrt_grid)
+        np.multiply(self._absvrt_grid, v_grid, out=self._dudt_grid)
+        np.negative(self._dudt_grid, out=self._dudt_grid)
+        np.multiply(self._absvrt_grid, u_grid, out=self._dvdt_grid)
+        out[:], _ = self.engine.vrtdiv_spec_from_uv_grid(self._dudt_grid,
+                                                         self._dvdt_grid)
+        return out
+
     def step_forward(self):
         """Step the model forward in time by one time-step."""
+        self._update_coefficients()
+        if self.integrator == 'leapfrog':
+            new_vrt_spec = self._step_leapfrog()
+        elif self.integrator == 'rk3':
+            new_vrt_spec = self._step_rk3()
+        else:
+            new_vrt_spec = self._step_rk4()
+        # Update the current time with the new values:
+        self.vrt_spec[:] = new_vrt_spec
+        self.vrt_grid[:] = self.engine.spec_to_grid(new_vrt_spec)
+        self.z_grid[:] = self.get_z(self.vrt_grid)  # @jweyn
+        self.u_grid[:], self.v_grid[:] = self.engine.uv_grid_from_vrtdiv_spec(
+            new_vrt_spec, self._zero_spec)
+        # Increment the model time:
+        self.t += self.dt
+
+    def _step_leapfrog(self):
         if self.first_step:
             dt = self.dt
         else:
             dt = 2 * self.dt
-        dudt = -(self.f + self.vrt_grid) * self.v_grid  # @jweyn
-        dvdt = (self.f + self.vrt_grid) * self.u_grid  # @jweyn
-        dzetadt, _ = self.engine.vrtdiv_spec_from_uv_grid(dudt, dvdt)
-        coeffs = 1. / (1. + self.damping * self.dt)
-        dzetadt = coeffs * (dzetadt - self.damping * self.vrt_spec_prev)
+        dzetadt = self._tendency(self.vrt_spec, self._tend_spec,
+                                 state_grids=True)
+        dzetadt = self._damping_coeffs * (dzetadt - self.damping * self.vrt_spec_prev)
         if self.first_step:
             # Apply a forward-difference time integration scheme:
             new_vrt_spec = self.vrt_spec + dt * dzetadt
@@ -149,14 +240,80 @@ class BarotropicModel(object):
             self.vrt_spec[:] += self.robert_coefficient * new_vrt_spec
         # Overwrite the t-1 time with the current time:
         self.vrt_spec_prev[:] = self.vrt_spec
-        # Update the current time with the new values:
-        self.vrt_spec[:] = new_vrt_spec
-        self.vrt_grid[:] = self.engine.spec_to_grid(new_vrt_spec)
-        self.z_grid[:] = self.get_z(self.vrt_grid)  # @jweyn
-        self.u_grid[:], self.v_grid[:] = self.engine.uv_grid_from_vrtdiv_spec(
-            new_vrt_spec, np.zeros_like(new_vrt_spec))
-        # Increment the model time:
-        self.t += self.dt
+        return new_vrt_spec
+
+    def _step_rk3(self):
+        # Integrating-factor (Lawson) form of Kutta's 3rd-order scheme for
+        # d(vrt)/dt = N(vrt) - damping * vrt, with E(t) = exp(-damping * t).
+        # Its stage times c = (0, 1/2, 1) never decrease, so only decaying
+        # factors E(t >= 0) appear; the times (0, 1, 1/2) of SSP-RK3 would
+        # need the growing factor E(-dt/2), which overflows at large steps.
+        dt = self.dt
+        vrt, stage, k = self.vrt_spec_prev, self._stage_spec, self._tend_spec
+        total = self._sum_spec
+        vrt[:] = self.vrt_spec
+        # a = N(vrt); total accumulates E(dt) (vrt + dt/6 a) + 2/3 dt E(dt/2) b + dt/6 c
+        self._tendency(vrt, k, state_grids=True)
+        np.multiply(k, dt / 6., out=total)
+        total += vrt
+        total *= self._if_full
+        # b = N(E(dt/2) (vrt + dt/2 a))
+        np.multiply(k, 0.5 * dt, out=stage)
+        stage += vrt
+        stage *= self._if_half
+        # vrt holds the third stage from here: E(dt) (vrt - dt a) + 2 dt E(dt/2) b
+        k *= dt
+        vrt -= k
+        vrt *= self._if_full
+        self._tendency(stage, k)
+        k *= dt * self._if_half
+        np.multiply(k, 2. / 3., out=stage)
+        total += stage
+        k *= 2.
+        vrt += k
+        # c = N(E(dt) (vrt - dt a) + 2 dt E(dt/2) b)
+        self._tendency(vrt, k)
+        k *= dt / 6.
+        total += k
+        self.first_step = False
+        return total
+
+    def _step_rk4(self):
+        # Integrating-factor (Lawson) RK4 for
+        # d(vrt)/dt = N(vrt) - damping * vrt, with E(t) = exp(-damping * t)
+        dt = self.dt
+        vrt, stage, k = self.vrt_spec_prev, self._stage_spec, self._tend_spec
+        total = self._sum_spec
+        vrt[:] = self.vrt_spec
+        # a = N(vrt); total accumulates E(dt) a + 2 E(dt/2) (b + c) + d
+        self._tendency(vrt, k, state_grids=True)
+        np.multiply(k, self._if_full, out=total)
+        # b = N(E(dt/2) (vrt + dt/2 a))
+        k *= 0.5 * dt
+        np.add(vrt, k, out=stage)
+        stage *= self._if_half
+        self._tendency(stage, k)
+        k *= 2. * self._if_half
+        total += k
+        # c = N(E(dt/2) vrt + dt/2 b)
+        k *= 0.25 * dt * self._if_inverse_half
+        np.multiply(vrt, self._if_half, out=stage)
+        stage += k
+        self._tendency(stage, k)
+        k *= 2. * self._if_half
+        total += k
+        # d = N(E(dt) vrt + dt E(dt/2) c)
+        k *= 0.5 * dt
+        np.multiply(vrt, self._if_full, out=stage)
+        stage += k
+        self._tendency(stage, k)
+        total += k
+        # new = E(dt) vrt + dt/6 total
+        total *= dt / 6.
+        np.multiply(vrt, self._if_full, out=stage)
+        stage += total
+        self.first_step = False
+        return stage
 
     def run_with_snapshots(self, run_time, snapshot_start=0,
                            snapshot_interval=None):
@@ -207,7 +364,7 @@ class BarotropicModelPsi(object):
 
     def __init__(self, z, truncation, dt, start_time,
                  robert_coefficient=0.04, damping_coefficient=1e-4,
-                 damping_order=4):
+                 damping_order=4, engine=None, dealias=False):
         """
         Initialize a barotropic model.
         Arguments:
@@ -230,6 +387,16 @@ class BarotropicModelPsi(object):
             The coefficient for the damping term.
         * damping_order : default 4 (hyperdiffusion)
             The order of the damping.
+        * engine : default None
+            An existing spectral transforms engine for the same grid and
+            truncation, which is expensive to construct. By default a new
+            TransformsEngine is created, using pyspharm if it is installed
+            and NumpyTransformsEngine otherwise.
+        * dealias : default False
+            If True, apply the 2/3 rule to the advection term: stream
+            function and vorticity are truncated to total wavenumbers
+            n <= 2 * truncation / 3 before their Jacobian is computed, so
+            that their product is not aliased onto the retained modes.
         """
         # Model grid size:
         self.nlat, self.nlon = z.shape
@@ -237,7 +404,14 @@ class BarotropicModelPsi(object):
         self.robert_coefficient = robert_coefficient
         # Initialize the spectral transforms engine:
         self.truncation = truncation
-        self.engine = TransformsEngine(self.nlon, self.nlat, truncation)
+        self.dealias = dealias
+        if engine is None:
+            engine = TransformsEngine(self.nlon, self.nlat, truncation)
+        elif (engine.nlon, engine.nlat, engine.truncation) != \
+                (self.nlon, self.nlat, truncation):
+            raise ValueError('the transforms engine does not match the grid '
+                             'and truncation of the model')
+        self.engine = engine
         # Initialize constants for spectral damping:
         m, n = self.engine.wavenumbers
         el = (m + n) * (m + n + 1) / float(self.engine.radius) ** 2
@@ -250,9 +424,18 @@ class BarotropicModelPsi(object):
         nspec = (truncation + 1) * (truncation + 2) // 2
         self.vrt_spec = np.zeros([nspec], dtype=np.complex128)
         self.vrt_spec_prev = np.zeros([nspec], dtype=np.complex128)
+        # Buffers and constants of the time step:
+        n = self.engine.wavenumbers[1] + 1.
+        self._laplacian = -1 * n * (n + 1) / (self.engine.radius ** 2.)
+        self._dealias_mask = (self.engine.wavenumbers[1] <= 2 * truncation // 3).astype(np.float64)
+        self._psi_vrt_spec = np.zeros([2, nspec], dtype=np.complex128)
+        self._jacobian_grid = np.zeros([self.nlat, self.nlon], dtype=np.float64)
+        self._product_grid = np.zeros([self.nlat, self.nlon], dtype=np.float64)
+        self._dzetadt = np.zeros([nspec], dtype=np.complex128)
         # Pre-compute the Coriolis parameter on the model grid:
         lats, _ = self.engine.grid_latlon
         self.lats = lats
+        self._sh_sign = np.where(lats < 0, -1., 1.)[:, np.newaxis]
         self.f = 2 * 7.29e-5
         self.beta = 2 * 7.29e-5 * np.cos(np.deg2rad(lats))[:, np.newaxis] / self.engine.radius
         self.g = 9.81
@@ -291,17 +474,20 @@ class BarotropicModelPsi(object):
 
     def step_forward(self, correct_sh=True):
         """Step the model forward in time by one time-step."""
-        psi_spec = self.engine.grid_to_spec(self.psi_grid)
+        timer = profiler.stopwatch('BarotropicModelPsi.step_forward')
+        # The stream function is band-limited, so take it from the vorticity
+        # instead of transforming psi_grid
+        psi_spec = self._vrt_to_psi(self.vrt_spec)
         # dpsidx, _ = self.engine.grad_of_spec(psi_spec)
         # beta_term = self.engine.grid_to_spec(self.beta * dpsidx)
-        dzetadt = -1. * (self._J(psi_spec, self.vrt_spec))
-        if correct_sh:
-            dzetadt = self.engine.spec_to_grid(dzetadt)
-            dzetadt[self.lats < 0] = -1. * dzetadt[self.lats < 0]
-            dzetadt = self.engine.grid_to_spec(dzetadt)
+        dzetadt = self._J(psi_spec, self.vrt_spec, correct_sh=correct_sh,
+                          out=self._dzetadt)
+        dzetadt *= -1.
+        timer.lap('jacobian')
 
         coeffs = 1. / (1. + self.damping * self.dt)
-        dzetadt = coeffs * (dzetadt - self.damping * self.vrt_spec_prev)
+        dzetadt -= self.damping * self.vrt_spec_prev
+        dzetadt *= coeffs
 
         if self.first_step:
             # Apply a forward-difference time integration scheme:
@@ -324,23 +510,58 @@ class BarotropicModelPsi(object):
         self.vrt_spec_prev[:] = self.vrt_spec
         # Update the current time with the new values:
         self.vrt_spec[:] = new_vrt_spec
+        timer.lap('time_step')
         self.vrt_grid[:] = self.engine.spec_to_grid(new_vrt_spec)
         self.psi_grid[:] = self.engine.spec_to_grid(self._vrt_to_psi(new_vrt_spec))
-        self.z_grid[:] = self.f * self.psi_grid / self.g
+        np.multiply(self.psi_grid, self.f / self.g, out=self.z_grid)
+        timer.lap('synthesis')
+        timer.stop()
         # Increment the model time:
         self.t += self.dt
 
     def _vrt_to_psi(self, vrt):  # @jweyn
-        n = self.engine.wavenumbers[1] + 1.
-        factor = -1 * n * (n + 1) / (self.engine.radius ** 2.)
-        return vrt / factor
+        return vrt / self._laplacian
 
     def _psi_to_vrt(self, z):  # @jweyn
-        n = self.engine.wavenumbers[1] + 1.
-        factor = -1 * n * (n + 1) / (self.engine.radius ** 2.)
-        return factor * z
+        return self._laplacian * z
 
-    def _J(self, psi, vrt):
-        dpsidx, dpsidy = self.engine.grad_of_spec(psi)
-        dvrtdx, dvrtdy = self.engine.grad_of_spec(vrt)
-        return self.engine.grid_to_spec(dpsidx * dvrtdy - dpsidy * dvrtdx)
+    def _J(self, psi, vrt, correct_sh=False, out=None):
+        """
+        Spectral Jacobian J(psi, vrt) = dpsi/dx dvrt/dy - dpsi/dy dvrt/dx.
+        The gradients of both fields are computed in one batched transform
+        and the product is formed in preallocated grids.
+        Arguments:
+        * psi, vrt : numpy.ndarray[nspec]
+            Spectral stream function and vorticity.
+        Optional arguments:
+        * correct_sh : default False
+            If True, reverse the sign of the Jacobian in the southern
+            hemisphere. As in the original model, the sign is applied to
+            the synthesis of the truncated spectral Jacobian, which is then
+            analysed again; applying it to the unprojected grid Jacobian
+            would save the round trip but change the results.
+        * out : default None
+            Spectral array in which to write the result.
+        """
+        timer = profiler.stopwatch('BarotropicModelPsi._J')
+        self._psi_vrt_spec[0] = psi
+        self._psi_vrt_spec[1] = vrt
+        if self.dealias:
+            self._psi_vrt_spec *= self._dealias_mask
+        dsdx, dsdy = self.engine.grads_of_spec(self._psi_vrt_spec)
+        timer.lap('gradients')
+        np.multiply(dsdx[0], dsdy[1], out=self._jacobian_grid)
+        np.multiply(dsdy[0], dsdx[1], out=self._product_grid)
+        self._jacobian_grid -= self._product_grid
+        timer.lap('product')
+        if out is None:
+            out = np.empty_like(self._dzetadt)
+        out[:] = self.engine.grid_to_spec(self._jacobian_grid)
+        timer.lap('analysis')
+        if correct_sh:
+            self._jacobian_grid[:] = self.engine.spec_to_grid(out)
+            self._jacobian_grid *= self._sh_sign
+            out[:] = self.engine.grid_to_spec(self._jacobian_grid)
+            timer.lap('correct_sh')
+        timer.stop()
+        return out
@@ -0,0 +1,452 @@
+"""A spectral transforms engine using only NumPy."""
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+from __future__ import (absolute_import, division, print_function)  #noqa
+
+from functools import lru_cache
+
+import numpy as np
+
+
+def _epsilon(m, n):
+    # Recurrence coefficient of the orthonormal associated Legendre functions: x P_n = eps_{n+1} P_{n+1} + eps_n P_{n-1}
+    return np.sqrt((n ** 2. - m ** 2.) / (4. * n ** 2. - 1.))
+
+
+def _legendre(truncation, x, sin_theta):
+    """
+    Evaluate the orthonormal associated Legendre functions P_n^m (the integral of P_n^m ** 2 over [-1, 1] is 1),
+    Q_n^m = P_n^m / cos(latitude) (zero for m = 0), and dP_n^m / d(latitude) at x = sin(latitude), for
+    0 <= m <= n <= truncation. Returns lists over m of arrays of shape (truncation - m + 1, len(x)).
+    """
+    nx = len(x)
+    p_all, q_all, dp_all = [], [], []
+    pmm = np.full(nx, np.sqrt(0.5))
+    qmm = np.zeros(nx)
+    for m in range(truncation + 2):
+        if m > 0:
+            qmm = np.sqrt((2. * m + 1.) / (2. * m)) * pmm
+            pmm = qmm * sin_theta
+        # Up to n = truncation + 1, needed for the derivatives
+        p = np.zeros((truncation + 2 - m, nx))
+        q = np.zeros((truncation + 2 - m, nx))
+        p[0], q[0] = pmm, qmm
+        for i in range(1, truncation + 2 - m):
+            n = m + i
+            p[i] = x * p[i - 1]
+            q[i] = x * q[i - 1]
+            if i > 1:
+                p[i] -= _epsilon(m, n - 1) * p[i - 2]
+                q[i] -= _epsilon(m, n - 1) * q[i - 2]
+            p[i] /= _epsilon(m, n)
+            q[i] /= _epsilon(m, n)
+        p_all.append(p)
+        q_all.append(q)
+    for m in range(truncation + 1):
+        n = np.arange(m, truncation + 1)[:, np.newaxis]
+        if m == 0:
+            # dP_n^0 / d(latitude) = sqrt(n (n + 1)) P_n^1
+            dp = np.zeros((truncation + 1, nx))
+            dp[1:] = np.sqrt(n[1:] * (n[1:] + 1.)) * p_all[1][:truncation]
+        else:
+            # cos(latitude) dP_n^m / dx = -n eps_{n+1} Q_{n+1} + (n + 1) eps_n Q_{n-1}
+            q = q_all[m]
+            dp = -n * _epsilon(m, n + 1) * q[1:]
+            dp[1:] += (n[1:] + 1.) * _epsilon(m, n[1:]) * q[:-2]
+        dp_all.append(dp)
+    return ([p[:-1] for p in p_all[:truncation + 1]], [q[:-1] for q in q_all[:truncation + 1]], dp_all)
+
+
+def _cardinal_functions(nlat, theta):
+    """
+    Values at colatitudes theta of the cardinal functions of the exact trigonometric interpolation of data on nlat
+    equally-spaced colatitudes including the poles: cosine series (DCT-I) for data that are even about the poles and
+    sine series (DST-I) for data that are odd about the poles. Returns two arrays of shape (len(theta), nlat).
+    """
+    n = nlat - 1
+    theta_j = np.pi * np.arange(nlat) / n
+    k = np.arange(nlat)
+    half = np.ones(nlat)
+    half[[0, -1]] = 0.5
+    even = (2. / n) * np.dot(np.cos(np.outer(theta, k)) * half, np.cos(np.outer(k, theta_j))) * half
+    odd = (2. / n) * np.dot(np.sin(np.outer(theta, k[1:-1])), np.sin(np.outer(k[1:-1], theta_j)))
+    return even, odd
+
+
+@lru_cache(maxsize=8)
+def _gaussian_latitudes(nlat):
+    """
+    Gaussian latitudes in degrees, from north to south, as from spharm.gaussian_lats_wts.
+    """
+    lats = np.rad2deg(np.arcsin(np.polynomial.legendre.leggauss(nlat)[0][::-1]))
+    lats.flags.writeable = False
+    return lats
+
+
+@lru_cache(maxsize=8)
+def _transform_matrices(nlat, truncation, gridtype):
+    """
+    Compute the latitudes and the Legendre synthesis and analysis matrices of a grid. The matrices are cached, so that
+    engines for the same grid share them.
+    """
+    if gridtype == 'gaussian':
+        x, weights = np.polynomial.legendre.leggauss(nlat)
+        x, weights = x[::-1], weights[::-1]
+        lats = np.rad2deg(np.arcsin(x))
+    elif gridtype == 'regular':
+        lats = np.linspace(90., -90., nlat)
+        x = np.sin(np.deg2rad(lats))
+    else:
+        raise ValueError("'gridtype' must be 'regular' or 'gaussian'")
+    sin_theta = np.cos(np.deg2rad(lats))
+    sin_theta[np.abs(lats) == 90.] = 0.
+    p, q, dp = _legendre(truncation, x, sin_theta)
+
+    if gridtype == 'gaussian':
+        # Gaussian quadrature is exact for the products of band-limited fields
+        analysis = [a * weights for a in p]
+        analysis_q = [a * weights for a in q]
+        analysis_dp = [a * weights for a in dp]
+    else:
+        # Interpolate the data exactly with trigonometric series in colatitude, then integrate the products with the
+        # Legendre functions exactly with a Gaussian quadrature. Scalar fields have the parity of m about the poles and
+        # the wind components the opposite parity.
+        n_quad = (nlat + truncation + 5) // 2
+        xg, wg = np.polynomial.legendre.leggauss(n_quad)
+        even, odd = _cardinal_functions(nlat, np.arccos(xg))
+        pg, qg, dpg = _legendre(truncation, xg, np.sqrt(1. - xg ** 2.))
+        analysis = [np.dot(a * wg, odd if m % 2 else even) for m, a in enumerate(pg)]
+        analysis_q = [np.dot(a * wg, even if m % 2 else odd) for m, a in enumerate(qg)]
+        analysis_dp = [np.dot(a * wg, even if m % 2 else odd) for m, a in enumerate(dpg)]
+
+    matrices = {
+        'lats': lats,
+        # Synthesis: (n, nlat) and (n, 2 nlat) for Q and dP together
+        'p': p,
+        'qdp': [np.concatenate([a, b], axis=1) for a, b in zip(q, dp)],
+        # Analysis: (nlat, n) and (nlat, 2 n) for Q and dP together
+        'a': [np.ascontiguousarray(a.T) for a in analysis],
+        'aqdp': [np.ascontiguousarray(np.concatenate([a, b], axis=0).T) for a, b in zip(analysis_q, analysis_dp)],
+    }
+    for value in matrices.values():
+        for array in (value if isinstance(value, list) else [value]):
+            array.flags.writeable = False
+    return matrices
+
+
+class NumpyTransformsEngine(object):
+    """
+    A spectral transforms engine using NumPy FFTs in longitude and cached
+    associated Legendre matrices in latitude, applied as matrix products
+    (with multi-threaded BLAS). It has the same interface as the pyspharm
+    TransformsEngine and needs no compiled extensions.
+
+    As with pyspharm, grid fields have shape (nlat, nlon) or
+    (nlat, nlon, ...), with latitudes from north to south, and spectral
+    fields have shape (nspec) or (nspec, ...), with coefficients ordered
+    as in spharm.getspecindx. Any trailing dimensions are transformed
+    together, which is much faster than transforming fields one at a
+    time. grads_of_spec takes fields stacked along the first dimension
+    instead, as for the pyspharm engine. The spectral coefficients are those of
+    orthonormal spherical harmonics; they differ from the pyspharm
+    coefficients by a normalization factor, but any function of the
+    wavenumbers applied to them (e.g. a Laplacian or damping) has the same
+    effect.
+
+    On the regular grid, the analysis is exact for fields band-limited to
+    the truncation if truncation <= nlat - 3; on the gaussian grid, if
+    truncation <= nlat - 1.
+
+    As with the pyspharm engine, grid_latlon returns the gaussian
+    latitudes of nlat points for either grid type, so that the Coriolis
+    parameter, and the results, of the models do not depend on which
+    engine is installed. The transforms use the latitudes of the grid.
+    """
+
+    def __init__(self, nlon, nlat, truncation, radius=6371200.,
+                 gridtype='regular'):
+        """
+        Initialize the spectral transforms engine.
+        Arguments:
+        * nlon: int
+            Number of longitudes in the transform grid.
+        * nlat: int
+            Number of latitudes in the transform grid.
+        * truncation: int
+            The spectral truncation (triangular). This is the maximum
+            number of spherical harmonic modes retained in the discrete
+            truncation. More modes means higher resolution.
+        Optional arguments:
+        * radius: default 6371200.
+            The radius of the sphere in meters.
+        * gridtype: default 'regular'
+            'regular' for equally-spaced latitudes including the poles or
+            'gaussian' for gaussian latitudes.
+        """
+        if truncation > nlat - 1 or truncation > (nlon - 1) // 2:
+            raise ValueError('truncation must be at most nlat - 1 and '
+                             '(nlon - 1) // 2')
+        self.radius = radius
+        self.nlon = nlon
+        self.nlat = nlat
+        self.truncation = truncation
+        self.gridtype = gridtype
+        self.nspec = (truncation + 1) * (truncation + 2) // 2
+        self._matrices = _transform_matrices(nlat, truncation, gridtype)
+        # Start and end of the coefficients of each zonal wavenumber m:
+        sizes = np.arange(truncation + 1, 0, -1)
+        ends = np.cumsum(sizes)
+        self._blocks = list(zip(ends - sizes, ends))
+        m, n = np.meshgrid(np.arange(truncation + 1),
+                           np.arange(truncation + 1), indexing='ij')
+        keep = n >= m
+        self._wavenumbers = (m[keep], n[keep])
+        for a in self._wavenumbers:
+            a.flags.writeable = False
+        self._im = 1j * self._wavenumbers[0]
+        n = self._wavenumbers[1][1:]
+        self._inverse_laplacian = np.zeros(self.nspec)
+        self._inverse_laplacian[1:] = -radius ** 2. / (n * (n + 1.))
+        lons = np.arange(0., 360., 360. / nlon)
+        lons.flags.writeable = False
+        self._grid_latlon = (_gaussian_latitudes(nlat), lons)
+
+    # Helpers ----------------------------------------------------------------
+
+    def _check_grid(self, *grids):
+        for grid in grids:
+            if grid.shape[-2:] != (self.nlat, self.nlon):
+                raise ValueError('grid fields must have shape (..., {y}, {x})'
+                                 .format(y=self.nlat, x=self.nlon))
+
+    def _check_spec(self, *specs):
+        for spec in specs:
+            if spec.shape[-1] != self.nspec:
+                raise ValueError('spectral fields must have shape (..., {})'
+                                 .format(self.nspec))
+
+    # The public transforms take and return the trailing batch dimensions
+    # of pyspharm; the private ones work on leading batch dimensions.
+
+    def _grid_in(self, *grids):
+        if any(np.ndim(grid) < 2 or np.shape(grid)[:2] != (self.nlat, self.nlon) for grid in grids):
+            raise ValueError('grid fields must have shape ({y}, {x}) or ({y}, {x}, ...)'
+                             .format(y=self.nlat, x=self.nlon))
+        return [np.moveaxis(np.asarray(grid), (0, 1), (-2, -1)) for grid in grids]
+
+    def _spec_in(self, *specs):
+        if any(np.ndim(spec) < 1 or np.shape(spec)[0] != self.nspec for spec in specs):
+            raise ValueError('spectral fields must have shape ({n}) or ({n}, ...)'.format(n=self.nspec))
+        return [np.moveaxis(np.asarray(spec), 0, -1) for spec in specs]
+
+    @staticmethod
+    def _grid_out(grid):
+        return np.moveaxis(grid, (-2, -1), (0, 1))
+
+    @staticmethod
+    def _spec_out(spec):
+        return np.moveaxis(spec, -1, 0)
+
+    def _fourier(self, *grids):
+        """
+        Fourier coefficients of m = 0..truncation of grid fields, as a real
+        array of shape (truncation + 1, 2 * len(grids) * batch, nlat)
+        holding the real parts then the imaginary parts of each field.
+        """
+        parts = []
+        for grid in grids:
+            f = np.fft.rfft(grid.reshape((-1, self.nlat, self.nlon)), axis=-1)
+            f = f[..., :self.truncation + 1].transpose(2, 0, 1) / self.nlon
+            parts.extend([f.real, f.imag])
+        return np.concatenate(parts, axis=1)
+
+    def _grid(self, real, imag, batch_shape):
+        """
+        Grid fields from the real and imaginary parts of their Fourier
+        coefficients, each of shape (truncation + 1, batch, nlat).
+        """
+        f = (real + 1j * imag).transpose(1, 2, 0) * self.nlon
+        grid = np.fft.irfft(f, n=self.nlon, axis=-1)
+        return grid.reshape(batch_shape + (self.nlat, self.nlon))
+
+    def _stack(self, *specs):
+        """
+        Real array of shape (2 * len(specs) * batch, nspec) holding the
+        real parts then the imaginary parts of each spectral field.
+        """
+        parts = []
+        for spec in specs:
+            spec = spec.reshape((-1, self.nspec))
+            parts.extend([spec.real, spec.imag])
+        return np.concatenate(parts)
+
+    def _unstack(self, stack, batch_shape):
+        """
+        Complex fields of the given batch shape from a real stack as
+        returned by _stack.
+        """
+        parts = np.split(stack, stack.shape[0] // int(np.prod(batch_shape, dtype=int)))
+        return [(re + 1j * im).reshape(batch_shape + stack.shape[1:])
+                for re, im in zip(parts[::2], parts[1::2])]
+
+    def _synthesis(self, stack, matrices):
+        """
+        Apply the synthesis matrices of each m to a spectral stack; returns
+        an array of shape (truncation + 1, rows, columns of the matrices).
+        """
+        out = np.empty((self.truncation + 1, stack.shape[0],
+                        matrices[0].shape[1]))
+        for m, (start, end) in enumerate(self._blocks):
+            out[m] = np.dot(stack[:, start:end], matrices[m])
+        return out
+
+    def _analysis(self, fourier, matrices, count=1):
+        """
+        Apply the analysis matrices of each m to Fourier coefficients as
+        returned by _fourier; the matrices hold count groups of columns,
+        returned as count stacks of shape (rows, nspec).
+        """
+        out = [np.empty((fourier.shape[1], self.nspec)) for _ in range(count)]
+        for m, (start, end) in enumerate(self._blocks):
+            product = np.dot(fourier[m], matrices[m])
+            size = end - start
+            for i in range(count):
+                out[i][:, start:end] = product[:, i * size:(i + 1) * size]
+        return out
+
+    # Transforms -------------------------------------------------------------
+
+    def spec_to_grid(self, scalar_spec):
+        """
+        Transform a scalar field from spectral to grid space.
+        """
+        return self._grid_out(self._spec_to_grid(*self._spec_in(scalar_spec)))
+
+    def grid_to_spec(self, scalar_grid):
+        """
+        Transform a scalar field from grid to spectral space.
+        """
+        return self._spec_out(self._grid_to_spec(*self._grid_in(scalar_grid)))
+
+    def grad_of_spec(self, scalar_spec):
+        """
+        Return zonal and meridional gradients of a spectral field.
+        """
+        dsdx, dsdy = self._grad_of_spec(*self._spec_in(scalar_spec))
+        return self._grid_out(dsdx), self._grid_out(dsdy)
+
+    def uv_grid_from_vrtdiv_spec(self, vrt, div):
+        """
+        Compute grid u and v from spectral vorticity and divergence.
+        """
+        u, v = self._uv_grid_from_vrtdiv_spec(*self._spec_in(vrt, div))
+        return self._grid_out(u), self._grid_out(v)
+
+    def vrtdiv_spec_from_uv_grid(self, u, v):
+        """
+        Compute spectral vorticity and divergence from grid u and v.
+        """
+        vrt, div = self._vrtdiv_spec_from_uv_grid(*self._grid_in(u, v))
+        return self._spec_out(vrt), self._spec_out(div)
+
+    def grads_of_spec(self, scalar_specs):
+        """
+        Return zonal and meridional gradients of several spectral fields,
+        stacked along the first dimension, in one transform call.
+        """
+        return self._grad_of_spec(scalar_specs)
+
+    # Transforms with leading batch dimensions -------------------------------
+
+    def _spec_to_grid(self, scalar_spec):
+        self._check_spec(scalar_spec)
+        batch_shape = scalar_spec.shape[:-1]
+        real, imag = np.split(self._synthesis(self._stack(scalar_spec),
+                                              self._matrices['p']), 2, axis=1)
+        return self._grid(real, imag, batch_shape)
+
+    def _grid_to_spec(self, scalar_grid):
+        self._check_grid(scalar_grid)
+        batch_shape = scalar_grid.shape[:-2]
+        stack, = self._analysis(self._fourier(scalar_grid),
+                                self._matrices['a'])
+        return self._unstack(stack, batch_shape)[0]
+
+    def _q_dp_to_fourier(self, *specs):
+        """
+        Fourier coefficients of sum(spec * Q) and sum(spec * dP/dlat) of
+        each spectral field, as pairs of (real, imag) parts.
+        """
+        out = self._synthesis(self._stack(*specs), self._matrices['qdp'])
+        parts = np.split(out, 2 * len(specs), axis=1)
+        q = [(re[..., :self.nlat], im[..., :self.nlat])
+             for re, im in zip(parts[::2], parts[1::2])]
+        dp = [(re[..., self.nlat:], im[..., self.nlat:])
+              for re, im in zip(parts[::2], parts[1::2])]
+        return q, dp
+
+    def _times_im(self, real, imag):
+        """
+        Multiply Fourier coefficients by i * m.
+        """
+        m = np.arange(self.truncation + 1)[:, np.newaxis, np.newaxis]
+        return -m * imag, m * real
+
+    def _grad_of_spec(self, scalar_spec):
+        self._check_spec(scalar_spec)
+        batch_shape = scalar_spec.shape[:-1]
+        (q,), (dp,) = self._q_dp_to_fourier(scalar_spec)
+        dsdx = self._grid(*self._times_im(*q), batch_shape=batch_shape)
+        dsdy = self._grid(*dp, batch_shape=batch_shape)
+        return dsdx / self.radius, dsdy / self.radius
+
+    def _uv_grid_from_vrtdiv_spec(self, vrt, div):
+        self._check_spec(vrt, div)
+        batch_shape = np.broadcast(vrt[..., 0], div[..., 0]).shape
+        psi = np.broadcast_to(vrt * self._inverse_laplacian,
+                              batch_shape + (self.nspec,))
+        chi = np.broadcast_to(div * self._inverse_laplacian,
+                              batch_shape + (self.nspec,))
+        (psi_q, chi_q), (psi_dp, chi_dp) = self._q_dp_to_fourier(psi, chi)
+        # u = (-dpsi/dlat + dchi/dlon / cos(lat)) / radius
+        # v = (dpsi/dlon / cos(lat) + dchi/dlat) / radius
+        chi_q = self._times_im(*chi_q)
+        psi_q = self._times_im(*psi_q)
+        u = self._grid(chi_q[0] - psi_dp[0], chi_q[1] - psi_dp[1],
+                       batch_shape)
+        v = self._grid(psi_q[0] + chi_dp[0], psi_q[1] + chi_dp[1],
+                       batch_shape)
+        return u / self.radius, v / self.radius
+
+    def _vrtdiv_spec_from_uv_grid(self, u, v):
+        self._check_grid(u, v)
+        batch_shape = np.broadcast(u[..., 0, 0], v[..., 0, 0]).shape
+        u = np.broadcast_to(u, batch_shape + (self.nlat, self.nlon))
+        v = np.broadcast_to(v, batch_shape + (self.nlat, self.nlon))
+        q, dp = self._analysis(self._fourier(u, v), self._matrices['aqdp'],
+                               count=2)
+        u_q, v_q = self._unstack(q, batch_shape)
+        u_dp, v_dp = self._unstack(dp, batch_shape)
+        # vrt = (i m <v Q> + <u dP/dlat>) / radius
+        # div = (i m <u Q> - <v dP/dlat>) / radius
+        vrt = (self._im * v_q + u_dp) / self.radius
+        div = (self._im * u_q - v_dp) / self.radius
+        return vrt, div
+
+    @property
+    def wavenumbers(self):
+        """
+        Wavenumbers corresponding to the spectral fields.
+        """
+        return self._wavenumbers
+
+    @property
+    def grid_latlon(self):
+        """
+        Return the latitude and longitude coordinate vectors of the
+        model grid.
+        """
+        return self._grid_latlon
@@ -25,7 +25,8 @@ except ImportError:
 class TransformsEngine(object):
     """A spectral transforms engine based on pyspharm."""
 
-    def __init__(self, nlon, nlat, truncation, radius=6371200.):
+    def __init__(self, nlon, nlat, truncation, radius=6371200.,
+                 gridtype='regular'):
         """
         Initialize the spectral transforms engine.
         Arguments:
@@ -37,12 +38,30 @@ class TransformsEngine(object):
             The spectral truncation (triangular). This is the maximum
             number of spherical harmonic modes retained in the discrete
             truncation. More modes means higher resolution.
-        """
-        self.sh = Spharmt(nlon, nlat, gridtype='regular', rsphere=radius)
+        Optional arguments:
+        * radius: default 6371200.
+            The radius of the sphere in meters.
+        * gridtype: default 'regular'
+            'regular' for equally-spaced latitudes including the poles or
+            'gaussian' for gaussian latitudes. grid_latlon returns the
+            gaussian latitudes for either grid type.
+        """
+        self.sh = Spharmt(nlon, nlat, gridtype=gridtype, rsphere=radius)
         self.radius = radius
         self.nlon = nlon
         self.nlat = nlat
         self.truncation = truncation
+        self.gridtype = gridtype
+        # The wavenumbers and coordinates are used at every time step of
+        # the models, so compute them only once
+        self._wavenumbers = getspecindx(truncation)
+        # The models have always used the gaussian latitudes, also with
+        # the regular grid, so these are kept for reproducible results
+        lats, _ = gaussian_lats_wts(nlat)
+        lons = np.arange(0., 360., 360. / nlon)
+        for a in self._wavenumbers + (lats, lons):
+            a.flags.writeable = False
+        self._grid_latlon = (lats, lons)
 
     def vrtdiv_spec_from_uv_grid(self, u, v):
         """
@@ -109,12 +128,21 @@ class TransformsEngine(object):
             raise ValueError(msg)
         return dsdx, dsdy
 
+    def grads_of_spec(self, scalar_specs):
+        """
+        Return zonal and meridional gradients of several spectral fields,
+        stacked along the first dimension, in one transform call.
+        """
+        dsdx, dsdy = self.grad_of_spec(
+            np.ascontiguousarray(np.moveaxis(scalar_specs, 0, -1)))
+        return np.moveaxis(dsdx, -1, 0), np.moveaxis(dsdy, -1, 0)
+
     @property
     def wavenumbers(self):
         """
         Wavenumbers corresponding to the spectral fields.
         """
-        return getspecindx(self.truncation)
+        return self._wavenumbers
 
     @property
     def grid_latlon(self):
@@ -122,6 +150,4 @@ class TransformsEngine(object):
         Return the latitude and longitude coordinate vectors of the
         model grid.
         """
-        lats, _ = gaussian_lats_wts(self.nlat)
-        lons = np.arange(0., 360., 360. / self.nlon)
-        return lats, lons
+        return self._grid_latlon
@@ -18,6 +18,8 @@ from tensorflow.python.keras.engine.base_layer import InputSpec
 from tensorflow.keras import activations, initializers, regularizers, constraints
 import numpy as np
 
+from .model.distribute import is_chief
+
 try:
     from s2cnn import S2Convolution, SO3Convolution
 except ImportError:
@@ -114,6 +116,9 @@ class EarlyStoppingMin(EarlyStopping):
     """
     Extends the keras.callbacks.EarlyStopping class to provide the option to force training for a minimum number of
     epochs or restore the best weights after the maximum epochs have been reached.
+
+    In multi-worker training, the monitored metrics are reduced over all workers, so every worker makes the same
+    decision to stop, as it must for the collective operations of the workers to remain matched; only the chief prints.
     """
 
     def __init__(self, min_epochs=0, max_epochs=None, **kwargs):
@@ -123,6 +128,8 @@ class EarlyStoppingMin(EarlyStopping):
         :param kwargs: passed to EarlyStopping.__init__()
         """
         super(EarlyStoppingMin, self).__init__(**kwargs)
+        if not is_chief():
+            self.verbose = 0
         if not isinstance(min_epochs, int) or min_epochs < 0:
             raise ValueError('min_epochs must be an integer >= 0')
         self.min_epochs = int(min_epochs)
@@ -168,7 +175,7 @@ class EarlyStoppingMin(EarlyStopping):
 class SaveWeightsOnEpoch(Callback):
     """
     Saves the model weights to a temporary file at the end of each epoch. This is useful for avoiding complete loss
-    of a run that fails for any reason.
+    of a run that fails for any reason. In multi-worker training, only the chief worker saves the weights.
     """
 
     def __init__(self, weights_file, interval=None):
@@ -182,6 +189,8 @@ class SaveWeightsOnEpoch(Callback):
         self.interval = interval
 
     def on_epoch_end(self, epoch, logs=None):
+        if not is_chief():
+            return
         if self.interval is not None and epoch % self.interval == 0:
             self.model.save_weights('%s.%s' % (self.weights_file, epoch), save_format='h5')
         else:
@@ -208,6 +217,54 @@ class GeneratorEpochEnd(Callback):
         self.generator.on_epoch_end()
 
 
+class ProfilerCallback(Callback):
+    """
+    Adds the time spent in each stage recorded by a DLWP.timing.Profiler (e.g. the stages of
+    SeriesDataGenerator.generate) during each epoch, and optionally each batch, to the training logs, as
+    'time/<stage>' seconds and 'count/<counter>' values. Must be placed before any callback that records the logs,
+    such as BatchHistory or RunHistory, in the list of callbacks.
+    """
+
+    def __init__(self, profiler=None, per_batch=False):
+        """
+        :param profiler: DLWP.timing.Profiler: profiler to report; defaults to the DLWP.timing.profiler instance.
+            The profiler is enabled when training begins, and disabled again when it ends if it was not enabled
+            before
+        :param per_batch: bool: if True, also add the stages recorded during each batch to the batch logs
+        """
+        super(ProfilerCallback, self).__init__()
+        if profiler is None:
+            from .timing import profiler
+        self.profiler = profiler
+        self.per_batch = per_batch
+        self._epoch_snapshot = None
+        self._batch_snapshot = None
+        self._was_enabled = None
+
+    def on_train_begin(self, logs=None):
+        self._was_enabled = self.profiler.enabled
+        self.profiler.enable()
+
+    def on_train_end(self, logs=None):
+        if self._was_enabled is False:
+            self.profiler.disable()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_snapshot = self.profiler.snapshot()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is not None:
+            logs.update(self.profiler.stats(since=self._epoch_snapshot))
+
+    def on_batch_begin(self, batch, logs=None):
+        if self.per_batch:
+            self._batch_snapshot = self.profiler.snapshot()
+
+    def on_batch_end(self, batch, logs=None):
+        if self.per_batch and logs is not None:
+            logs.update(self.profiler.stats(since=self._batch_snapshot))
+
+
 # ==================================================================================================================== #
 # Keras padding layers
 # ==================================================================================================================== #
@@ -1729,6 +1786,43 @@ class AsymptoteReLU(Layer):
         return input_shape
 
 
+class AffineScaling(Layer):
+    """
+    Fixed (non-trainable) affine scaling of the inputs, `f(x) = x * scale + offset`, in float32. Used to fuse the data
+    scaling of a model into its first layer and the un-scaling into its last layer; see
+    DLWP.model.preprocessing.AffineScaler.
+
+      Input shape:
+        Arbitrary. The scale and offset must broadcast against the input shape excluding the samples axis.
+
+      Output shape:
+        Same shape as the input.
+
+      Arguments:
+        scale: float or array. Multiplicative factor.
+        offset: float or array. Additive offset.
+    """
+
+    def __init__(self, scale=1., offset=0., **kwargs):
+        super(AffineScaling, self).__init__(**kwargs)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+
+    def call(self, inputs, **kwargs):
+        return inputs * K.constant(self.scale) + K.constant(self.offset)
+
+    def get_config(self):
+        config = {
+            'scale': self.scale.tolist(),
+            'offset': self.offset.tolist()
+        }
+        base_config = super(AffineScaling, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
+
+
 # ==================================================================================================================== #
 # PyTorch classes
 # ==================================================================================================================== #
@@ -1741,3 +1835,17 @@ class TorchReshape(object):
 
     def __call__(self, x):
         return x.view(*self.shape)
+
+
+class TorchAffineScaling(object):
+    def __init__(self, scale=1., offset=0.):
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self._tensors = None
+
+    def __call__(self, x):
+        import torch
+        if self._tensors is None or self._tensors[0].device != x.device:
+            self._tensors = (torch.as_tensor(self.scale, device=x.device),
+                             torch.as_tensor(self.offset, device=x.device))
+        return x * self._tensors[0] + self._tensors[1]
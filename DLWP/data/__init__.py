@@ -6,7 +6,31 @@
 
 """
 Data retrieval classes.
+
+The classes are imported lazily (PEP 562) so that netCDF4 and the optional retrieval backends are only loaded when
+one of them is first accessed.
 """
 
-from .cfsr import CFSReanalysis, CFSReforecast
-from .era5 import ERA5Reanalysis
+from importlib import import_module
+
+_lazy_imports = {
+    'CFSReanalysis': '.cfsr',
+    'CFSReforecast': '.cfsr',
+    'ERA5Reanalysis': '.era5',
+}
+
+__all__ = list(_lazy_imports.keys())
+
+
+def __getattr__(name):
+    try:
+        module_name = _lazy_imports[name]
+    except KeyError:
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+    attr = getattr(import_module(module_name, __name__), name)
+    globals()[name] = attr
+    return attr
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
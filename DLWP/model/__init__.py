@@ -6,12 +6,54 @@
 
 """
 Implementation of deep learning model frameworks for DLWP.
+
+The public classes are imported lazily (PEP 562) so that importing this package does not pull in TensorFlow or
+PyTorch until a class that needs them is actually accessed.
 """
 
-from .models import DLWPNeuralNet, DLWPFunctional
-from .generators import DataGenerator, SeriesDataGenerator, ArrayDataGenerator, tf_data_generator
-from .preprocessing import Preprocessor
-from .extensions import TimeSeriesEstimator, SeriesDataGeneratorWithInference, ArrayDataGeneratorWithInference
+from importlib import import_module
+
+_lazy_imports = {
+    'DLWPNeuralNet': '.models',
+    'DLWPFunctional': '.models',
+    'DataGenerator': '.generators',
+    'SeriesDataGenerator': '.generators',
+    'ArrayDataGenerator': '.generators',
+    'tf_data_generator': '.generators',
+    'SampleIndexPlanner': '.generators',
+    'generator_moments': '.generators',
+    'Preprocessor': '.preprocessing',
+    'RunningMoments': '.preprocessing',
+    'MeanImputer': '.preprocessing',
+    'get_strategy': '.distribute',
+    'is_chief': '.distribute',
+    'worker_shard': '.distribute',
+    'global_batch_size': '.distribute',
+    'launch_workers': '.distribute',
+    'init_process_group': '.distribute_torch',
+    'rank_shard': '.distribute_torch',
+    'launch_ranks': '.distribute_torch',
+    'TimeSeriesEstimator': '.extensions',
+    'ForecastWriter': '.extensions',
+    'SeriesDataGeneratorWithInference': '.extensions',
+    'ArrayDataGeneratorWithInference': '.extensions',
+    'DLWPTorchNN': '.models_torch',
+    'cube_sphere_model': '.zoo',
+    'TorchCubeSphereNet': '.zoo_torch',
+}
+
+__all__ = list(_lazy_imports.keys())
+
+
+def __getattr__(name):
+    try:
+        module_name = _lazy_imports[name]
+    except KeyError:
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+    attr = getattr(import_module(module_name, __name__), name)
+    globals()[name] = attr
+    return attr
 
-from .models_torch import DLWPTorchNN
 
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
@@ -0,0 +1,225 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Data-parallel training of DLWP Keras models with tf.distribute.
+
+A model is replicated on the devices of one process with MirroredStrategy, or on the devices of several processes,
+possibly on several hosts, with MultiWorkerMirroredStrategy. Gradients are averaged over the replicas at every step.
+Processes are configured with the TF_CONFIG environment variable; launch_workers() starts several local processes
+with a TF_CONFIG for each, so that multi-worker training also uses all the cores of a single large CPU node:
+
+    python -m DLWP.model.distribute --workers 4 -- python train.py
+
+In the training script, the strategy must be created before any other TensorFlow operation:
+
+    strategy = get_strategy('auto')
+    index, count = worker_shard()
+    generator = ArrayDataGenerator(..., batch_size=global_batch_size(32, strategy), shard=(index, count))
+    dlwp.build_model(model, strategy=strategy, ...)
+
+Each worker then reads a disjoint shard of the samples, and the DLWP callbacks that write files act only on the chief
+worker. TensorFlow is imported only when needed, so that the launcher does not initialize it.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+
+
+def _tf_config():
+    return json.loads(os.environ.get('TF_CONFIG', '{}'))
+
+
+def worker_shard():
+    """
+    Index of this worker among the workers of the cluster defined by TF_CONFIG, and the number of workers. The chief,
+    if any, is worker 0. This is the shard argument of the DLWP data generators.
+
+    :return: (int, int): worker index and number of workers; (0, 1) without TF_CONFIG
+    """
+    config = _tf_config()
+    cluster, task = config.get('cluster', {}), config.get('task', {})
+    n_chief = len(cluster.get('chief', []))
+    count = n_chief + len(cluster.get('worker', []))
+    if not task or count == 0:
+        return 0, 1
+    if task.get('type') == 'chief':
+        return 0, count
+    if task.get('type') == 'worker':
+        return n_chief + int(task.get('index', 0)), count
+    raise ValueError("TF_CONFIG task type '%s' does not train the model" % task.get('type'))
+
+
+def is_chief():
+    """
+    Whether this process is the chief of its cluster: the 'chief' task, or worker 0 if the cluster has no chief, or
+    the only process without TF_CONFIG. Only the chief should write checkpoints, models and logs.
+
+    :return: bool
+    """
+    config = _tf_config()
+    task = config.get('task', {})
+    if not task:
+        return True
+    if task.get('type') == 'chief':
+        return True
+    return task.get('type') == 'worker' and int(task.get('index', 0)) == 0 and not config['cluster'].get('chief')
+
+
+def get_strategy(strategy=None, gpus=1):
+    """
+    Get a tf.distribute strategy.
+
+    :param strategy: str or tf.distribute.Strategy: the strategy, returned as is if it is already one, or
+        None or 'default': the default strategy, which does not distribute, unless gpus > 1
+        'mirrored': MirroredStrategy on the local GPUs, or on the first gpus of them if gpus > 1, or on the CPU
+        'multi_worker': MultiWorkerMirroredStrategy on the cluster defined by TF_CONFIG
+        'auto': 'multi_worker' if TF_CONFIG defines several workers, 'mirrored' if there are several local GPUs,
+            and otherwise the default strategy
+    :param gpus: int: number of local GPUs for 'mirrored'; gpus > 1 with strategy None selects 'mirrored', for
+        compatibility with the former gpus argument of build_model
+    :return: tf.distribute.Strategy
+    """
+    import tensorflow as tf
+    if isinstance(strategy, tf.distribute.Strategy):
+        return strategy
+    if type(gpus) is not int:
+        raise TypeError("'gpus' argument must be an int")
+    if strategy in [None, 'default'] and gpus > 1:
+        strategy = 'mirrored'
+    if strategy == 'auto':
+        if worker_shard()[1] > 1:
+            strategy = 'multi_worker'
+        elif len(tf.config.list_physical_devices('GPU')) > 1:
+            strategy = 'mirrored'
+        else:
+            strategy = 'default'
+    if strategy in [None, 'default']:
+        return tf.distribute.get_strategy()
+    elif strategy == 'mirrored':
+        devices = ['/gpu:%d' % g for g in range(gpus)] if gpus > 1 else None
+        return tf.distribute.MirroredStrategy(devices=devices)
+    elif strategy == 'multi_worker':
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    raise ValueError("'strategy' must be a tf.distribute.Strategy or one of 'default', 'mirrored', 'multi_worker', "
+                     "or 'auto'")
+
+
+def global_batch_size(per_replica_batch_size, strategy):
+    """
+    Batch size for the data generators, such that each replica of the model sees per_replica_batch_size samples per
+    step. tf.distribute treats each batch of a dataset as a global batch, which it splits between all the replicas, so
+    the generators of every worker yield batches of per_replica_batch_size times strategy.num_replicas_in_sync samples.
+    With sharded generators, each worker consumes the parts of its own batches over several steps.
+
+    :param per_replica_batch_size: int: number of samples per replica per step
+    :param strategy: tf.distribute.Strategy
+    :return: int: global batch size
+    """
+    return int(per_replica_batch_size) * strategy.num_replicas_in_sync
+
+
+def disable_auto_shard(dataset):
+    """
+    Turn off the automatic sharding of a tf.data.Dataset across workers. The DLWP generators are sharded by their
+    shard argument instead, so that each worker only generates its own samples.
+
+    :param dataset: tf.data.Dataset
+    :return: tf.data.Dataset
+    """
+    import tensorflow as tf
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.with_options(options)
+
+
+def clone_in_scope(model, strategy, compile_kwargs=None):
+    """
+    Clone a Keras model, with its weights, under the scope of a strategy, so that its variables are distributed. An
+    optimizer instance in compile_kwargs is also re-created under the scope.
+
+    :param model: keras.models.Model: model built outside the scope
+    :param strategy: tf.distribute.Strategy
+    :param compile_kwargs: dict: kwargs for the model's compile() method
+    :return: (keras.models.Model, dict): clone and compile_kwargs
+    """
+    import tensorflow as tf
+    compile_kwargs = dict(compile_kwargs or {})
+    with strategy.scope():
+        clone = tf.keras.models.clone_model(model)
+        clone.set_weights(model.get_weights())
+        optimizer = compile_kwargs.get('optimizer')
+        if isinstance(optimizer, tf.keras.optimizers.Optimizer):
+            compile_kwargs['optimizer'] = optimizer.__class__.from_config(optimizer.get_config())
+    return clone, compile_kwargs
+
+
+def _free_ports(count):
+    sockets = [socket.socket() for _ in range(count)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def launch_workers(command, workers, hosts=None, threads_per_worker=None, env=None):
+    """
+    Run a command in several local processes, each with a TF_CONFIG for a MultiWorkerMirroredStrategy cluster of all
+    of them, and wait for them to finish.
+
+    :param command: list of str: command to run, e.g. ['python', 'train.py']
+    :param workers: int: number of worker processes
+    :param hosts: list of str: 'host:port' addresses of the workers. Defaults to free local ports.
+    :param threads_per_worker: int: number of TensorFlow intra-op threads per worker. Defaults to the number of CPU
+        cores divided by the number of workers, so that the workers share the cores of the node.
+    :param env: dict: additional environment variables for the workers
+    :return: list of int: return codes of the workers
+    """
+    workers = int(workers)
+    if workers < 1:
+        raise ValueError("'workers' must be a positive integer")
+    if hosts is None:
+        hosts = ['localhost:%d' % port for port in _free_ports(workers)]
+    if len(hosts) != workers:
+        raise ValueError("got %d hosts for %d workers" % (len(hosts), workers))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    processes = []
+    for index in range(workers):
+        worker_env = dict(os.environ, **(env or {}))
+        worker_env['TF_CONFIG'] = json.dumps({'cluster': {'worker': hosts}, 'task': {'type': 'worker', 'index': index}})
+        worker_env['TF_NUM_INTRAOP_THREADS'] = str(threads_per_worker)
+        worker_env['OMP_NUM_THREADS'] = str(threads_per_worker)
+        processes.append(subprocess.Popen(command, env=worker_env))
+    try:
+        return [p.wait() for p in processes]
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+        raise
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a training script in several local multi-worker processes.')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Number of worker processes')
+    parser.add_argument('--threads-per-worker', type=int, dest='threads_per_worker', default=None,
+                        help='TensorFlow intra-op threads per worker (default: CPU cores / workers)')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='Command to run, after --')
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('no command given')
+    codes = launch_workers(command, args.workers, threads_per_worker=args.threads_per_worker)
+    sys.exit(next((code for code in codes if code), 0))
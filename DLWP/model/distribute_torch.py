@@ -0,0 +1,210 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Data-parallel training of DLWPTorchNN models with torch.distributed.
+
+Each rank is a process holding a replica of the model, wrapped in DistributedDataParallel, which averages the
+gradients over the ranks at every step with the gloo backend on the CPU. Ranks are configured with the standard
+RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT environment variables; launch_ranks() starts several local processes
+with these set, so that training uses all the cores of a CPU node, or of several nodes:
+
+    python -m DLWP.model.distribute_torch --ranks 4 -- python train.py
+
+In the training script:
+
+    rank, world_size = init_process_group()
+    generator = ArrayDataGenerator(..., shard=(rank, world_size))
+    dlwp.fit_generator(generator, ...)
+
+DLWPTorchNN.fit_generator then trains in distributed mode: each rank trains on its own disjoint shard of the samples,
+the metrics in the history are averaged over all the ranks, and early stopping and learning rate scheduling act on the
+averaged validation loss, so that all the ranks take the same decisions. torch is imported only when needed, so that
+the launcher does not initialize it.
+"""
+
+import os
+import subprocess
+import sys
+
+from .distribute import _free_ports
+
+
+def _dist():
+    import torch.distributed as dist
+    return dist
+
+
+def is_distributed():
+    """
+    Whether a torch.distributed process group of more than one rank is initialized.
+
+    :return: bool
+    """
+    dist = _dist()
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def rank_shard():
+    """
+    Rank of this process and the number of ranks, from the initialized process group or else from the RANK and
+    WORLD_SIZE environment variables. This is the shard argument of the DLWP data generators.
+
+    :return: (int, int): rank and number of ranks; (0, 1) if not distributed
+    """
+    dist = _dist()
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return int(os.environ.get('RANK', 0)), int(os.environ.get('WORLD_SIZE', 1))
+
+
+def is_main_process():
+    """
+    Whether this process is rank 0, or the only process. Only rank 0 should print progress and write models and logs.
+
+    :return: bool
+    """
+    return rank_shard()[0] == 0
+
+
+def init_process_group(backend='gloo', timeout=None):
+    """
+    Initialize the default torch.distributed process group from the RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT
+    environment variables, as set by launch_ranks() or torchrun. Does nothing if WORLD_SIZE is not set or is 1, or if
+    the group is already initialized.
+
+    :param backend: str: torch.distributed backend
+    :param timeout: datetime.timedelta: timeout of collective operations; defaults to that of torch
+    :return: (int, int): rank and number of ranks
+    """
+    dist = _dist()
+    rank, world_size = rank_shard()
+    if world_size > 1 and not dist.is_initialized():
+        kwargs = {} if timeout is None else {'timeout': timeout}
+        dist.init_process_group(backend, init_method='env://', rank=rank, world_size=world_size, **kwargs)
+    return rank, world_size
+
+
+def all_reduce_sum(values):
+    """
+    Sum a list of floats over all the ranks, in float64. Returns the values unchanged if not distributed.
+
+    :param values: list of float: values on this rank
+    :return: list of float: sums over the ranks
+    """
+    if not is_distributed():
+        return list(values)
+    import torch
+    tensor = torch.tensor(values, dtype=torch.float64)
+    _dist().all_reduce(tensor)
+    return tensor.tolist()
+
+
+def all_gather(value):
+    """
+    Gather a picklable value from all the ranks. Returns [value] if not distributed.
+
+    :param value: value on this rank
+    :return: list: values of all the ranks, in rank order
+    """
+    if not is_distributed():
+        return [value]
+    values = [None] * _dist().get_world_size()
+    _dist().all_gather_object(values, value)
+    return values
+
+
+def broadcast_flag(flag, src=0):
+    """
+    Return the value of a boolean flag on rank src, on all the ranks.
+
+    :param flag: bool: flag on this rank
+    :param src: int: rank whose flag is used
+    :return: bool
+    """
+    if not is_distributed():
+        return bool(flag)
+    import torch
+    tensor = torch.tensor([int(bool(flag))], dtype=torch.int32)
+    _dist().broadcast(tensor, src)
+    return bool(tensor.item())
+
+
+def launch_ranks(command, ranks, nodes=1, node_rank=0, master_addr='localhost', master_port=None,
+                 threads_per_rank=None, env=None):
+    """
+    Run a command in several local processes, each with the environment for one rank of a torch.distributed process
+    group, and wait for them to finish. For several nodes, run launch_ranks on each node with the same ranks, nodes,
+    master_addr and master_port, and node_rank from 0 to nodes - 1.
+
+    :param command: list of str: command to run, e.g. ['python', 'train.py']
+    :param ranks: int: number of ranks on this node
+    :param nodes: int: number of nodes
+    :param node_rank: int: index of this node; the master address must be on node 0
+    :param master_addr: str: address of rank 0
+    :param master_port: int: free port of rank 0. Defaults to a free local port, for a single node.
+    :param threads_per_rank: int: number of torch intra-op threads per rank. Defaults to the number of CPU cores
+        divided by the number of ranks on this node, so that the ranks share the cores of the node.
+    :param env: dict: additional environment variables for the ranks
+    :return: list of int: return codes of the ranks
+    """
+    ranks, nodes, node_rank = int(ranks), int(nodes), int(node_rank)
+    if ranks < 1 or nodes < 1:
+        raise ValueError("'ranks' and 'nodes' must be positive integers")
+    if not 0 <= node_rank < nodes:
+        raise ValueError("'node_rank' must be in the range 0 to nodes - 1")
+    if master_port is None:
+        if nodes > 1:
+            raise ValueError("'master_port' is required for several nodes")
+        master_port = _free_ports(1)[0]
+    if threads_per_rank is None:
+        threads_per_rank = max(1, (os.cpu_count() or 1) // ranks)
+    processes = []
+    for local_rank in range(ranks):
+        rank_env = dict(os.environ, **(env or {}))
+        rank_env.update({
+            'RANK': str(node_rank * ranks + local_rank),
+            'LOCAL_RANK': str(local_rank),
+            'WORLD_SIZE': str(nodes * ranks),
+            'MASTER_ADDR': master_addr,
+            'MASTER_PORT': str(master_port),
+            'OMP_NUM_THREADS': str(threads_per_rank),
+        })
+        processes.append(subprocess.Popen(command, env=rank_env))
+    try:
+        return [p.wait() for p in processes]
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+        raise
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a training script in several local torch.distributed ranks.')
+    parser.add_argument('--ranks', type=int, default=2,
+                        help='Number of ranks on this node')
+    parser.add_argument('--nodes', type=int, default=1,
+                        help='Number of nodes')
+    parser.add_argument('--node-rank', type=int, dest='node_rank', default=0,
+                        help='Index of this node')
+    parser.add_argument('--master-addr', type=str, dest='master_addr', default='localhost',
+                        help='Address of rank 0')
+    parser.add_argument('--master-port', type=int, dest='master_port', default=None,
+                        help='Port of rank 0 (default: a free local port, for a single node)')
+    parser.add_argument('--threads-per-rank', type=int, dest='threads_per_rank', default=None,
+                        help='torch intra-op threads per rank (default: CPU cores / ranks)')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='Command to run, after --')
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('no command given')
+    codes = launch_ranks(command, args.ranks, nodes=args.nodes, node_rank=args.node_rank,
+                         master_addr=args.master_addr, master_port=args.master_port,
+                         threads_per_rank=args.threads_per_rank)
+    sys.exit(next((code for code in codes if code), 0))
@@ -15,6 +15,7 @@ from .models import DLWPNeuralNet, DLWPFunctional
 from .models_torch import DLWPTorchNN
 from .generators import DataGenerator, SeriesDataGenerator, ArrayDataGenerator
 from ..util import insolation
+from ..timing import profiler
 import warnings
 
 
@@ -160,7 +161,7 @@ class TimeSeriesEstimator(object):
         return (self.generator._n_sample,) + self.generator.convolution_shape
 
     def predict(self, steps, samples=(), impute=False, keep_time_dim=False, prefer_first_times=True,
-                f_hour_timedelta_type=False, **kwargs):
+                f_hour_timedelta_type=False, handlers=None, **kwargs):
         """
         Step forward the time series prediction from the model 'steps' times, feeding predictions back in as
         inputs. Predicts for all the data provided in the generator. If there are inputs which are not produced by
@@ -181,11 +182,18 @@ class TimeSeriesEstimator(object):
             output time_steps is less than the input time_steps, we always use all of the output times.
         :param f_hour_timedelta_type: bool: if True, converts f_hour dimension into a timedelta type. May not always be
             compatible with netCDF applications.
+        :param handlers: callable or list of callables: if given, stream the forecast instead of returning it. After
+            each forward step, each handler is called with a DataArray of the forecast hours produced by that step,
+            formatted exactly as the corresponding f_hour slice of the full result. Only one step of the forecast is
+            held in memory, except for DLWPFunctional models without insolation, whose forecast is produced at once.
+            See ForecastWriter for writing the steps to disk.
         :param kwargs: passed to Keras.predict()
-        :return: ndarray: predicted states with forecast_step as the first dimension
+        :return: DataArray: predicted states with f_hour as the first dimension, or None if handlers are given
         """
         if int(steps) < 1:
             raise ValueError('must use positive integer for steps')
+        if handlers is not None and not isinstance(handlers, (list, tuple)):
+            handlers = [handlers]
 
         # Effective forward time steps for each step
         if self._output_time_steps <= self._input_time_steps:
@@ -201,9 +209,20 @@ class TimeSeriesEstimator(object):
                 es = self._output_time_steps
                 in_times = np.arange(self._input_time_steps) + (self._output_time_steps - self._input_time_steps)
         effective_steps = int(np.ceil(steps / es))
+        timer = profiler.stopwatch('TimeSeriesEstimator.predict')
+
+        def emit(block, first_step):
+            # Format the forecast of a block of effective steps and pass it to the handlers
+            block_da = self._format_result(block.copy(), first_step, steps, es, keep_inputs, keep_time_dim,
+                                           prefer_first_times, sample_coord, f_hour_timedelta_type)
+            timer.lap('format')
+            for handler in handlers:
+                handler(block_da)
+            timer.lap('handlers')
 
         # Load data from the generator, without any scaling as this will be done by the model's predict method
         predictors, t = self.generator.generate(samples, scale_and_impute=False)
+        timer.lap('generate')
         p = predictors[0] if isinstance(predictors, (list, tuple)) else predictors
         p_shape = tuple(p.shape)
 
@@ -236,6 +255,7 @@ class TimeSeriesEstimator(object):
         if self.rank == 2:
             p_da = p_da.rename({'x0': 'lat', 'x1': 'lon'}).assign_coords(lat=self.generator.ds.lat,
                                                                          lon=self.generator.ds.lon)
+        timer.lap('metadata')
 
         # Calculate mean for imputing
         if impute:
@@ -256,20 +276,30 @@ class TimeSeriesEstimator(object):
                 result = self.model.predict_timeseries(predictors, steps, keep_time_dim=True,
                                                        **kwargs).reshape((-1,) + t_shape)[:effective_steps, ...]
                 result = result.transpose((0, 1) + tuple(range(2, len(result.shape)))).copy()
+                timer.lap('model')
+                if handlers is not None:
+                    for s in range(result.shape[1]):
+                        emit(result[:, s:s + 1], s)
+                    return
             else:
                 # If insolation is requested, intelligently add it in the same way the generator does
                 sequence_steps = int(np.ceil(steps / self.model._n_steps / self.model.time_dim))
 
-                # Giant forecast array
-                result = np.full((t_shape[0], sequence_steps, self.model._n_steps) + t_shape[1:],
-                                 np.nan, dtype=np.float32)
+                # Giant forecast array, or the array of one step if streaming to handlers
+                result = np.full((t_shape[0], sequence_steps if handlers is None else 1, self.model._n_steps) +
+                                 t_shape[1:], np.nan, dtype=np.float32)
 
                 # Iterate
                 new_t = p_da.sample[:]
                 for s in range(sequence_steps):
+                    r_index = s if handlers is None else 0
                     if 'verbose' in kwargs and kwargs['verbose'] > 0:
                         print('Time step %d/%d' % (s + 1, sequence_steps))
-                    result[:, s] = np.stack(self.model.predict(predictors, **kwargs), axis=1)
+                    result[:, r_index] = np.stack(self.model.predict(predictors, **kwargs), axis=1)
+                    timer.lap('model')
+                    if handlers is not None:
+                        first_step = s * self.model._n_steps
+                        emit(result[:, 0, :effective_steps - first_step], first_step)
 
                     # Assign new insolation to list of inputs
                     new_t = new_t + self._output_time_steps * self.model._n_steps * self._dt
@@ -280,14 +310,15 @@ class TimeSeriesEstimator(object):
                                         axis=-1 if self.channels_last else 1)
                          for n in range(self._input_time_steps)],
                         axis=1) for m in range(self.model._n_steps)]
+                    timer.lap('insolation')
 
                     if self.channels_last:
                         if self.generator._keep_time_axis:
-                            r = result[:, s, -1]
+                            r = result[:, r_index, -1]
                             predictors = [np.concatenate([r, new_insolation[0]], axis=-1).reshape(
                                 (-1,) + self.convolution_shape[1:])] + new_insolation[1:]
                         else:
-                            r = result[:, s, -1].reshape(t_shape[:-1] + (self._output_time_steps, -1)).transpose(
+                            r = result[:, r_index, -1].reshape(t_shape[:-1] + (self._output_time_steps, -1)).transpose(
                                 self._forward_transpose
                             )
                             predictors = [np.concatenate([r, new_insolation[0]], axis=-1).transpose(
@@ -295,38 +326,45 @@ class TimeSeriesEstimator(object):
                                 + new_insolation[1:]
                     else:
                         predictors = [
-                            np.concatenate([result[:, s, -1].reshape((-1,) + self.shape[1:]), new_insolation[0]],
+                            np.concatenate([result[:, r_index, -1].reshape((-1,) + self.shape[1:]), new_insolation[0]],
                                            axis=2).reshape((-1,) + self.convolution_shape[1:])
                         ] + new_insolation[1:]
 
                     # Add constants
                     if self.constants is not None:
                         predictors.append(np.repeat(np.expand_dims(self.constants, axis=0), len(p_da.sample), axis=0))
+                    timer.lap('assign')
 
+                if handlers is not None:
+                    return
                 n_dim_1 = result.size // int(np.prod(t_shape))
                 result.shape = (t_shape[0], n_dim_1,) + t_shape[1:]
                 result = result[:, :effective_steps, ...]
         else:
-            # Giant forecast array
-            result = np.full((t_shape[0], effective_steps,) + t_shape[1:], np.nan, dtype=np.float32)
+            # Giant forecast array, or the array of one step if streaming to handlers
+            result = np.full((t_shape[0], effective_steps if handlers is None else 1,) + t_shape[1:], np.nan,
+                             dtype=np.float32)
 
             # Iterate prediction forward for a regular DLWP Sequential NN
             for s in range(effective_steps):
+                r_index = s if handlers is None else 0
                 if 'verbose' in kwargs and kwargs['verbose'] > 0:
                     print('Time step %d/%d' % (s + 1, effective_steps))
                 if self.channels_last and not self.generator._keep_time_axis:
-                    result[:, s] = self.model.predict(p_da.values.transpose(self._backward_transpose).reshape(p_shape),
-                                                      **kwargs)
+                    result[:, r_index] = self.model.predict(
+                        p_da.values.transpose(self._backward_transpose).reshape(p_shape), **kwargs)
                 else:
-                    result[:, s] = self.model.predict(p_da.values.reshape(p_shape), **kwargs)
+                    result[:, r_index] = self.model.predict(p_da.values.reshape(p_shape), **kwargs)
+                timer.lap('model')
 
                 # Add metadata to the prediction
                 if self.channels_last:
                     if not self.generator._keep_time_axis:
-                        r = result[:, s].reshape((p_shape[0],) + self.generator.convolution_shape[-self.rank-1:-1] +
-                                                 (self._output_time_steps, -1)).transpose(self._forward_transpose)
+                        r = result[:, r_index].reshape(
+                            (p_shape[0],) + self.generator.convolution_shape[-self.rank-1:-1] +
+                            (self._output_time_steps, -1)).transpose(self._forward_transpose)
                     else:
-                        r = result[:, s]
+                        r = result[:, r_index]
                     r_da = xr.DataArray(
                         r,
                         coords=([p_da.sample + (es + self._interval - 1) * self._dt,
@@ -337,7 +375,7 @@ class TimeSeriesEstimator(object):
                     )
                 else:
                     r_da = xr.DataArray(
-                        result[:, s].reshape((p_shape[0], self._output_time_steps, -1,) +
+                        result[:, r_index].reshape((p_shape[0], self._output_time_steps, -1,) +
                                              self.generator.convolution_shape[-self.rank:]),
                         coords=([p_da.sample + (es + self._interval - 1) * self._dt,
                                  np.arange(self._output_time_steps), self._output_sel['varlev']] +
@@ -347,6 +385,7 @@ class TimeSeriesEstimator(object):
                 if self.rank == 2:
                     r_da = r_da.rename({'x0': 'lat', 'x1': 'lon'}).assign_coords(lat=self.generator.ds.lat,
                                                                                  lon=self.generator.ds.lon)
+                timer.lap('metadata')
 
                 # Re-index the predictors to the new forward time step
                 p_da = p_da.reindex(sample=r_da.sample, method=None)
@@ -355,6 +394,7 @@ class TimeSeriesEstimator(object):
                 if impute:
                     # Calculate mean values for the added time steps after re-indexing
                     p_da[-es:] = np.concatenate([p_mean[np.newaxis, ...]] * es)
+                timer.lap('reindex')
 
                 # Take care of the known insolation for added time steps
                 if self._add_insolation:
@@ -362,6 +402,7 @@ class TimeSeriesEstimator(object):
                         np.concatenate([insolation(p_da.sample[-es:] + n * self._dt, self.generator.ds.lat.values,
                                                    self.generator.ds.lon.values)[:, np.newaxis]
                                         for n in range(self._input_time_steps)], axis=1)
+                    timer.lap('insolation')
 
                 # Replace the predictors that exist in the result with the result. Any that do not exist are
                 # automatically inherited from the known predictor data (or imputed data).
@@ -375,29 +416,60 @@ class TimeSeriesEstimator(object):
                     else:
                         p_da.loc[{'varlev': self._outputs_in_inputs['varlev']}] = \
                             r_da.loc[{'varlev': self._outputs_in_inputs['varlev']}][:, -self._input_time_steps:]
+                timer.lap('assign')
+
+                if handlers is not None:
+                    emit(result, s)
+
+        if handlers is not None:
+            timer.stop()
+            return
+
+        result_da = self._format_result(result, 0, steps, es, keep_inputs, keep_time_dim, prefer_first_times,
+                                        sample_coord, f_hour_timedelta_type)
+        timer.lap('format')
+        timer.stop()
+        return result_da
 
+    def _format_result(self, result, first_step, steps, es, keep_inputs, keep_time_dim, prefer_first_times,
+                       sample_coord, f_hour_timedelta_type):
+        """
+        Format the forecast array of consecutive effective steps of the model, starting at first_step, as a DataArray.
+
+        :param result: ndarray: forecast of shape (samples, effective steps, ...) as produced by the model
+        :param first_step: int: index of the first effective step in result
+        :param steps: int: total number of forecast steps requested
+        :param es: int: number of forecast steps per effective step
+        :param keep_inputs: bool: whether the model outputs include the inputs
+        :param keep_time_dim: bool: see predict()
+        :param prefer_first_times: bool: see predict()
+        :param sample_coord: initialization times of the samples
+        :param f_hour_timedelta_type: bool: see predict()
+        :return: DataArray
+        """
         # Return a DataArray. Keep the actual model initialization, that is, the last available time in the inputs,
         # as the time
-        rv = result.view()
+        rv = np.ascontiguousarray(result)
+        n_samples, n_steps = rv.shape[:2]
         if self.channels_last:
             if not self.generator._keep_time_axis:
-                rv.shape = (p_shape[0], effective_steps,) + \
+                rv.shape = (n_samples, n_steps,) + \
                            self.generator.output_convolution_shape[-self.rank-1:-1] + (self._output_time_steps, -1,)
         else:
-            rv.shape = (p_shape[0], effective_steps, self._output_time_steps, -1,) + \
+            rv.shape = (n_samples, n_steps, self._output_time_steps, -1,) + \
                 self.generator.output_convolution_shape[-self.rank:]
         if f_hour_timedelta_type:
             dt = self._dt.values
         else:
             dt = np.array(self._dt.values.astype('timedelta64[h]').astype('float'))
         if keep_time_dim:
+            f_hour = (np.arange(first_step, first_step + n_steps) * (es + self._interval - 1) + 1) * dt
             if self.channels_last:
                 result_da = xr.DataArray(
                     rv.transpose((1, 0) + tuple(range(2, len(rv.shape)))) if self.generator._keep_time_axis else
                     rv.transpose((1, 0, -2) + tuple(range(2, 2 + self.rank)) + (-1,)),
                     coords=[
-                               np.arange(dt, (effective_steps * (es + self._interval - 1) + 1) * dt,
-                                         (es + self._interval - 1) * dt),
+                               f_hour,
                                sample_coord + (self._input_time_steps - 1) * self._dt,
                                range(self._output_time_steps),
                            ]
@@ -410,8 +482,7 @@ class TimeSeriesEstimator(object):
                 result_da = xr.DataArray(
                     rv.transpose((1, 0) + tuple(range(2, len(rv.shape)))),
                     coords=[
-                        np.arange(dt, (effective_steps * (es + self._interval - 1) + 1) * dt,
-                                  (es + self._interval - 1) * dt),
+                        f_hour,
                         sample_coord + (self._input_time_steps - 1) * self._dt,
                         range(self._output_time_steps),
                         self._output_sel['varlev'],
@@ -424,12 +495,14 @@ class TimeSeriesEstimator(object):
                                                                                        lon=self.generator.ds.lon)
         else:
             # To create a correct time series, we must retain only the effective steps
+            f_hour = np.array([(np.arange(0, es) + self._interval + e * (es - 1 + self._interval)) * dt
+                               for e in range(first_step, first_step + n_steps)]).flatten()
             if not keep_inputs:
                 if prefer_first_times:
                     rv = rv[:, :, :es]
             if self.channels_last:
                 if self.generator._keep_time_axis:
-                    rv.shape = (t_shape[0], rv.shape[1] * rv.shape[2]) + rv.shape[3:]
+                    rv.shape = (n_samples, rv.shape[1] * rv.shape[2]) + rv.shape[3:]
                 result_da = xr.DataArray(
                     rv.transpose((1, 0) + tuple(range(2, len(rv.shape)))) if self.generator._keep_time_axis else
                     rv.transpose((1, -2, 0) + tuple(range(2, 2 + self.rank)) + (-1,)).reshape(
@@ -437,8 +510,7 @@ class TimeSeriesEstimator(object):
                         self.generator.output_convolution_shape[-self.rank-1:-1] + (-1,)
                     ),
                     coords=[
-                               np.array([(np.arange(0, es) + self._interval + e * (es - 1 + self._interval)) * dt
-                                         for e in range(effective_steps)]).flatten(),
+                               f_hour,
                                sample_coord + (self._input_time_steps - 1) * self._dt,
                            ]
                     + [np.arange(d) for d in self.generator.output_convolution_shape[-self.rank-1:-1]]
@@ -447,12 +519,11 @@ class TimeSeriesEstimator(object):
                     name='forecast'
                 )
             else:
-                rv.shape = (t_shape[0], rv.shape[1] * rv.shape[2]) + rv.shape[3:]
+                rv.shape = (n_samples, rv.shape[1] * rv.shape[2]) + rv.shape[3:]
                 result_da = xr.DataArray(
                     rv.transpose((1, 0) + tuple(range(2, len(rv.shape)))),
                     coords=[
-                        np.array([(np.arange(0, es) + self._interval + e * (es - 1 + self._interval)) * dt
-                                  for e in range(effective_steps)]).flatten(),
+                        f_hour,
                         sample_coord + (self._input_time_steps - 1) * self._dt,
                         self._output_sel['varlev'],
                     ] + [np.arange(d) for d in self.generator.output_convolution_shape[-self.rank:]],
@@ -462,7 +533,7 @@ class TimeSeriesEstimator(object):
             if self.rank == 2:
                 result_da = result_da.rename({'x0': 'lat', 'x1': 'lon'}).assign_coords(lat=self.generator.ds.lat,
                                                                                        lon=self.generator.ds.lon)
-            result_da = result_da.isel(f_hour=slice(0, steps))
+            result_da = result_da.isel(f_hour=slice(0, max(0, steps - first_step * es)))
 
         # Expand back out to variable/level pairs
         if self._uses_varlev:
@@ -474,11 +545,133 @@ class TimeSeriesEstimator(object):
             spatial_dims = [d for d in result_da.dims if d not in ['f_hour', 'time', 'variable', 'level']]
             if self.channels_last:
                 transpose_dims = ('f_hour', 'time') + tuple(spatial_dims) + ('variable', 'level')
-                result_da = result_da.transpose('f_hour', 'time', 'lat', 'lon', 'variable', 'level')
             else:
                 transpose_dims = ('f_hour', 'time') + ('variable', 'level') + tuple(spatial_dims)
-            result_da = result_da.transpose(*transpose_dims)
-            return result_da
+            return result_da.transpose(*transpose_dims)
+
+
+class ForecastWriter(object):
+    """
+    Writes a forecast to disk one step at a time, for use as a handler of TimeSeriesEstimator.predict:
+
+        writer = ForecastWriter('forecast.nc', scale=sd, offset=mean)
+        estimator.predict(steps, handlers=writer)
+        writer.close()
+
+    Each call appends a DataArray of one or more forecast hours along the append dimension of a netCDF or Zarr store,
+    so that the memory used by the forecast is bounded by one step. Values may be un-normalized and converted on the
+    fly before writing.
+    """
+
+    def __init__(self, path, format='netcdf', append_dim='f_hour', scale=None, offset=None, transform=None,
+                 encoding=None):
+        """
+        :param path: str: path of the output file (netCDF) or directory (Zarr); overwritten on the first write
+        :param format: str: 'netcdf' or 'zarr'
+        :param append_dim: str: dimension along which successive forecast steps are appended
+        :param scale: float or DataArray: if given, multiply the forecast by this before writing, e.g. the standard
+            deviation used to normalize the data, indexed by varlev
+        :param offset: float or DataArray: if given, add this to the forecast (after scale), e.g. the mean used to
+            normalize the data
+        :param transform: callable: if given, applied to the un-normalized forecast DataArray before writing, e.g. for
+            unit conversion
+        :param encoding: dict: encoding of the forecast variable for xarray, e.g. compression options. By default the
+            data are chunked by one element of the append dimension.
+        """
+        if format not in ['netcdf', 'zarr']:
+            raise ValueError("'format' must be 'netcdf' or 'zarr'")
+        if transform is not None and not callable(transform):
+            raise TypeError("'transform' must be callable")
+        self.path = path
+        self.format = format
+        self.append_dim = append_dim
+        self.scale = scale
+        self.offset = offset
+        self.transform = transform
+        self.encoding = encoding or {}
+        self._nc = None
+        self._name = None
+        self._dims = None
+        self._sizes = None
+        self.length = 0
+
+    def _prepare(self, da):
+        if self.append_dim not in da.dims:
+            raise ValueError("the forecast does not have the append dimension '%s'" % self.append_dim)
+        if self.scale is not None:
+            da = da * self.scale
+        if self.offset is not None:
+            da = da + self.offset
+        if self.transform is not None:
+            da = self.transform(da)
+        # netCDF applications do not all understand timedeltas; write forecast hours as floats
+        if 'f_hour' in da.coords:
+            coord = da['f_hour']
+            if np.issubdtype(coord.dtype, np.timedelta64):
+                values = coord.values.astype('timedelta64[s]').astype('float') / 3600.
+                da = da.assign_coords(f_hour=(coord.dims, values, dict(coord.attrs, units='hours')))
+            elif 'units' not in coord.attrs:
+                da = da.assign_coords(f_hour=(coord.dims, coord.values, dict(coord.attrs, units='hours')))
+        return da
+
+    def write(self, da):
+        """
+        Append the forecast steps in a DataArray to the store.
+
+        :param da: DataArray: forecast with the append dimension
+        """
+        da = self._prepare(da)
+        if self.length == 0:
+            self._name = da.name or 'forecast'
+            self._dims = da.dims
+            self._sizes = {d: da.sizes[d] for d in da.dims if d != self.append_dim}
+            ds = da.to_dataset(name=self._name)
+            encoding = {'chunksizes' if self.format == 'netcdf' else 'chunks':
+                        tuple(1 if d == self.append_dim else self._sizes[d] for d in self._dims)}
+            encoding.update(self.encoding)
+            if self.format == 'netcdf':
+                ds.to_netcdf(self.path, mode='w', engine='netcdf4', unlimited_dims=[self.append_dim],
+                             encoding={self._name: encoding})
+            else:
+                ds.to_zarr(self.path, mode='w', encoding={self._name: encoding})
+        else:
+            if da.dims != self._dims or any(da.sizes[d] != n for d, n in self._sizes.items()):
+                raise ValueError('forecast steps must have the same dimensions as the first step written; got %s' %
+                                 dict(da.sizes))
+            if self.format == 'netcdf':
+                import netCDF4
+                if self._nc is None:
+                    self._nc = netCDF4.Dataset(self.path, 'a')
+                n = da.sizes[self.append_dim]
+                coord = self._nc.variables[self.append_dim]
+                values = da[self.append_dim].values
+                if np.issubdtype(values.dtype, np.datetime64):
+                    values = netCDF4.date2num(pd.to_datetime(values).to_pydatetime(), coord.units,
+                                              getattr(coord, 'calendar', 'standard'))
+                coord[self.length:self.length + n] = values
+                index = tuple(slice(self.length, self.length + n) if d == self.append_dim else slice(None)
+                              for d in self._dims)
+                self._nc.variables[self._name][index] = da.values
+            else:
+                da.to_dataset(name=self._name).to_zarr(self.path, append_dim=self.append_dim)
+        self.length += da.sizes[self.append_dim]
+
+    __call__ = write
+
+    def close(self):
+        """
+        Flush and close the store.
+        """
+        if self._nc is not None:
+            self._nc.close()
+            self._nc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
 
 
 class SeriesDataGeneratorWithInference(SeriesDataGenerator):
@@ -514,15 +707,16 @@ class SeriesDataGeneratorWithInference(SeriesDataGenerator):
             raise ValueError("got steps parameter (%s) outside of range 0 to %s" % (inference_steps, self._sequence))
         self.inference_steps = inference_steps
 
-    def generate(self, samples, scale_and_impute=True):
+    def generate(self, samples, scale_and_impute=True, remove_nan=None):
         # Generate data normally
-        p, t = super(SeriesDataGeneratorWithInference, self).generate(samples, scale_and_impute)
+        p, t = super(SeriesDataGeneratorWithInference, self).generate(samples, scale_and_impute,
+                                                                      remove_nan=remove_nan)
 
         # Make a prediction with the inference model
         predicted = self.inference_model.predict(p)
 
         # Insert inference prediction
-        for s in self.steps:
+        for s in self.inference_steps:
             t[s] = predicted[s][:]
 
         # Return modified sample
@@ -562,9 +756,9 @@ class ArrayDataGeneratorWithInference(ArrayDataGenerator):
             raise ValueError("got steps parameter (%s) outside of range 0 to %s" % (inference_steps, self._sequence))
         self.inference_steps = inference_steps
 
-    def generate(self, samples):
+    def generate(self, samples, remove_nan=None):
         # Generate data normally
-        p, t = super(ArrayDataGeneratorWithInference, self).generate(samples)
+        p, t = super(ArrayDataGeneratorWithInference, self).generate(samples, remove_nan=remove_nan)
 
         # Make a prediction with the inference model
         predicted = self.inference_model.predict(p)
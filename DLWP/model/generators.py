@@ -9,12 +9,247 @@ High-level APIs for building data generators. These produce batches of data on-t
 fit_generator() methods.
 """
 
+import threading
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import xarray as xr
 import tensorflow as tf
 from tensorflow.keras.utils import Sequence
-from ..util import delete_nan_samples, insolation, to_bool
+from ..util import delete_nan_samples, insolation, to_bool, nan_sample_mask, valid_sample_mask, compact_samples
+from ..timing import profiler
+from .distribute import disable_auto_shard
+from .preprocessing import RunningMoments
+
+
+class SampleIndexPlanner(object):
+    """
+    Class used by the data generators to build and order the index of samples for each epoch. A sample is identified by
+    the index of the first time step of its window of input and output time steps. The index of valid samples is built
+    once as a compact int32 array, excluding windows which straddle gaps in the time coordinate or which contain
+    missing values. Each epoch, the index is ordered according to the shuffle mode and optionally split into
+    deterministic, disjoint shards for data-parallel training.
+    """
+
+    def __init__(self, n_time, input_time_steps=1, output_time_steps=1, interval=1, times=None, valid_in=None,
+                 valid_out=None, shuffle=False, block_size=32, reservoir=None, seed=None, shard=None):
+        """
+        Initialize a SampleIndexPlanner.
+
+        :param n_time: int: number of time steps in the data
+        :param input_time_steps: int: number of input time steps in a sample
+        :param output_time_steps: int: total number of output time steps in a sample, including all sequence steps
+        :param interval: int: number of data time steps between the time steps of a sample
+        :param times: array-like of datetime64: time coordinate of the data. If given, samples whose time steps are not
+            evenly spaced by the most common time step of the data are excluded, and the seasons of samples are known.
+        :param valid_in: ndarray of bool: per-time-step validity (no NaN) of the input data, or None
+        :param valid_out: ndarray of bool: per-time-step validity (no NaN) of the output data, or None
+        :param shuffle: bool or str: order of samples in each epoch
+            if False: samples in time order
+            if True or 'random': random permutation
+            if 'blocked': blocks of block_size consecutive samples in random order; preserves locality of data access
+            if 'season': random order stratified by meteorological season, so that seasons are evenly mixed
+                throughout the epoch. Requires times.
+        :param block_size: int: number of consecutive samples in a block for 'blocked' shuffling. For data read lazily
+            from disk, this should be the chunk size of the data along the time dimension.
+        :param reservoir: int: for 'blocked' shuffling, additionally shuffle the samples within a bounded reservoir of
+            this many samples: each sample is drawn at random from the next `reservoir` samples in block order. Samples
+            are then well mixed while data access stays within a few consecutive blocks.
+        :param seed: int: random seed. With a seed, the order in each epoch is deterministic. Required to be the same on
+            all ranks when using shards; defaults to 0 in that case.
+        :param shard: tuple of (index, count): if given, each epoch yields only the index-th of count disjoint, equal-
+            length shards of the ordered samples. Up to count - 1 samples are dropped each epoch to equalize shards.
+        """
+        if shuffle is True:
+            shuffle = 'random'
+        if shuffle not in [False, None, 'random', 'blocked', 'season']:
+            raise ValueError("'shuffle' must be a bool or one of 'random', 'blocked', or 'season'")
+        if shuffle == 'season' and times is None:
+            raise ValueError("'season' shuffling requires the 'times' of the data")
+        self.shuffle = shuffle or False
+        self.block_size = int(block_size)
+        if self.block_size < 1:
+            raise ValueError("'block_size' must be a positive integer")
+        self.reservoir = int(reservoir) if reservoir is not None else None
+        if shard is None:
+            shard = (0, 1)
+        self.shard_index, self.num_shards = int(shard[0]), int(shard[1])
+        if not 0 <= self.shard_index < self.num_shards:
+            raise ValueError("invalid shard %s; must be (index, count) with 0 <= index < count" % (shard,))
+        if seed is None and self.num_shards > 1:
+            seed = 0
+        self.seed = seed
+        self._epoch = 0
+
+        # Find the valid window starts
+        n_sample = max(n_time - interval * (input_time_steps + output_time_steps) + 1, 0)
+        valid = np.ones(n_sample, dtype=bool)
+        if valid_in is not None:
+            for n in range(input_time_steps):
+                valid &= valid_in[n * interval:n * interval + n_sample]
+        if valid_out is not None:
+            for n in range(output_time_steps):
+                offset = interval * (input_time_steps + n)
+                valid &= valid_out[offset:offset + n_sample]
+        if times is not None and n_sample > 0:
+            valid &= self._contiguous_windows(np.asarray(times), n_sample,
+                                              interval * (input_time_steps + output_time_steps - 1) + 1)
+        self.n_sample = n_sample
+        self.index = np.flatnonzero(valid).astype(np.int32)
+
+        # Season of each sample: 0 for DJF, 1 for MAM, 2 for JJA, 3 for SON
+        if times is not None:
+            months = np.asarray(times)[self.index].astype('datetime64[M]').astype(np.int64) % 12 + 1
+            self.seasons = (months % 12) // 3
+        else:
+            self.seasons = None
+
+    @staticmethod
+    def _contiguous_windows(times, n_sample, window_length):
+        # A window is contiguous if all of the time differences it spans equal the most common time difference
+        diff = np.diff(times)
+        if len(diff) == 0:
+            return np.ones(n_sample, dtype=bool)
+        values, counts = np.unique(diff, return_counts=True)
+        irregular = np.concatenate([[0], np.cumsum(diff != values[np.argmax(counts)])])
+        return irregular[window_length - 1:window_length - 1 + n_sample] - irregular[:n_sample] == 0
+
+    @staticmethod
+    def _reservoir_shuffle(order, size, rng):
+        # Emit samples at random from a buffer holding the next `size` samples of the given order
+        if len(order) <= size:
+            return order[rng.permutation(len(order))]
+        result = np.empty_like(order)
+        buffer = order[:size].copy()
+        draws = rng.randint(0, size, len(order) - size)
+        for j, (sample, k) in enumerate(zip(order[size:], draws)):
+            result[j] = buffer[k]
+            buffer[k] = sample
+        result[len(order) - size:] = buffer[rng.permutation(size)]
+        return result
+
+    def __len__(self):
+        """
+        :return: the number of samples yielded per epoch
+        """
+        return len(self.index) // self.num_shards
+
+    def plan(self, epoch=None):
+        """
+        Return the ordered samples for an epoch.
+
+        :param epoch: int: epoch number, used with the seed for deterministic ordering. If None, uses an internal
+            counter which is incremented with each call.
+        :return: ndarray of int32: sample indices
+        """
+        if epoch is None:
+            epoch = self._epoch
+            self._epoch += 1
+        if self.seed is None:
+            rng = np.random
+        else:
+            rng = np.random.RandomState((int(self.seed) + int(epoch)) % 2 ** 32)
+        n = len(self.index)
+
+        if self.shuffle == 'random':
+            order = self.index[rng.permutation(n)]
+        elif self.shuffle == 'blocked':
+            block = np.arange(n) // self.block_size
+            block_order = rng.permutation(block[-1] + 1 if n > 0 else 0)
+            order = self.index[np.lexsort((np.arange(n), block_order[block]))]
+            if self.reservoir is not None and self.reservoir > 1:
+                order = self._reservoir_shuffle(order, self.reservoir, rng)
+        elif self.shuffle == 'season':
+            key = np.empty(n)
+            for season in np.unique(self.seasons):
+                members = rng.permutation(np.flatnonzero(self.seasons == season))
+                key[members] = (np.arange(len(members)) + rng.uniform(size=len(members))) / len(members)
+            order = self.index[np.argsort(key, kind='stable')]
+        else:
+            order = self.index.copy()
+
+        if self.num_shards > 1:
+            length = n // self.num_shards
+            order = order[self.shard_index * length:(self.shard_index + 1) * length]
+        return order
+
+
+class ChunkCache(object):
+    """
+    Least-recently-used cache of contiguous chunks of a lazily-loaded (e.g. dask-backed) DataArray along its first
+    dimension. Used by the SeriesDataGenerator when data are not loaded into memory, so that each chunk on disk is read
+    once while it is in use rather than once for every sample taken from it.
+    """
+
+    def __init__(self, da, max_chunks=8, chunk_size=None):
+        """
+        Initialize a ChunkCache.
+
+        :param da: xarray DataArray: data to cache; the first dimension is the sample (time) dimension
+        :param max_chunks: int: maximum number of chunks held in memory
+        :param chunk_size: int: size of chunks along the first dimension. Defaults to the dask chunks of da, if any, or
+            otherwise 32.
+        """
+        self.da = da
+        self.max_chunks = int(max_chunks)
+        if self.max_chunks < 1:
+            raise ValueError("'max_chunks' must be a positive integer")
+        n = da.shape[0]
+        if chunk_size is None and da.chunks is not None:
+            sizes = da.chunks[0]
+        else:
+            chunk_size = int(chunk_size or 32)
+            sizes = [chunk_size] * (n // chunk_size) + ([n % chunk_size] if n % chunk_size else [])
+        self.bounds = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_chunk(self, c):
+        # The cache may be shared by threads (see generator_moments); chunks are read outside of the lock
+        with self._lock:
+            chunk = self._chunks.pop(c, None)
+            if chunk is not None:
+                self.hits += 1
+                self._chunks[c] = chunk
+                return chunk
+        chunk = self.da[self.bounds[c]:self.bounds[c + 1]].values
+        with self._lock:
+            self.misses += 1
+            self._chunks.pop(c, None)
+            while len(self._chunks) >= self.max_chunks:
+                self._chunks.popitem(last=False)
+            self._chunks[c] = chunk
+        return chunk
+
+    def take(self, indices):
+        """
+        Return the data at the given indices along the first dimension.
+
+        :param indices: array-like of int: indices to take
+        :return: ndarray
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        chunk_ids = np.searchsorted(self.bounds, indices, side='right') - 1
+        result = None
+        for c in np.unique(chunk_ids):
+            chunk = self._get_chunk(c)
+            if result is None:
+                result = np.empty((len(indices),) + chunk.shape[1:], dtype=chunk.dtype)
+            rows = chunk_ids == c
+            result[rows] = chunk[indices[rows] - self.bounds[c]]
+        if result is None:
+            result = np.empty((0,) + self.da.shape[1:], dtype=self.da.dtype)
+        return result
+
+    def clear(self):
+        """
+        Empty the cache.
+        """
+        with self._lock:
+            self._chunks.clear()
 
 
 class DataGenerator(Sequence):
@@ -23,15 +258,23 @@ class DataGenerator(Sequence):
     of the EnsembleSelector to do scaling and imputing of data.
     """
 
-    def __init__(self, model, ds, batch_size=32, shuffle=False, remove_nan=True):
+    def __init__(self, model, ds, batch_size=32, shuffle=False, remove_nan=True, nan_index=False, seed=None,
+                 shard=None):
         """
         Initialize a DataGenerator.
 
         :param model: instance of a DLWP model
         :param ds: xarray Dataset: predictor dataset. Should have attributes 'predictors' and 'targets'
         :param batch_size: int: number of samples to take at a time from the dataset
-        :param shuffle: bool: if True, randomly select batches
+        :param shuffle: bool or str: if True, randomly select batches. May also be 'blocked' or 'season'; see
+            SampleIndexPlanner.
         :param remove_nan: bool: if True, remove any samples with NaNs
+        :param nan_index: bool: if True, scan the dataset once for samples with NaNs and exclude them from the index
+            of batches, so that batches no longer need to be checked for NaNs. Samples passed explicitly to generate()
+            are still checked if remove_nan is True.
+        :param seed: int: random seed for deterministic shuffling; see SampleIndexPlanner
+        :param shard: tuple of (index, count): yield only one of count disjoint shards of the samples each epoch, for
+            data-parallel training; see SampleIndexPlanner
         """
         self.model = model
         if not hasattr(ds, 'predictors') or not hasattr(ds, 'targets'):
@@ -47,6 +290,14 @@ class DataGenerator(Sequence):
         self._n_sample = ds.dims['sample']
         self._has_time_step = 'time_step' in ds.dims
 
+        # Index of the samples used for batches, optionally excluding samples with NaN
+        self._nan_index = nan_index
+        valid = None
+        if self._nan_index:
+            valid = valid_sample_mask(ds.predictors) & valid_sample_mask(ds.targets)
+        self.planner = SampleIndexPlanner(self._n_sample, 1, 0, valid_in=valid, shuffle=shuffle,
+                                          block_size=batch_size, seed=seed, shard=shard)
+
         self.on_epoch_end()
 
     @property
@@ -102,11 +353,11 @@ class DataGenerator(Sequence):
             return self.convolution_shape
 
     def on_epoch_end(self):
-        self._indices = np.arange(self._n_sample)
-        if self._shuffle:
-            np.random.shuffle(self._indices)
+        self._indices = self.planner.plan()
 
-    def generate(self, samples, scale_and_impute=True):
+    def generate(self, samples, scale_and_impute=True, remove_nan=None):
+        if remove_nan is None:
+            remove_nan = self._remove_nan
         if len(samples) > 0:
             ds = self.ds.isel(sample=samples)
         else:
@@ -117,11 +368,20 @@ class DataGenerator(Sequence):
         ds.close()
         ds = None
 
+        # Samples selected by index are copies, but all the samples of an in-memory dataset are views of the caller's
+        # data, which must not be modified in place
+        owned = len(samples) > 0
+
         # Remove samples with NaN; scale and impute
-        if self._remove_nan:
-            p, t = delete_nan_samples(p, t)
+        if remove_nan:
+            p_in = p
+            p, t = delete_nan_samples(p, t, in_place=owned)
+            owned = owned or p is not p_in
+            n_sample = p.shape[0]
         if scale_and_impute:
             if self._impute_missing:
+                if not owned:
+                    p, t = p.copy(), t.copy()
                 p, t = self.model.imputer_transform(p, t)
             p, t = self.model.scaler_transform(p, t)
 
@@ -139,7 +399,7 @@ class DataGenerator(Sequence):
         """
         :return: the number of batches per epoch
         """
-        return int(np.ceil(self._n_sample / self._batch_size))
+        return int(np.ceil(len(self._indices) / self._batch_size))
 
     def __getitem__(self, index):
         """
@@ -155,7 +415,7 @@ class DataGenerator(Sequence):
         indexes = self._indices[index * self._batch_size:(index + 1) * self._batch_size]
 
         # Generate data
-        X, y = self.generate(indexes)
+        X, y = self.generate(indexes, remove_nan=self._remove_nan and not self._nan_index)
 
         return X, y
 
@@ -173,7 +433,8 @@ class SeriesDataGenerator(Sequence):
 
     def __init__(self, model, ds, rank=2, input_sel=None, output_sel=None, input_time_steps=1, output_time_steps=1,
                  sequence=None, interval=1, add_insolation=False, batch_size=32, shuffle=False, remove_nan=True,
-                 load='required', delay_load=False, constants=None, channels_last=False, drop_remainder=False):
+                 nan_index=False, load='required', delay_load=False, constants=None, channels_last=False,
+                 drop_remainder=False, seed=None, shard=None, planner=None, reservoir=None, cache_chunks=None):
         """
         Initialize a SeriesDataGenerator.
 
@@ -197,10 +458,14 @@ class SeriesDataGenerator(Sequence):
             if 'hourly': same as True
             if 'daily': add the daily max insolation without diurnal cycle
         :param batch_size: int: number of samples to take at a time from the dataset
-        :param shuffle: bool: if True, randomly select batches
+        :param shuffle: bool or str: if True, randomly select batches. May also be 'blocked' or 'season'; see
+            SampleIndexPlanner.
         :param remove_nan: bool: if True, remove any samples with NaNs
+        :param nan_index: bool: if True, scan the data once for time steps with NaNs and exclude any samples whose
+            inputs or outputs contain them from the index of batches, so that batches no longer need to be checked for
+            NaNs. Samples passed explicitly to generate() are still checked if remove_nan is True.
         :param load: str: option for loading data into memory. If it evaluates to negative, no memory loading is done.
-            THIS IS LIKELY VERY SLOW.
+            THIS IS LIKELY VERY SLOW, unless used with cache_chunks and shuffle=False or 'blocked'.
             'full': load the full dataset. May use a lot of memory.
             'required': load only the required variables, but this also loads two separate datasets for predictors and
                 targets
@@ -214,6 +479,17 @@ class SeriesDataGenerator(Sequence):
         :param channels_last: bool: if True, returns data with channels as the last dimension. May slow down processing
             of data, but may speed up GPU operations on the data.
         :param drop_remainder: bool: if True, ignore the last batch of data if it is smaller than the batch size
+        :param seed: int: random seed for deterministic shuffling; see SampleIndexPlanner
+        :param shard: tuple of (index, count): yield only one of count disjoint shards of the samples each epoch, for
+            data-parallel training; see SampleIndexPlanner
+        :param planner: SampleIndexPlanner: use this planner for the index of batches instead of the default one. By
+            default, samples straddling gaps in a datetime 'sample' coordinate are excluded.
+        :param reservoir: int: with shuffle='blocked', also shuffle samples within a reservoir of this many samples.
+            With dask-chunked data, blocks default to the chunks along 'sample', so that reads stay sequential.
+        :param cache_chunks: int: if load is False, keep up to this many chunks of the data along 'sample' in a
+            least-recently-used cache (see ChunkCache) instead of reading the data anew for each batch. Best used with
+            shuffle=False or 'blocked'. Since sample windows extend into the following chunk, the cache should hold
+            about twice the number of chunks spanned by the reservoir, plus two.
         """
         self.model = model
         if not hasattr(ds, 'predictors'):
@@ -264,6 +540,9 @@ class SeriesDataGenerator(Sequence):
             self.da = self.ds.predictors
 
         self.rank = rank
+        self._cache_chunks = cache_chunks
+        self._input_cache = None
+        self._output_cache = None
         self._input_sel = input_sel or {}
         if len(self._input_sel) == 0:
             if 'varlev' in self.ds.variables.keys():
@@ -287,6 +566,27 @@ class SeriesDataGenerator(Sequence):
         if not delay_load:
             self._load_data()
 
+        # Index of the samples used for batches, optionally excluding samples with NaN
+        self._nan_index = nan_index
+        if planner is None:
+            valid_in = valid_out = None
+            if self._nan_index:
+                if self._is_loaded:
+                    valid_in = valid_sample_mask(self.input_da)
+                    valid_out = valid_sample_mask(self.output_da)
+                else:
+                    valid_in = valid_sample_mask(self.da.sel(**self._input_sel))
+                    valid_out = valid_sample_mask(self.da.sel(**self._output_sel))
+            times = self.da.sample.values
+            if not np.issubdtype(times.dtype, np.datetime64):
+                times = None
+            block_size = self.da.chunks[0][0] if self.da.chunks is not None else batch_size
+            planner = SampleIndexPlanner(self.da.shape[0], self._input_time_steps,
+                                         self._output_time_steps * (sequence or 1), self._interval, times=times,
+                                         valid_in=valid_in, valid_out=valid_out, shuffle=shuffle,
+                                         block_size=block_size, reservoir=reservoir, seed=seed, shard=shard)
+        self.planner = planner
+
         self.on_epoch_end()
 
         # Pre-generate the insolation data
@@ -344,8 +644,21 @@ class SeriesDataGenerator(Sequence):
             if self._load == 'required':
                 self.input_da.load()
                 self.output_da.load()
+        if not self._load and self._cache_chunks:
+            self._input_cache = ChunkCache(self.input_da, self._cache_chunks)
+            self._output_cache = ChunkCache(self.output_da, self._cache_chunks)
         self._is_loaded = True
 
+    def _input_values(self, indices):
+        if self._input_cache is not None:
+            return self._input_cache.take(indices)
+        return self.input_da.values[indices]
+
+    def _output_values(self, indices):
+        if self._output_cache is not None:
+            return self._output_cache.take(indices)
+        return self.output_da.values[indices]
+
     @property
     def shape(self):
         """
@@ -476,23 +789,26 @@ class SeriesDataGenerator(Sequence):
             return tuple((self._input_time_steps, 1) + self.convolution_shape[-self.rank:])
 
     def on_epoch_end(self):
-        self._indices = np.arange(self._n_sample)
-        if self._shuffle:
-            np.random.shuffle(self._indices)
+        self._indices = self.planner.plan()
 
-    def generate(self, samples, scale_and_impute=True):
+    def generate(self, samples, scale_and_impute=True, remove_nan=None):
+        if remove_nan is None:
+            remove_nan = self._remove_nan
         if len(samples) == 0:
-            samples = np.arange(self._n_sample, dtype=np.int)
+            samples = np.arange(self._n_sample, dtype=int)
         else:
-            samples = np.array(samples, dtype=np.int)
+            samples = np.array(samples, dtype=int)
         n_sample = len(samples)
+        timer = profiler.stopwatch('SeriesDataGenerator.generate')
 
         if not self._is_loaded:
             self._load_data()
+            timer.lap('load')
 
         # Predictors
-        p = np.concatenate([self.input_da.values[samples + n * self._interval, np.newaxis]
+        p = np.concatenate([self._input_values(samples + n * self._interval)[:, np.newaxis]
                             for n in range(self._input_time_steps)], axis=1)
+        timer.lap('inputs')
         if self._add_insolation:
             insol = []
             if self._sequence is not None:
@@ -510,6 +826,7 @@ class SeriesDataGenerator(Sequence):
                                     for n in range(self._input_time_steps)], axis=1)
                 )
             p = np.concatenate([p, insol[0]], axis=2)
+            timer.lap('insolation')
         p = p.reshape((n_sample, -1))
 
         # Targets, including sequence if desired
@@ -517,21 +834,28 @@ class SeriesDataGenerator(Sequence):
             targets = []
             for s in range(self._sequence):
                 t = np.concatenate(
-                    [self.output_da.values[samples + self._interval * (
-                            self._input_time_steps + self._output_time_steps * s + n), np.newaxis]
+                    [self._output_values(samples + self._interval * (
+                            self._input_time_steps + self._output_time_steps * s + n))[:, np.newaxis]
                      for n in range(self._output_time_steps)],
                     axis=1
                 )
+                targets.append(t.reshape((n_sample, -1)))
+            timer.lap('targets')
+
+            # Remove samples with NaN in the inputs or in any step of the targets
+            if remove_nan:
+                p, targets, insol, n_sample = _remove_nan_sequence(p, targets, insol if self._add_insolation else [])
+                timer.lap('remove_nan')
 
-                t = t.reshape((n_sample, -1))
+            for s in range(self._sequence):
+                t = targets[s]
 
-                # Remove samples with NaN; scale and impute
-                if self._remove_nan:
-                    p, t = delete_nan_samples(p, t)
+                # Scale and impute
                 if scale_and_impute:
                     if self._impute_missing:
                         p, t = self.model.imputer_transform(p, t)
                     p, t = self.model.scaler_transform(p, t)
+                    timer.lap('scale')
 
                 # Format spatial shape for convolutions; also takes care of time axis
                 if self._is_convolutional:
@@ -543,26 +867,30 @@ class SeriesDataGenerator(Sequence):
                 elif self._keep_time_axis:
                     p = p.reshape((n_sample,) + self.dense_shape)
                     t = t.reshape((n_sample,) + self.output_dense_shape)
+                timer.lap('reshape')
 
-                targets.append(t)
+                targets[s] = t
 
             # Sequence of inputs (plus insolation) for predictors
             if self._add_insolation:
                 p = [p] + insol[1:]
         else:
-            t = np.concatenate([self.output_da.values[samples + self._interval * (self._input_time_steps + n),
-                                                      np.newaxis]
-                                for n in range(self._output_time_steps)], axis=1)
+            t = np.concatenate([self._output_values(samples + self._interval * (self._input_time_steps + n))[
+                                    :, np.newaxis] for n in range(self._output_time_steps)], axis=1)
 
             t = t.reshape((n_sample, -1))
+            timer.lap('targets')
 
             # Remove samples with NaN; scale and impute
-            if self._remove_nan:
-                p, t = delete_nan_samples(p, t)
+            if remove_nan:
+                p, t = delete_nan_samples(p, t, in_place=True)
+                n_sample = p.shape[0]
+                timer.lap('remove_nan')
             if scale_and_impute:
                 if self._impute_missing:
                     p, t = self.model.imputer_transform(p, t)
                 p, t = self.model.scaler_transform(p, t)
+                timer.lap('scale')
 
             # Format spatial shape for convolutions; also takes care of time axis
             if self._is_convolutional:
@@ -574,6 +902,7 @@ class SeriesDataGenerator(Sequence):
             elif self._keep_time_axis:
                 p = p.reshape((n_sample,) + self.dense_shape)
                 t = t.reshape((n_sample,) + self.output_dense_shape)
+            timer.lap('reshape')
 
             targets = t
 
@@ -586,6 +915,7 @@ class SeriesDataGenerator(Sequence):
                 p = p + [constants]
             else:
                 p = [p, constants]
+            timer.lap('constants')
 
         # Transpose to channels_last if requested
         if self.channels_last:
@@ -602,7 +932,10 @@ class SeriesDataGenerator(Sequence):
                     targets[s] = targets[s].transpose(self._transpose)
             else:
                 targets = targets.transpose(self._transpose)
+            timer.lap('transpose')
 
+        timer.stop()
+        profiler.count('SeriesDataGenerator.generate/samples', n_sample)
         return p, targets
 
     def __len__(self):
@@ -610,9 +943,9 @@ class SeriesDataGenerator(Sequence):
         :return: the number of batches per epoch
         """
         if self.drop_remainder:
-            return int(np.floor(self._n_sample / self._batch_size))
+            return int(np.floor(len(self._indices) / self._batch_size))
         else:
-            return int(np.ceil(self._n_sample / self._batch_size))
+            return int(np.ceil(len(self._indices) / self._batch_size))
 
     def __getitem__(self, index):
         """
@@ -628,7 +961,7 @@ class SeriesDataGenerator(Sequence):
         indexes = self._indices[index * self._batch_size:(index + 1) * self._batch_size]
 
         # Generate data
-        X, y = self.generate(indexes)
+        X, y = self.generate(indexes, remove_nan=self._remove_nan and not self._nan_index)
 
         return X, y
 
@@ -643,8 +976,8 @@ class ArrayDataGenerator(Sequence):
 
     def __init__(self, model, array, rank=2, batch_size=32, input_slice=None, output_slice=None,
                  input_time_steps=1, output_time_steps=1, sequence=None, interval=1,
-                 shuffle=False, remove_nan=True, insolation_array=None, constants=None, channels_last=False,
-                 drop_remainder=False):
+                 shuffle=False, remove_nan=True, nan_index=False, insolation_array=None, constants=None,
+                 channels_last=False, drop_remainder=False, times=None, seed=None, shard=None, planner=None):
         """
         Initialize an ArrayDataGenerator.
 
@@ -663,14 +996,24 @@ class ArrayDataGenerator(Sequence):
             insolation fields.
         :param interval: int: the number of steps to take between data samples and within input/output time steps.
             Effectively it is the model delta t multiplier for the data resolution.
-        :param shuffle: bool: if True, randomly select batches
+        :param shuffle: bool or str: if True, randomly select batches. May also be 'blocked' or 'season'; see
+            SampleIndexPlanner.
         :param remove_nan: bool: if True, remove any samples with NaNs
+        :param nan_index: bool: if True, scan the array once for time steps with NaNs and exclude any samples whose
+            inputs or outputs contain them from the index of batches, so that batches no longer need to be checked for
+            NaNs. Samples passed explicitly to generate() are still checked if remove_nan is True.
         :param insolation_array: np.array: insolation (see DLWP.util.insolation) for the given data
         :param constants: ndarray: additional constant fields to add to each input. Must match the spatial dimensions
             (last `rank` dimensions) of the input data.
         :param channels_last: bool: if True, returns data with channels as the last dimension. May slow down processing
             of data, but may speed up GPU operations on the data.
         :param drop_remainder: bool: if True, ignore the last batch of data if it is smaller than the batch size
+        :param times: array-like of datetime64: time coordinate of the array. If given, samples straddling gaps in time
+            are excluded from the index of batches, and 'season' shuffling is possible.
+        :param seed: int: random seed for deterministic shuffling; see SampleIndexPlanner
+        :param shard: tuple of (index, count): yield only one of count disjoint shards of the samples each epoch, for
+            data-parallel training; see SampleIndexPlanner
+        :param planner: SampleIndexPlanner: use this planner for the index of batches instead of the default one
         """
         assert int(rank) > 0
         assert int(input_time_steps) > 0
@@ -711,14 +1054,28 @@ class ArrayDataGenerator(Sequence):
         else:
             self._output_size = len(self._output_slice)
 
+        # Index of the samples used for batches, optionally excluding samples with NaN
+        self._nan_index = nan_index
+        if planner is None:
+            valid_in = valid_out = None
+            if self._nan_index:
+                valid_in = valid_sample_mask(array, (self._input_slice,))
+                valid_out = valid_sample_mask(array, (self._output_slice,))
+            planner = SampleIndexPlanner(array.shape[0], self._input_time_steps,
+                                         self._output_time_steps * (sequence or 1), self._interval, times=times,
+                                         valid_in=valid_in, valid_out=valid_out, shuffle=shuffle,
+                                         block_size=batch_size, seed=seed, shard=shard)
+        self.planner = planner
+
         self.on_epoch_end()
 
         # Add insolation
         self.insolation_array = insolation_array
         self._add_insolation = 1 if self.insolation_array is not None else 0
-        assert self.insolation_array.shape[-self.rank:] == self.shape[-self.rank:], \
-            "spatial dimensions of insolation must be the same as input data; got %s and %s" % \
-            (self.insolation_array.shape[-self.rank:], self.shape[-self.rank:])
+        if self._add_insolation:
+            assert self.insolation_array.shape[-self.rank:] == self.shape[-self.rank:], \
+                "spatial dimensions of insolation must be the same as input data; got %s and %s" % \
+                (self.insolation_array.shape[-self.rank:], self.shape[-self.rank:])
 
         # Add extra constants
         self.constants = constants
@@ -865,15 +1222,15 @@ class ArrayDataGenerator(Sequence):
             return tuple((self._input_time_steps, 1) + self.convolution_shape[-self.rank:])
 
     def on_epoch_end(self):
-        self._indices = np.arange(self._n_sample)
-        if self._shuffle:
-            np.random.shuffle(self._indices)
+        self._indices = self.planner.plan()
 
-    def generate(self, samples):
+    def generate(self, samples, remove_nan=None):
+        if remove_nan is None:
+            remove_nan = self._remove_nan
         if len(samples) == 0:
-            samples = np.arange(self._n_sample, dtype=np.int)
+            samples = np.arange(self._n_sample, dtype=int)
         else:
-            samples = np.array(samples, dtype=np.int)
+            samples = np.array(samples, dtype=int)
         n_sample = len(samples)
 
         # Predictors
@@ -908,12 +1265,14 @@ class ArrayDataGenerator(Sequence):
                      for n in range(self._output_time_steps)],
                     axis=1
                 )
+                targets.append(t.reshape((n_sample, -1)))
 
-                t = t.reshape((n_sample, -1))
+            # Remove samples with NaN in the inputs or in any step of the targets
+            if remove_nan:
+                p, targets, insol, n_sample = _remove_nan_sequence(p, targets, insol if self._add_insolation else [])
 
-                # Remove samples with NaN if requested
-                if self._remove_nan:
-                    p, t = delete_nan_samples(p, t)
+            for s in range(self._sequence):
+                t = targets[s]
 
                 # Format spatial shape for convolutions; also takes care of time axis
                 if self._is_convolutional:
@@ -926,21 +1285,22 @@ class ArrayDataGenerator(Sequence):
                     p = p.reshape((n_sample,) + self.dense_shape)
                     t = t.reshape((n_sample,) + self.output_dense_shape)
 
-                targets.append(t)
+                targets[s] = t
 
             # Sequence of inputs (plus insolation) for predictors
             if self._add_insolation:
                 p = [p] + insol[1:]
         else:
             t = np.concatenate([self.array[samples + self._interval * (self._input_time_steps + n),
-                                           np.newaxis, self._output_slice]
+                                           self._output_slice][:, np.newaxis]
                                 for n in range(self._output_time_steps)], axis=1)
 
             t = t.reshape((n_sample, -1))
 
             # Remove samples with NaN if requested
-            if self._remove_nan:
-                p, t = delete_nan_samples(p, t)
+            if remove_nan:
+                p, t = delete_nan_samples(p, t, in_place=True)
+                n_sample = p.shape[0]
 
             # Format spatial shape for convolutions; also takes care of time axis
             if self._is_convolutional:
@@ -988,9 +1348,9 @@ class ArrayDataGenerator(Sequence):
         :return: the number of batches per epoch
         """
         if self.drop_remainder:
-            return int(np.floor(self._n_sample / self._batch_size))
+            return int(np.floor(len(self._indices) / self._batch_size))
         else:
-            return int(np.ceil(self._n_sample / self._batch_size))
+            return int(np.ceil(len(self._indices) / self._batch_size))
 
     def __getitem__(self, index):
         """
@@ -1006,11 +1366,30 @@ class ArrayDataGenerator(Sequence):
         indexes = self._indices[index * self._batch_size:(index + 1) * self._batch_size]
 
         # Generate data
-        X, y = self.generate(indexes)
+        X, y = self.generate(indexes, remove_nan=self._remove_nan and not self._nan_index)
 
         return X, y
 
 
+def _remove_nan_sequence(p, targets, insol):
+    """
+    Remove samples with NaN in the predictors or in any step of the targets, in place, from the predictors, targets,
+    and the insolation inputs for subsequent sequence steps.
+
+    :return: p, targets, insol, n_sample
+    """
+    bad = nan_sample_mask(p)
+    for t in targets:
+        bad |= nan_sample_mask(t)
+    if not np.any(bad):
+        return p, targets, insol, p.shape[0]
+    keep = np.flatnonzero(~bad)
+    p = compact_samples(keep, p)[0]
+    targets = compact_samples(keep, *targets)
+    insol = insol[:1] + compact_samples(keep, *insol[1:])
+    return p, targets, insol, len(keep)
+
+
 def tf_data_generator(generator, batch_size=None, input_names=None, output_names=None):
     """
     Wraps a DLWP.model Generator class into a generator function that can be used in a TensorFlow.Data.Dataset object.
@@ -1020,7 +1399,8 @@ def tf_data_generator(generator, batch_size=None, input_names=None, output_names
         data does not have the same number of samples.
     :param input_names: list of str: optional list of names for the inputs, to match the model Input layers
     :param output_names: list of str: optional list of names for the outputs, to match the model's output layers
-    :return: tensorflow.data.Dataset
+    :return: tensorflow.data.Dataset. If the generator is sharded, the automatic sharding of the dataset by
+        tf.distribute is turned off.
     """
     # Determine structure of output data
     p, t = generator.generate([0])
@@ -1045,19 +1425,21 @@ def tf_data_generator(generator, batch_size=None, input_names=None, output_names
             for sample in generator:
                 yield sample[0], sample[1]
         data_types = (tf.float32, tf.float32)
-        data_shapes = (p.shape, t.shape)
+        data_shapes = ((batch_size,) + p.shape[1:], (batch_size,) + t.shape[1:])
     elif p_is_list and not t_is_list:
         def yield_fn():
             for sample in generator:
                 yield {input_names[i]: d for i, d in enumerate(sample[0])}, sample[1]
         data_types = ({input_names[i]: tf.float32 for i in range(len(p))}, tf.float32)
-        data_shapes = ({input_names[i]: (batch_size,) + p[i].shape[1:] for i in range(len(p))}, t.shape)
+        data_shapes = ({input_names[i]: (batch_size,) + p[i].shape[1:] for i in range(len(p))},
+                       (batch_size,) + t.shape[1:])
     elif not p_is_list and t_is_list:
         def yield_fn():
             for sample in generator:
                 yield sample[0], {output_names[i]: d for i, d in enumerate(sample[1])}
         data_types = (tf.float32, {output_names[i]: tf.float32 for i in range(len(t))})
-        data_shapes = (p.shape, {output_names[i]: (batch_size,) + t[i].shape[1:] for i in range(len(t))})
+        data_shapes = ((batch_size,) + p.shape[1:], {output_names[i]: (batch_size,) + t[i].shape[1:]
+                                                     for i in range(len(t))})
     else:
         def yield_fn():
             for sample in generator:
@@ -1071,4 +1453,62 @@ def tf_data_generator(generator, batch_size=None, input_names=None, output_names
     # Create a tf.data.Dataset
     del p, t
     tf_dataset = tf.data.Dataset.from_generator(yield_fn, output_types=data_types, output_shapes=data_shapes)
+    # A sharded generator already yields only the samples of this worker
+    planner = getattr(generator, 'planner', None)
+    if planner is not None and planner.num_shards > 1:
+        tf_dataset = disable_auto_shard(tf_dataset)
     return tf_dataset
+
+
+def generator_moments(generator, predictors=True, targets=True, batch_size=None, n_jobs=1):
+    """
+    Accumulate the streaming, NaN-aware per-feature moments of the unscaled predictors and targets of all the valid
+    samples of a DataGenerator or SeriesDataGenerator, one batch at a time, so that the data never need to fit in
+    memory. With n_jobs > 1, contiguous shards of the batches are processed in parallel threads and their moments
+    merged, which overlaps reading from disk with computation.
+
+    :param generator: DataGenerator or SeriesDataGenerator
+    :param predictors: bool: if True, accumulate the moments of the predictors. For generators with insolation inputs
+        in a sequence, these are the moments of the first input, which is the one scaled by the model.
+    :param targets: bool: if True, accumulate the moments of the targets, over all steps of a sequence
+    :param batch_size: int: number of samples to generate at a time; defaults to the batch size of the generator
+    :param n_jobs: int: number of threads
+    :return: (RunningMoments, RunningMoments): moments of the predictors and targets, or None for either if not
+        requested
+    """
+    if isinstance(generator, ArrayDataGenerator):
+        raise TypeError("ArrayDataGenerator data are not scaled by the model; scale them with prepare_data_array")
+    samples = generator.planner.index
+    batch_size = int(batch_size or generator._batch_size)
+    batches = [samples[s:s + batch_size] for s in range(0, len(samples), batch_size)]
+
+    def run(shard):
+        p_moments = RunningMoments() if predictors else None
+        t_moments = RunningMoments() if targets else None
+        for batch in shard:
+            p, t = generator.generate(batch, scale_and_impute=False)
+            if predictors:
+                p_moments.partial_fit(p[0] if isinstance(p, list) else p)
+            if targets:
+                for step in (t if isinstance(t, list) else [t]):
+                    t_moments.partial_fit(step)
+        return p_moments, t_moments
+
+    # The first batch is generated alone, so that data loaded on first use are loaded by a single thread
+    results = [run(batches[:1])]
+    rest = batches[1:]
+    if n_jobs is None or n_jobs == 1 or len(rest) < 2:
+        results.append(run(rest))
+    else:
+        bounds = np.linspace(0, len(rest), min(n_jobs, len(rest)) + 1).astype(int)
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            results.extend(executor.map(run, [rest[a:b] for a, b in zip(bounds[:-1], bounds[1:])]))
+
+    # Merge in the order of the samples, so that the result does not depend on the timing of the threads
+    p_moments, t_moments = results[0]
+    for p_shard, t_shard in results[1:]:
+        if predictors:
+            p_moments.merge(p_shard)
+        if targets:
+            t_moments.merge(t_shard)
+    return p_moments, t_moments
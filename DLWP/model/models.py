@@ -10,9 +10,10 @@ High-level APIs for building a DLWP model based on Keras and scikit-learn.
 
 import numpy as np
 from tensorflow.keras import models
-from tensorflow.keras.utils import multi_gpu_model
 
-from .generators import DataGenerator, SeriesDataGenerator, ArrayDataGenerator
+from .distribute import get_strategy, clone_in_scope
+from .generators import DataGenerator, SeriesDataGenerator, ArrayDataGenerator, generator_moments
+from .preprocessing import AffineScaler, MeanImputer
 from .. import util
 
 
@@ -34,7 +35,7 @@ class DLWPNeuralNet(object):
             are large magnitude differences in the output features.
         :param apply_same_y_scaling: bool: if True, if the predictors and targets are the same shape (as for time
             series prediction), apply the same scaler to predictors and targets
-        :param impute_missing: bool: if True, uses scikit-learn Imputer for missing values
+        :param impute_missing: bool: if True, replaces missing values by the mean of their feature
         """
         self.is_convolutional = is_convolutional
         self.is_recurrent = is_recurrent
@@ -46,6 +47,7 @@ class DLWPNeuralNet(object):
         self.apply_same_y_scaling = apply_same_y_scaling
         self.scaler = None
         self.scaler_y = None
+        self._affine_scalers = None
         self.impute = impute_missing
         self.imputer = None
         self.imputer_y = None
@@ -53,6 +55,7 @@ class DLWPNeuralNet(object):
         self.base_model = None
         self.model = None
         self.gpus = 1
+        self.strategy = None
         if scaler_type is None:
             self._is_init_fit = True
         else:
@@ -61,14 +64,16 @@ class DLWPNeuralNet(object):
         # DLWP >= 0.9.0 compatibility
         self.FHW_DIMS = True
 
-    def build_model(self, layers=(), gpus=1, **compile_kwargs):
+    def build_model(self, layers=(), gpus=1, strategy=None, **compile_kwargs):
         """
         Build a Keras Sequential model using the specified layers. Each element of layers must be a tuple consisting of
         (layer_name, layer_args, layer_kwargs); that is, each tuple is the name of the layer as defined in keras.layers,
         a tuple of arguments passed to the layer, and a dictionary of kwargs passed to the layer.
 
         :param layers: tuple: tuple of (layer_name, kwargs_dict) pairs added to the model
-        :param gpus: int: number of GPU units on which to parallelize the Keras model
+        :param gpus: int: number of GPU units on which to parallelize the Keras model with a MirroredStrategy
+        :param strategy: str or tf.distribute.Strategy: distribute the model's replicas and training with this
+            strategy; see DLWP.model.distribute.get_strategy
         :param compile_kwargs: kwargs passed to the 'compile' method of the Keras model
         """
         # Test the parameters
@@ -93,24 +98,20 @@ class DLWPNeuralNet(object):
             layers[l] = layer
         # Self-explanatory
         util.make_keras_picklable()
-        # Build a model, either on a single GPU or on a CPU to control multiple GPUs
-        self.base_model = models.Sequential()
-        for layer in layers:
-            try:
-                layer_class = util.get_from_class('tensorflow.keras.layers', layer[0])
-            except (ImportError, AttributeError):
-                # Maybe we've defined a custom layer, which would be in DLWP.custom
-                layer_class = util.get_from_class('DLWP.custom', layer[0])
-            self.base_model.add(layer_class(*layer[1], **layer[2]))
-        if gpus > 1:
-            import tensorflow as tf
-            with tf.device('/cpu:0'):
-                self.base_model = models.clone_model(self.base_model)
-            self.model = multi_gpu_model(self.base_model, gpus=gpus)
-            self.gpus = gpus
-        else:
+        # Build the model under the scope of the strategy, so that its variables are mirrored on all replicas
+        self.strategy = get_strategy(strategy, gpus)
+        self.gpus = gpus
+        with self.strategy.scope():
+            self.base_model = models.Sequential()
+            for layer in layers:
+                try:
+                    layer_class = util.get_from_class('tensorflow.keras.layers', layer[0])
+                except (ImportError, AttributeError):
+                    # Maybe we've defined a custom layer, which would be in DLWP.custom
+                    layer_class = util.get_from_class('DLWP.custom', layer[0])
+                self.base_model.add(layer_class(*layer[1], **layer[2]))
             self.model = self.base_model
-        self.model.compile(**compile_kwargs)
+            self.model.compile(**compile_kwargs)
 
     @staticmethod
     def _reshape(a, ret=False):
@@ -126,24 +127,40 @@ class DLWPNeuralNet(object):
             self.scaler = scaler_class(**kwargs)
             self.scaler_y = scaler_class(**kwargs)
             self.scaler.fit(self._reshape(X))
+            self._affine_scalers = None
             if self.scale_targets:
                 if self.apply_same_y_scaling:
                     self.scaler_y = self.scaler
                 else:
                     self.scaler_y.fit(self._reshape(y))
 
+    def _get_affine_scalers(self):
+        """
+        Return float32 AffineScaler equivalents of the fitted scaler and target scaler, converting the scikit-learn
+        scalers on first use. This keeps scikit-learn out of the per-batch path, including for saved models which
+        only contain the scikit-learn scalers.
+        """
+        if getattr(self, '_affine_scalers', None) is None:
+            scaler = AffineScaler.from_scaler(self.scaler)
+            scaler_y = None
+            if self.scale_targets:
+                scaler_y = scaler if self.scaler_y is self.scaler else AffineScaler.from_scaler(self.scaler_y)
+            self._affine_scalers = (scaler, scaler_y)
+        return self._affine_scalers
+
     def scaler_transform(self, X, y=None):
         if self.scaler_type is None:
             if y is not None:
                 return X, y
             else:
                 return X
+        scaler, scaler_y = self._get_affine_scalers()
         X, X_shape = self._reshape(X, ret=True)
-        X_transform = self.scaler.transform(X)
+        X_transform = scaler.transform(X)
         if y is not None:
             if self.scale_targets:
                 y, y_shape = self._reshape(y, ret=True)
-                y_transform = self.scaler_y.transform(y)
+                y_transform = scaler_y.transform(y)
                 return X_transform.reshape(X_shape), y_transform.reshape(y_shape)
             else:
                 return X_transform.reshape(X_shape), y
@@ -151,14 +168,11 @@ class DLWPNeuralNet(object):
             return X_transform.reshape(X_shape)
 
     def imputer_fit(self, X, y):
-        imputer_class = util.get_from_class('sklearn.preprocessing', 'Imputer')
-        self.imputer = imputer_class(missing_values=np.nan, strategy="mean", axis=0, copy=False)
-        self.imputer_y = imputer_class(missing_values=np.nan, strategy="mean", axis=0, copy=False)
-        self.imputer.fit(self._reshape(X))
+        self.imputer = MeanImputer(copy=False).fit(self._reshape(X))
         if self.apply_same_y_scaling:
             self.imputer_y = self.imputer
         else:
-            self.imputer_y.fit(self._reshape(y))
+            self.imputer_y = MeanImputer(copy=False).fit(self._reshape(y))
 
     def imputer_transform(self, X, y=None):
         X, X_shape = self._reshape(X, ret=True)
@@ -186,6 +200,38 @@ class DLWPNeuralNet(object):
         self.scaler_fit(predictors, targets, **scaler_kwargs)
         self._is_init_fit = True
 
+    def init_fit_generator(self, generator, batch_size=None, n_jobs=1, scaler_kwargs=None):
+        """
+        Initialize the Imputer and Scaler of the model on all of the samples of a data generator, which are read one
+        batch at a time, so that the data never need to fit in memory. The mean and variance (or extremes) of each
+        feature are accumulated in float64 and give the same Imputer and Scaler as init_fit() on all of the data. Only
+        the StandardScaler, MinMaxScaler and MaxAbsScaler scaler types are supported.
+
+        :param generator: DataGenerator or SeriesDataGenerator for this model
+        :param batch_size: int: number of samples to read at a time; defaults to the batch size of the generator
+        :param n_jobs: int: number of threads reading and accumulating contiguous shards of the samples
+        :param scaler_kwargs: dict: arguments passed to create the Scaler
+        """
+        scaler_kwargs = scaler_kwargs or {}
+        if self.impute or self.scaler_type is not None:
+            separate_y = not self.apply_same_y_scaling and (self.impute or self.scale_targets)
+            moments, moments_y = generator_moments(generator, targets=separate_y, batch_size=batch_size,
+                                                   n_jobs=n_jobs)
+            if self.impute:
+                self.imputer = MeanImputer.from_moments(moments, copy=False)
+                self.imputer_y = self.imputer
+                moments = moments.imputed()
+                if separate_y:
+                    self.imputer_y = MeanImputer.from_moments(moments_y, copy=False)
+                    moments_y = moments_y.imputed()
+            if self.scaler_type is not None:
+                self.scaler = moments.to_scaler(self.scaler_type, **scaler_kwargs)
+                self._affine_scalers = None
+                if self.scale_targets:
+                    self.scaler_y = moments_y.to_scaler(self.scaler_type, **scaler_kwargs) if separate_y \
+                        else self.scaler
+        self._is_init_fit = True
+
     def fit(self, predictors, targets, initialize=True, **kwargs):
         """
         Fit the DLWPNeuralNet model. Also performs input feature scaling.
@@ -241,7 +287,8 @@ class DLWPNeuralNet(object):
         predictors_scaled = self.scaler_transform(predictors)
         predicted = self.model.predict(predictors_scaled, **kwargs)
         if self.scale_targets and self.scaler_type is not None:
-            return self.scaler_y.inverse_transform(predicted)
+            predicted, p_shape = self._reshape(predicted, ret=True)
+            return self._get_affine_scalers()[1].inverse_transform(predicted).reshape(p_shape)
         else:
             return predicted
 
@@ -346,16 +393,20 @@ class DLWPFunctional(object):
         self.base_model = None
         self.model = None
         self.gpus = 1
+        self.strategy = None
 
         # DLWP >= 0.9.0 compatibility
         self.FHW_DIMS = True
 
-    def build_model(self, model, gpus=1, **compile_kwargs):
+    def build_model(self, model, gpus=1, strategy=None, **compile_kwargs):
         """
         Compile a Keras Functional model.
 
-        :param model: keras.models.Model: Keras functional model
-        :param gpus: int: number of GPU units on which to parallelize the Keras model
+        :param model: keras.models.Model: Keras functional model. With a distribution strategy, the model may be built
+            outside of the strategy's scope; it is then cloned, with its weights, under the scope.
+        :param gpus: int: number of GPU units on which to parallelize the Keras model with a MirroredStrategy
+        :param strategy: str or tf.distribute.Strategy: distribute the model's replicas and training with this
+            strategy; see DLWP.model.distribute.get_strategy
         :param compile_kwargs: kwargs passed to the 'compile' method of the Keras model
         """
         # Test the parameters
@@ -363,18 +414,15 @@ class DLWPFunctional(object):
             raise TypeError("'gpus' argument must be an int")
         # Self-explanatory
         util.make_keras_picklable()
-        # Build a model, either on a single GPU or on a CPU to control multiple GPUs
-        self.base_model = model
+        self.strategy = get_strategy(strategy, gpus)
+        self.gpus = gpus
         self._n_steps = len(model.outputs)
-        if gpus > 1:
-            import tensorflow as tf
-            with tf.device('/cpu:0'):
-                self.base_model = models.clone_model(self.base_model)
-            self.model = multi_gpu_model(self.base_model, gpus=gpus)
-            self.gpus = gpus
-        else:
+        if not all(self.strategy.extended.variable_created_in_scope(w) for w in model.weights):
+            model, compile_kwargs = clone_in_scope(model, self.strategy, compile_kwargs)
+        self.base_model = model
+        with self.strategy.scope():
             self.model = self.base_model
-        self.model.compile(**compile_kwargs)
+            self.model.compile(**compile_kwargs)
 
     def scaler_transform(self, X, y=None):
         """
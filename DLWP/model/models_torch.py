@@ -11,6 +11,8 @@ High-level APIs for building a DLWP model using PyTorch.
 import numpy as np
 import time
 import warnings
+from .distribute_torch import all_gather, all_reduce_sum, broadcast_flag, is_distributed, is_main_process, rank_shard
+from .preprocessing import AffineScaler, MeanImputer
 from .. import util
 
 try:
@@ -44,7 +46,7 @@ class DLWPTorchNN(object):
             are large magnitude differences in the output features.
         :param apply_same_y_scaling: bool: if True, if the predictors and targets are the same shape (as for time
             series prediction), apply the same scaler to predictors and targets
-        :param impute_missing: bool: if True, uses scikit-learn Imputer for missing values
+        :param impute_missing: bool: if True, replaces missing values by the mean of their feature
         """
         self.is_convolutional = is_convolutional
         self.is_recurrent = is_recurrent
@@ -56,6 +58,7 @@ class DLWPTorchNN(object):
         self.apply_same_y_scaling = apply_same_y_scaling
         self.scaler = None
         self.scaler_y = None
+        self._affine_scalers = None
         self.impute = impute_missing
         self.imputer = None
         self.imputer_y = None
@@ -176,24 +179,40 @@ class DLWPTorchNN(object):
             self.scaler = scaler_class(**kwargs)
             self.scaler_y = scaler_class(**kwargs)
             self.scaler.fit(self._reshape(X))
+            self._affine_scalers = None
             if self.scale_targets:
                 if self.apply_same_y_scaling:
                     self.scaler_y = self.scaler
                 else:
                     self.scaler_y.fit(self._reshape(y))
 
+    def _get_affine_scalers(self):
+        """
+        Return float32 AffineScaler equivalents of the fitted scaler and target scaler, converting the scikit-learn
+        scalers on first use. This keeps scikit-learn out of the per-batch path, including for saved models which
+        only contain the scikit-learn scalers.
+        """
+        if getattr(self, '_affine_scalers', None) is None:
+            scaler = AffineScaler.from_scaler(self.scaler)
+            scaler_y = None
+            if self.scale_targets:
+                scaler_y = scaler if self.scaler_y is self.scaler else AffineScaler.from_scaler(self.scaler_y)
+            self._affine_scalers = (scaler, scaler_y)
+        return self._affine_scalers
+
     def scaler_transform(self, X, y=None):
         if self.scaler_type is None:
             if y is not None:
                 return X, y
             else:
                 return X
+        scaler, scaler_y = self._get_affine_scalers()
         X, X_shape = self._reshape(X, ret=True)
-        X_transform = self.scaler.transform(X)
+        X_transform = scaler.transform(X)
         if y is not None:
             if self.scale_targets:
                 y, y_shape = self._reshape(y, ret=True)
-                y_transform = self.scaler_y.transform(y)
+                y_transform = scaler_y.transform(y)
                 return X_transform.reshape(X_shape), y_transform.reshape(y_shape)
             else:
                 return X_transform.reshape(X_shape), y
@@ -201,14 +220,11 @@ class DLWPTorchNN(object):
             return X_transform.reshape(X_shape)
 
     def imputer_fit(self, X, y):
-        imputer_class = util.get_from_class('sklearn.preprocessing', 'Imputer')
-        self.imputer = imputer_class(missing_values=np.nan, strategy="mean", axis=0, copy=False)
-        self.imputer_y = imputer_class(missing_values=np.nan, strategy="mean", axis=0, copy=False)
-        self.imputer.fit(self._reshape(X))
+        self.imputer = MeanImputer(copy=False).fit(self._reshape(X))
         if self.apply_same_y_scaling:
             self.imputer_y = self.imputer
         else:
-            self.imputer_y.fit(self._reshape(y))
+            self.imputer_y = MeanImputer(copy=False).fit(self._reshape(y))
 
     def imputer_transform(self, X, y=None):
         X, X_shape = self._reshape(X, ret=True)
@@ -234,73 +250,201 @@ class DLWPTorchNN(object):
         self.scaler_fit(predictors, targets)
         self._is_init_fit = True
 
+    def init_fit_generator(self, generator, batch_size=None, n_jobs=1, scaler_kwargs=None):
+        """
+        Initialize the Imputer and Scaler of the model on all of the samples of a data generator, which are read one
+        batch at a time, so that the data never need to fit in memory. The mean and variance (or extremes) of each
+        feature are accumulated in float64 and give the same Imputer and Scaler as init_fit() on all of the data. Only
+        the StandardScaler, MinMaxScaler and MaxAbsScaler scaler types are supported.
+
+        :param generator: DataGenerator or SeriesDataGenerator for this model
+        :param batch_size: int: number of samples to read at a time; defaults to the batch size of the generator
+        :param n_jobs: int: number of threads reading and accumulating contiguous shards of the samples
+        :param scaler_kwargs: dict: arguments passed to create the Scaler
+        """
+        from .generators import generator_moments
+        scaler_kwargs = scaler_kwargs or {}
+        if self.impute or self.scaler_type is not None:
+            separate_y = not self.apply_same_y_scaling and (self.impute or self.scale_targets)
+            moments, moments_y = generator_moments(generator, targets=separate_y, batch_size=batch_size,
+                                                   n_jobs=n_jobs)
+            if self.impute:
+                self.imputer = MeanImputer.from_moments(moments, copy=False)
+                self.imputer_y = self.imputer
+                moments = moments.imputed()
+                if separate_y:
+                    self.imputer_y = MeanImputer.from_moments(moments_y, copy=False)
+                    moments_y = moments_y.imputed()
+            if self.scaler_type is not None:
+                self.scaler = moments.to_scaler(self.scaler_type, **scaler_kwargs)
+                self._affine_scalers = None
+                if self.scale_targets:
+                    self.scaler_y = moments_y.to_scaler(self.scaler_type, **scaler_kwargs) if separate_y \
+                        else self.scaler
+        self._is_init_fit = True
+
     def fit_generator(self, generator, epochs=1, min_epochs=None, validation_generator=None,
-                      early_stop=None, lr_schedule=None, verbose=0):
-        self.history['loss'] = []
-        self.history['error'] = []
-        if validation_generator is not None:
-            self.history['val_loss'] = []
-            self.history['val_error'] = []
-        elif lr_schedule is not None:
-            print("Warning: learning rate scheduler 'lr_sched' needs validation data; disabling")
-        n_d = len(generator)
-        for epoch in range(epochs):
-            if verbose > 0:
-                print('\nEpoch %d/%d' % (epoch + 1, epochs))
-            epoch_start = time.time()
-            running_loss = 0.0
-            running_error = 0.0
-            for b in range(len(generator)):
-                # Retrieve the batch of data
-                p, t = generator[b]
-                p, t = torch.tensor(p).to(device), torch.tensor(t).to(device)
-                # Zero the parameter gradients
-                self.optimizer.zero_grad()
-                # forward + backward + optimize
-                o = self.model(p)
-                loss = self.loss(o, t)
-                loss.backward()
-                self.optimizer.step()
-                # Calculate and print statistics
-                running_loss = (b * running_loss + loss.item()) / (b + 1)
-                running_error = (b * running_error + self._error(o, t)) / (b + 1)
-                if verbose > 1:
-                    print('%d/%d loss: %0.4f - error: %0.4f' %
-                          (b + 1, n_d, running_loss, running_error), end='\r')
-            # Calculate and print metrics
-            print_line = ''
-            self.history['loss'].append(running_loss)
-            self.history['error'].append(running_error)
-            if verbose > 0:
-                print_line += ' - loss: %0.4f - error: %0.4f' % (running_loss, running_error)
+                      early_stop=None, lr_schedule=None, verbose=0, profiler=None, distributed=None):
+        """
+        Fit the model to data from a generator.
+
+        :param generator: DLWP.model generator instance for training data
+        :param epochs: int: number of epochs
+        :param min_epochs: int: train for at least this many epochs before early stopping
+        :param validation_generator: DLWP.model generator instance for validation data
+        :param early_stop: int: stop after this many epochs without improvement in the validation loss
+        :param lr_schedule: torch learning rate scheduler, stepped with the validation loss
+        :param verbose: int: 0, 1, or 2 for more verbose printing
+        :param profiler: DLWP.timing.Profiler: if given, the time spent fetching batches ('DLWPTorchNN.fit/data'),
+            training on them ('DLWPTorchNN.fit/step') and validating ('DLWPTorchNN.fit/validation'), the total time
+            of the epoch ('DLWPTorchNN.fit'), and all other stages recorded by the profiler during each epoch, are
+            added to the history as 'time/<stage>' and 'count/<counter>'. The profiler is enabled during training, and
+            disabled again afterwards if it was not enabled before.
+        :param distributed: bool: if True, train with DistributedDataParallel over the ranks of the torch.distributed
+            process group (see DLWP.model.distribute_torch). The generator of each rank must yield its own shard of
+            the samples, e.g. with shard=(rank, world_size). Losses and errors in the history are averaged over all
+            the ranks, and only rank 0 prints. Defaults to True if a process group of several ranks is initialized.
+        :return: dict: history of metrics
+        """
+        if distributed is None:
+            distributed = is_distributed()
+        if distributed:
+            model = self._distributed_model(generator)
+            if not is_main_process():
+                verbose = 0
+        else:
+            model = self.model
+        was_enabled = profiler is not None and profiler.enabled
+        if profiler is not None:
+            profiler.enable()
+        try:
+            self.history['loss'] = []
+            self.history['error'] = []
             if validation_generator is not None:
-                with torch.no_grad():
-                    running_loss = 0.0
-                    running_error = 0.0
-                    for b in range(len(validation_generator)):
-                        p, t = validation_generator[b]
-                        p, t = torch.tensor(p).to(device), torch.tensor(t).to(device)
-                        o = self.model(p)
-                        running_loss = (b * running_loss + self.loss(o, t).item()) / (b + 1)
-                        running_error = (b * running_error + self._error(o, t)) / (b + 1)
-                self.history['val_loss'].append(running_loss)
-                self.history['val_error'].append(running_error)
+                self.history['val_loss'] = []
+                self.history['val_error'] = []
+            elif lr_schedule is not None:
+                print("Warning: learning rate scheduler 'lr_sched' needs validation data; disabling")
+            n_d = len(generator)
+            for epoch in range(epochs):
+                if verbose > 0:
+                    print('\nEpoch %d/%d' % (epoch + 1, epochs))
+                epoch_start = time.time()
+                if profiler is not None:
+                    snapshot = profiler.snapshot()
+                    timer = profiler.stopwatch('DLWPTorchNN.fit')
+                running_loss = 0.0
+                running_error = 0.0
+                for b in range(len(generator)):
+                    # Retrieve the batch of data
+                    p, t = generator[b]
+                    p, t = torch.tensor(p).to(device), torch.tensor(t).to(device)
+                    if profiler is not None:
+                        timer.lap('data')
+                    # Zero the parameter gradients
+                    self.optimizer.zero_grad()
+                    # forward + backward + optimize
+                    o = model(p)
+                    loss = self.loss(o, t)
+                    loss.backward()
+                    self.optimizer.step()
+                    # Calculate and print statistics
+                    running_loss = (b * running_loss + loss.item()) / (b + 1)
+                    running_error = (b * running_error + self._error(o, t)) / (b + 1)
+                    if profiler is not None:
+                        timer.lap('step')
+                    if verbose > 1:
+                        print('%d/%d loss: %0.4f - error: %0.4f' %
+                              (b + 1, n_d, running_loss, running_error), end='\r')
+                if hasattr(generator, 'on_epoch_end'):
+                    generator.on_epoch_end()
+                # Calculate and print metrics
+                print_line = ''
+                if distributed:
+                    running_loss, running_error = self._mean_over_ranks(running_loss, running_error, len(generator))
+                self.history['loss'].append(running_loss)
+                self.history['error'].append(running_error)
+                if profiler is not None and validation_generator is None:
+                    timer.stop()
+                    self._record_profile(profiler, snapshot)
                 if verbose > 0:
-                    print_line += ' - val_loss: %0.4f – val_error: %0.4f' % (running_loss, running_error)
-                if early_stop is not None:
-                    if min_epochs is not None and epoch > min_epochs + early_stop:
-                        if epoch - np.argmin(self.history['val_loss']) == early_stop:
+                    print_line += ' - loss: %0.4f - error: %0.4f' % (running_loss, running_error)
+                if validation_generator is not None:
+                    with torch.no_grad():
+                        running_loss = 0.0
+                        running_error = 0.0
+                        for b in range(len(validation_generator)):
+                            p, t = validation_generator[b]
+                            p, t = torch.tensor(p).to(device), torch.tensor(t).to(device)
+                            o = self.model(p)
+                            running_loss = (b * running_loss + self.loss(o, t).item()) / (b + 1)
+                            running_error = (b * running_error + self._error(o, t)) / (b + 1)
+                    if distributed:
+                        running_loss, running_error = self._mean_over_ranks(running_loss, running_error,
+                                                                            len(validation_generator))
+                    self.history['val_loss'].append(running_loss)
+                    self.history['val_error'].append(running_error)
+                    if profiler is not None:
+                        timer.lap('validation')
+                        timer.stop()
+                        self._record_profile(profiler, snapshot)
+                    if verbose > 0:
+                        print_line += ' - val_loss: %0.4f – val_error: %0.4f' % (running_loss, running_error)
+                    # The validation metrics are the same on all ranks, but the decision to stop is taken by rank 0 so
+                    # that no rank is left waiting for the others in a collective
+                    if early_stop is not None:
+                        stop = False
+                        if min_epochs is not None and epoch > min_epochs + early_stop:
+                            stop = epoch - np.argmin(self.history['val_loss']) == early_stop
+                        if distributed:
+                            stop = broadcast_flag(stop)
+                        if stop:
                             if verbose > 0:
                                 print('\nval_loss stopped improving; ending fit')
                             break
-                if lr_schedule is not None:
-                    lr_schedule.step(running_loss)
+                    if lr_schedule is not None:
+                        lr_schedule.step(running_loss)
+                if verbose > 0:
+                    print('%d/%d - time: %0.2f s' % (n_d, n_d, time.time() - epoch_start) + print_line, end='')
             if verbose > 0:
-                print('%d/%d - time: %0.2f s' % (n_d, n_d, time.time() - epoch_start) + print_line, end='')
-        if verbose > 0:
-            print('')
+                print('')
+        finally:
+            if profiler is not None and not was_enabled:
+                profiler.disable()
         return self.history
 
+    def _distributed_model(self, generator):
+        """
+        Wrap the model in DistributedDataParallel, after checking that the generator is sharded over the ranks.
+        """
+        rank, world_size = rank_shard()
+        planner = getattr(generator, 'planner', None)
+        shard = None if planner is None else (planner.shard_index, planner.num_shards)
+        # Gather the configuration of every rank before checking it, so that all the ranks raise the same error
+        # instead of some of them waiting forever in a collective that a failed rank never joins
+        configs = all_gather((rank, shard, len(generator)))
+        for r, s, _ in configs:
+            if s is not None and s != (r, world_size):
+                raise ValueError("the generator of rank %d must be created with shard=(%d, %d) for distributed "
+                                 "training; got shard=%s" % (r, r, world_size, s))
+        # Every rank must take the same number of steps, or the gradient all-reduce of the extra steps never returns
+        n_batches = [n for _, _, n in configs]
+        if len(set(n_batches)) > 1:
+            raise ValueError("the generators of the ranks have different numbers of batches: %s" % n_batches)
+        return nn.parallel.DistributedDataParallel(self.model)
+
+    @staticmethod
+    def _mean_over_ranks(loss, error, n_batches):
+        # Means over the ranks of the per-rank mean loss and error, weighted by the number of batches of each rank
+        loss_sum, error_sum, total = all_reduce_sum([loss * n_batches, error * n_batches, n_batches])
+        if total == 0:
+            return loss, error
+        return loss_sum / total, error_sum / total
+
+    def _record_profile(self, profiler, snapshot):
+        for k, v in profiler.stats(since=snapshot).items():
+            self.history.setdefault(k, []).append(v)
+
     def predict(self, predictors):
         """
         Make a prediction with the DLWPTorchNN model. Also performs input feature scaling.
@@ -318,7 +462,8 @@ class DLWPTorchNN(object):
             all_p.append(predicted)
         all_p = np.array(all_p).reshape((-1,) + predicted.shape[1:])
         if self.scale_targets and self.scaler_type is not None:
-            return self.scaler_y.inverse_transform(all_p)
+            all_p, p_shape = self._reshape(all_p, ret=True)
+            return self._get_affine_scalers()[1].inverse_transform(all_p).reshape(p_shape)
         else:
             return all_p
 
@@ -14,7 +14,7 @@ import xarray as xr
 import os
 import warnings
 from datetime import datetime
-from ..util import to_bool, insolation
+from ..util import to_bool, insolation, get_from_class
 
 # netCDF fill value
 fill_value = np.array(nc.default_fillvals['f4']).astype(np.float32)
@@ -841,6 +841,333 @@ class Preprocessor(object):
             self.data.to_netcdf(predictor_file)
 
 
+class AffineScaler(object):
+    """
+    Float32 feature-wise affine scaling of data, `x * scale + offset`. This is equivalent to any of the feature-wise
+    scikit-learn scalers (StandardScaler, MinMaxScaler, MaxAbsScaler, RobustScaler), but avoids their per-call
+    float64 round trip. The scale and offset may be per-feature (for flattened samples) or per-channel, in which case
+    they are broadcast along the given axis of the data. The same transformation may be baked into a prepared data
+    array or fused into the first and last layers of a model with `keras_layer()` or `torch_layer()`.
+    """
+
+    def __init__(self, scale=1., offset=0.):
+        """
+        Initialize an AffineScaler.
+
+        :param scale: float or ndarray: multiplicative factor a in x * a + b
+        :param offset: float or ndarray: additive offset b in x * a + b
+        """
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.inverse_scale = (1. / self.scale).astype(np.float32)
+            self.inverse_offset = (-self.offset / self.scale).astype(np.float32)
+
+    @classmethod
+    def from_mean_std(cls, mean, std):
+        """
+        Create an AffineScaler which standardizes data, (x - mean) / std.
+
+        :param mean: float or ndarray: mean of the data
+        :param std: float or ndarray: standard deviation of the data
+        :return: AffineScaler
+        """
+        mean = np.asarray(mean, dtype=np.float64)
+        std = np.asarray(std, dtype=np.float64)
+        return cls(1. / std, -mean / std)
+
+    @classmethod
+    def from_scaler(cls, scaler, n_features=None):
+        """
+        Create an AffineScaler equivalent to a fitted scikit-learn feature-wise scaler. The coefficients are obtained
+        by transforming arrays of zeros and ones, so any scaler whose transform is feature-wise affine is supported.
+
+        :param scaler: fitted scikit-learn scaler, or an AffineScaler (returned as-is)
+        :param n_features: int: number of features of the scaler; inferred from the fitted scaler if not given
+        :return: AffineScaler
+        """
+        if isinstance(scaler, cls):
+            return scaler
+        if n_features is None:
+            n_features = getattr(scaler, 'n_features_in_', None)
+        if n_features is None:
+            for attr in ['scale_', 'mean_', 'center_', 'min_']:
+                value = getattr(scaler, attr, None)
+                if value is not None:
+                    n_features = len(value)
+                    break
+        if n_features is None:
+            raise ValueError("could not determine the number of features of scaler %s; specify 'n_features'" %
+                             type(scaler).__name__)
+        offset = scaler.transform(np.zeros((1, n_features)))[0]
+        scale = scaler.transform(np.ones((1, n_features)))[0] - offset
+        test = np.linspace(-2., 2., n_features)[np.newaxis, :]
+        if not np.allclose(scaler.transform(test)[0], test[0] * scale + offset):
+            raise TypeError("scaler %s is not a feature-wise affine transformation" % type(scaler).__name__)
+        return cls(scale, offset)
+
+    @staticmethod
+    def _expand(a, ndim, axis):
+        # Broadcast a 1-d array of coefficients along the given axis of an ndim array
+        if a.ndim != 1 or axis in [-1, ndim - 1]:
+            return a
+        shape = [1] * ndim
+        shape[axis] = a.shape[0]
+        return a.reshape(shape)
+
+    def _apply(self, X, scale, offset, axis, out):
+        X = np.asarray(X)
+        scale = self._expand(scale, X.ndim, axis)
+        offset = self._expand(offset, X.ndim, axis)
+        if out is None:
+            out = np.empty(np.broadcast(X, scale).shape, dtype=np.float32)
+        np.multiply(X, scale, out=out)
+        np.add(out, offset, out=out)
+        return out
+
+    def transform(self, X, axis=-1, out=None):
+        """
+        Scale data, x * scale + offset.
+
+        :param X: ndarray: data
+        :param axis: int: axis of X along which 1-d (per-channel) coefficients are broadcast
+        :param out: ndarray: optional float32 output array; may be X itself for in-place scaling
+        :return: ndarray: float32 scaled data
+        """
+        return self._apply(X, self.scale, self.offset, axis, out)
+
+    def inverse_transform(self, X, axis=-1, out=None):
+        """
+        Un-scale data, (x - offset) / scale.
+
+        :param X: ndarray: scaled data
+        :param axis: int: axis of X along which 1-d (per-channel) coefficients are broadcast
+        :param out: ndarray: optional float32 output array; may be X itself for in-place un-scaling
+        :return: ndarray: float32 un-scaled data
+        """
+        return self._apply(X, self.inverse_scale, self.inverse_offset, axis, out)
+
+    def keras_layer(self, inverse=False, **kwargs):
+        """
+        Return a Keras layer applying this scaling (or its inverse), to be used as the first (last) layer of a model.
+
+        :param inverse: bool: if True, the layer un-scales its inputs
+        :param kwargs: passed to DLWP.custom.AffineScaling
+        :return: DLWP.custom.AffineScaling layer
+        """
+        from ..custom import AffineScaling
+        if inverse:
+            return AffineScaling(self.inverse_scale, self.inverse_offset, **kwargs)
+        return AffineScaling(self.scale, self.offset, **kwargs)
+
+    def torch_layer(self, inverse=False):
+        """
+        Return a callable applying this scaling (or its inverse) to torch tensors, to be used as the first (last)
+        layer of a DLWPTorchNN model.
+
+        :param inverse: bool: if True, the layer un-scales its inputs
+        :return: DLWP.custom.TorchAffineScaling
+        """
+        from ..custom import TorchAffineScaling
+        if inverse:
+            return TorchAffineScaling(self.inverse_scale, self.inverse_offset)
+        return TorchAffineScaling(self.scale, self.offset)
+
+
+class RunningMoments(object):
+    """
+    Streaming, NaN-aware per-feature count, mean, variance, minimum and maximum of data, accumulated in float64 over
+    batches of samples with partial_fit(). Moments accumulated separately, e.g. over shards of the samples in parallel,
+    are combined exactly with merge() (Chan et al., 1979), so that scalers and imputers can be fit on datasets much
+    larger than memory. Missing values (NaN) are excluded from the moments of their feature.
+    """
+
+    def __init__(self):
+        self.n_samples_seen = 0
+        self.shape = None
+        self.count = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def _combine(self, n_samples, count, mean, m2, minimum, maximum):
+        if self.count is None:
+            self.n_samples_seen = n_samples
+            self.count, self.mean, self.m2, self.min, self.max = count, mean, m2, minimum, maximum
+            return
+        if count.shape != self.count.shape:
+            raise ValueError("got %d features; expected %d" % (count.shape[0], self.count.shape[0]))
+        total = self.count + count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(total > 0, count / total, 0.)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * weight
+        self.count = total
+        self.min = np.fmin(self.min, minimum)
+        self.max = np.fmax(self.max, maximum)
+        self.n_samples_seen += n_samples
+
+    def partial_fit(self, X):
+        """
+        Update the moments with a batch of samples.
+
+        :param X: ndarray, shape [num_samples, ...]: batch of data; the trailing dimensions are the features
+        :return: self
+        """
+        X = np.asarray(X)
+        if X.shape[0] == 0:
+            return self
+        if self.shape is None:
+            self.shape = X.shape[1:]
+        X = X.reshape((X.shape[0], -1))
+        minimum = np.fmin.reduce(X, axis=0).astype(np.float64)
+        maximum = np.fmax.reduce(X, axis=0).astype(np.float64)
+        X = X.astype(np.float64)
+        missing = np.isnan(X)
+        X[missing] = 0.
+        count = (X.shape[0] - missing.sum(axis=0)).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, X.sum(axis=0) / count, 0.)
+        X -= mean
+        X[missing] = 0.
+        m2 = np.einsum('ij,ij->j', X, X)
+        self._combine(X.shape[0], count, mean, m2, minimum, maximum)
+        return self
+
+    def merge(self, other):
+        """
+        Add the moments of other data, e.g. of another shard of the samples, to these moments.
+
+        :param other: RunningMoments
+        :return: self
+        """
+        if other.count is not None:
+            if self.shape is None:
+                self.shape = other.shape
+            self._combine(other.n_samples_seen, other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    @property
+    def var(self):
+        """
+        :return: ndarray: per-feature population variance; 0 for features without data
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 0, self.m2 / self.count, 0.)
+
+    @property
+    def std(self):
+        """
+        :return: ndarray: per-feature population standard deviation; 0 for features without data
+        """
+        return np.sqrt(self.var)
+
+    def imputed(self, fill_value=0.):
+        """
+        Return the moments the data would have after replacing their missing values by the mean of their feature, as
+        done by a MeanImputer fit on the same data. Features without any data are filled with fill_value.
+
+        :param fill_value: float: value of features without any data
+        :return: RunningMoments
+        """
+        result = RunningMoments()
+        result.n_samples_seen = self.n_samples_seen
+        result.shape = self.shape
+        empty = self.count == 0
+        result.count = np.full_like(self.count, self.n_samples_seen)
+        result.mean = np.where(empty, fill_value, self.mean)
+        result.m2 = self.m2.copy()
+        result.min = np.where(empty, fill_value, self.min)
+        result.max = np.where(empty, fill_value, self.max)
+        return result
+
+    def to_scaler(self, scaler_type='StandardScaler', **kwargs):
+        """
+        Return a fitted scikit-learn scaler equivalent to one fit on all of the data. Supports the scalers which
+        depend only on these moments: StandardScaler, MinMaxScaler and MaxAbsScaler.
+
+        :param scaler_type: str: class of scikit-learn scaler
+        :param kwargs: passed to the scaler class
+        :return: fitted scikit-learn scaler
+        """
+        if self.count is None:
+            raise ValueError('cannot create a scaler from moments of no data')
+        scaler = get_from_class('sklearn.preprocessing', scaler_type)(**kwargs)
+        if scaler_type == 'StandardScaler':
+            scale = self.std
+            scale[scale == 0.] = 1.
+            scaler.mean_ = self.mean.copy()
+            scaler.var_ = self.var
+            scaler.scale_ = scale
+            scaler.n_samples_seen_ = self.count.astype(np.int64)
+            scaler.n_features_in_ = self.count.shape[0]
+        elif scaler_type in ['MinMaxScaler', 'MaxAbsScaler']:
+            # These scalers depend only on the extremes of each feature, which are the rows of this array
+            scaler.partial_fit(np.stack([self.min, self.max]))
+        else:
+            raise ValueError("scaler_type '%s' cannot be fit from streaming moments; use 'StandardScaler', "
+                             "'MinMaxScaler' or 'MaxAbsScaler'" % scaler_type)
+        return scaler
+
+
+class MeanImputer(object):
+    """
+    Replace missing values (NaN) in each feature of data by the mean of that feature, as the former scikit-learn
+    Imputer with strategy='mean' and axis=0. Unlike scikit-learn's SimpleImputer, features without any data are kept,
+    and filled with fill_value, so that the shape of the data is unchanged.
+    """
+
+    def __init__(self, fill_value=0., copy=True):
+        """
+        Initialize a MeanImputer.
+
+        :param fill_value: float: value of features without any data
+        :param copy: bool: if False, impute in place where possible
+        """
+        self.fill_value = fill_value
+        self.copy = copy
+        self.statistics_ = None
+
+    @classmethod
+    def from_moments(cls, moments, **kwargs):
+        """
+        Create a MeanImputer from the moments of the data, e.g. accumulated in a stream of batches.
+
+        :param moments: RunningMoments: moments of the data
+        :param kwargs: passed to MeanImputer
+        :return: fitted MeanImputer
+        """
+        imputer = cls(**kwargs)
+        imputer.statistics_ = np.where(moments.count > 0, moments.mean, imputer.fill_value)
+        return imputer
+
+    def fit(self, X):
+        """
+        Fit the means of the features.
+
+        :param X: ndarray, shape [num_samples, num_features]: data
+        :return: self
+        """
+        moments = RunningMoments().partial_fit(X)
+        self.statistics_ = np.where(moments.count > 0, moments.mean, self.fill_value)
+        return self
+
+    def transform(self, X):
+        """
+        Replace missing values by the means of their features.
+
+        :param X: ndarray, shape [num_samples, num_features]: data
+        :return: ndarray: imputed data
+        """
+        X = np.array(X) if self.copy else np.asarray(X)
+        if not np.issubdtype(X.dtype, np.floating):
+            return X
+        np.copyto(X, self.statistics_.astype(X.dtype), where=np.isnan(X))
+        return X
+
+
 def mean_by_batch(da, batch_size, axis=0):
     """
     Loop over batches indexed in axis in an xarray DataArray to take the grand mean of the array in a memory-
@@ -911,7 +1238,7 @@ def get_constants(constants=None, **kwargs):
     return result
 
 
-def prepare_data_array(ds, input_sel=None, output_sel=None, add_insolation=False, return_data=True):
+def prepare_data_array(ds, input_sel=None, output_sel=None, add_insolation=False, return_data=True, scaler=None):
     """
     Prepare an array of predictor or
     :param ds:
@@ -919,6 +1246,8 @@ def prepare_data_array(ds, input_sel=None, output_sel=None, add_insolation=False
     :param output_sel:
     :param add_insolation:
     :param return_data:
+    :param scaler: AffineScaler: if given, per-channel scaling baked into the returned float32 array. The scaler
+        coefficients correspond to the 'varlev' coordinate of ds, or are scalars that apply to every channel.
     :return:
     """
     input_sel = input_sel or {}
@@ -980,6 +1309,13 @@ def prepare_data_array(ds, input_sel=None, output_sel=None, add_insolation=False
 
     # Return the data if requested
     if return_data:
-        return da.values, input_ind, output_ind, sol
+        data = da.values
+        if scaler is not None:
+            # Re-order the per-channel coefficients to match the selected variables; scalar coefficients apply to all
+            varlev = list(ds['varlev'].values)
+            ind = [varlev.index(v) for v in da['varlev'].values]
+            scaler = AffineScaler(*[c[ind] if np.ndim(c) > 0 else c for c in (scaler.scale, scaler.offset)])
+            data = scaler.transform(data, axis=1)
+        return data, input_ind, output_ind, sol
     else:
         return input_ind, output_ind, sol
@@ -0,0 +1,361 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Model zoo of the cubed-sphere convolutional networks used for DLWP-CS.
+
+Each architecture is written once as a function of a layer provider `l` and a tensor `x`, using only the operations
+    l.conv(name, x): cube-sphere padding, 3x3 CubeSphereConv2D and activation
+    l.output(x): the final 1x1 CubeSphereConv2D
+    l.pool(x), l.up(x): 2x2 average pooling and up-sampling within each face
+    l.concat(xs): concatenation along the channel axis
+The same functions build the Keras models (cube_sphere_model), the PyTorch modules (.zoo_torch) and the analytic
+layer shapes, parameter counts and FLOPs (cube_sphere_complexity). Layers with the same name share weights, including
+across the integration steps of a sequence model.
+"""
+
+from collections import OrderedDict
+
+
+# ==================================================================================================================== #
+# Architectures
+# ==================================================================================================================== #
+
+def basic(l, x):
+    x = l.conv('conv_2d_1', x)
+    x = l.pool(x)
+    x = l.conv('conv_2d_2', x)
+    x = l.pool(x)
+    x = l.conv('conv_2d_3', x)
+    x = l.up(x)
+    x = l.conv('conv_2d_6', x)
+    x = l.up(x)
+    x = l.conv('conv_2d_7', x)
+    x = l.conv('conv_2d_7_2', x)
+    return l.output(x)
+
+
+def unet(l, x):
+    x0 = l.conv('conv_2d_1', x)
+    x1 = l.pool(x0)
+    x1 = l.conv('conv_2d_2', x1)
+    x2 = l.pool(x1)
+    x2 = l.conv('conv_2d_3', x2)
+    x2 = l.up(x2)
+    x = l.concat([x2, x1])
+    x = l.conv('conv_2d_6', x)
+    x = l.up(x)
+    x = l.concat([x, x0])
+    x = l.conv('conv_2d_7', x)
+    x = l.conv('conv_2d_7_2', x)
+    return l.output(x)
+
+
+def unet2(l, x):
+    x0 = l.conv('conv_2d_1', x)
+    x0 = l.conv('conv_2d_1_2', x0)
+    x1 = l.pool(x0)
+    x1 = l.conv('conv_2d_2', x1)
+    x1 = l.conv('conv_2d_2_2', x1)
+    x2 = l.pool(x1)
+    x2 = l.conv('conv_2d_5_2', x2)
+    x2 = l.conv('conv_2d_5', x2)
+    x2 = l.up(x2)
+    x = l.concat([x2, x1])
+    x = l.conv('conv_2d_6_2', x)
+    x = l.conv('conv_2d_6', x)
+    x = l.up(x)
+    x = l.concat([x, x0])
+    x = l.conv('conv_2d_7', x)
+    x = l.conv('conv_2d_7_2', x)
+    return l.output(x)
+
+
+def unet3(l, x):
+    x0 = l.conv('conv_2d_1', x)
+    x0 = l.conv('conv_2d_1_2', x0)
+    x0 = l.conv('conv_2d_1_3', x0)
+    x1 = l.pool(x0)
+    x1 = l.conv('conv_2d_2', x1)
+    x1 = l.conv('conv_2d_2_2', x1)
+    x1 = l.conv('conv_2d_2_3', x1)
+    x2 = l.pool(x1)
+    x2 = l.conv('conv_2d_5_3', x2)
+    x2 = l.conv('conv_2d_5_2', x2)
+    x2 = l.conv('conv_2d_5', x2)
+    x2 = l.up(x2)
+    x = l.concat([x2, x1])
+    x = l.conv('conv_2d_6_3', x)
+    x = l.conv('conv_2d_6_2', x)
+    x = l.conv('conv_2d_6', x)
+    x = l.up(x)
+    x = l.concat([x, x0])
+    x = l.conv('conv_2d_7', x)
+    x = l.conv('conv_2d_7_2', x)
+    x = l.conv('conv_2d_7_3', x)
+    return l.output(x)
+
+
+def unet4(l, x):
+    x0 = l.conv('conv_2d_1', x)
+    x0 = l.conv('conv_2d_1_2', x0)
+    x1 = l.pool(x0)
+    x1 = l.conv('conv_2d_2', x1)
+    x1 = l.conv('conv_2d_2_2', x1)
+    x2 = l.pool(x1)
+    x2 = l.conv('conv_2d_3_2', x2)
+    x2 = l.conv('conv_2d_3', x2)
+    x3 = l.pool(x2)
+    x3 = l.conv('conv_2d_4_2', x3)
+    x3 = l.conv('conv_2d_4', x3)
+    x3 = l.up(x3)
+    x = l.concat([x3, x2])
+    x = l.conv('conv_2d_5_2', x)
+    x = l.conv('conv_2d_5', x)
+    x = l.up(x)
+    x = l.concat([x, x1])
+    x = l.conv('conv_2d_6_2', x)
+    x = l.conv('conv_2d_6', x)
+    x = l.up(x)
+    x = l.concat([x, x0])
+    x = l.conv('conv_2d_7', x)
+    x = l.conv('conv_2d_7_2', x)
+    return l.output(x)
+
+
+architectures = OrderedDict([
+    ('basic', basic),
+    ('unet', unet),
+    ('unet2', unet2),
+    ('unet3', unet3),
+    ('unet4', unet4),
+])
+
+
+def get_architecture(name):
+    """
+    :param name: str: name of a cubed-sphere architecture; one of 'basic', 'unet', 'unet2', 'unet3', 'unet4'
+    :return: the architecture function
+    """
+    try:
+        return architectures[name.lower()]
+    except KeyError:
+        raise ValueError("unknown architecture '%s'; must be one of %s" % (name, list(architectures.keys())))
+
+
+def conv_filters(name, base_filter_number=32):
+    """
+    Number of filters in each named 3x3 convolution. U-nets use fewer filters in the layers preceding a concatenation
+    with a skip connection.
+
+    :param name: str: name of the architecture
+    :param base_filter_number: int: number of filters in the first (highest-resolution) layers
+    :return: dict: filters per layer name
+    """
+    b = base_filter_number
+    skip_connections = 'unet' in name.lower()
+    return {
+        'conv_2d_1': b,
+        'conv_2d_1_2': b,
+        'conv_2d_1_3': b,
+        'conv_2d_2': b * 2,
+        'conv_2d_2_2': b * 2,
+        'conv_2d_2_3': b * 2,
+        'conv_2d_3': b * 4,
+        'conv_2d_3_2': b * 4,
+        'conv_2d_4': b * 4 if skip_connections else b * 8,
+        'conv_2d_4_2': b * 8,
+        'conv_2d_5': b * 2 if skip_connections else b * 4,
+        'conv_2d_5_2': b * 4,
+        'conv_2d_5_3': b * 4,
+        'conv_2d_6': b if skip_connections else b * 2,
+        'conv_2d_6_2': b * 2,
+        'conv_2d_6_3': b * 2,
+        'conv_2d_7': b,
+        'conv_2d_7_2': b,
+        'conv_2d_7_3': b,
+    }
+
+
+# ==================================================================================================================== #
+# Analytic shapes and cost
+# ==================================================================================================================== #
+
+class _ShapeTracer(object):
+    """
+    Layer provider that runs an architecture on (channels, face size) tuples to record the shape of each convolution.
+    """
+
+    def __init__(self, filters, output_channels):
+        self.filters = filters
+        self.output_channels = output_channels
+        self.layers = OrderedDict()
+
+    def _record(self, name, x, filters, kernel_size):
+        channels, size = x
+        self.layers[name] = {'input_channels': channels, 'filters': filters, 'kernel_size': kernel_size,
+                             'face_size': size}
+        return filters, size
+
+    def conv(self, name, x):
+        return self._record(name, x, self.filters[name], 3)
+
+    def output(self, x):
+        return self._record('output', x, self.output_channels, 1)
+
+    def pool(self, x):
+        if x[1] % 2 != 0:
+            raise ValueError('face size %d is not divisible by 2 at a pooling layer' % x[1])
+        return x[0], x[1] // 2
+
+    def up(self, x):
+        return x[0], x[1] * 2
+
+    def concat(self, xs):
+        if len(set(x[1] for x in xs)) > 1:
+            raise ValueError('mismatched face sizes in concatenation: %s' % [x[1] for x in xs])
+        return sum(x[0] for x in xs), xs[0][1]
+
+
+def cube_sphere_complexity(name, input_channels, output_channels, face_size, base_filter_number=32,
+                           independent_north_pole=False):
+    """
+    Analytic size and cost of one forward step of a cubed-sphere architecture for a single sample.
+
+    :param name: str: name of the architecture
+    :param input_channels: int: number of input channels, including insolation and constants
+    :param output_channels: int: number of output channels
+    :param face_size: int: number of points along each side of a cube face
+    :param base_filter_number: int: number of filters in the first layers
+    :param independent_north_pole: bool: if True, the convolutions learn a third set of weights for the north pole
+    :return: dict: 'layers' (shapes of each convolution), 'parameters', and 'flops' (multiply and add counted as two
+        floating-point operations; convolutions and biases only)
+    """
+    tracer = _ShapeTracer(conv_filters(name, base_filter_number), output_channels)
+    get_architecture(name)(tracer, (input_channels, face_size))
+    n_kernels = 3 if independent_north_pole else 2
+    parameters = 0
+    flops = 0
+    for layer in tracer.layers.values():
+        weights = layer['kernel_size'] ** 2 * layer['input_channels'] * layer['filters']
+        parameters += n_kernels * (weights + layer['filters'])
+        flops += 6 * layer['face_size'] ** 2 * (2 * weights + layer['filters'])
+    return {'layers': tracer.layers, 'parameters': parameters, 'flops': flops}
+
+
+# ==================================================================================================================== #
+# Keras models
+# ==================================================================================================================== #
+
+class _KerasLayers(object):
+    """
+    Layer provider for Keras. Each named layer is created once so that repeated calls share weights.
+    """
+
+    def __init__(self, filters, output_channels, data_format='channels_last', independent_north_pole=False):
+        from tensorflow.keras.layers import AveragePooling3D, UpSampling3D, ReLU, Concatenate
+        from ..custom import CubeSphereConv2D, CubeSpherePadding2D
+
+        self.channel_axis = -1 if data_format == 'channels_last' else 1
+        self.padding = CubeSpherePadding2D(1, data_format=data_format)
+        self.pooling = AveragePooling3D((1, 2, 2), data_format=data_format)
+        self.up_sampling = UpSampling3D((1, 2, 2), data_format=data_format)
+        self.relu = ReLU(negative_slope=0.1, max_value=10.)
+        self._concatenate = Concatenate
+        conv_kwargs = {
+            'dilation_rate': 1,
+            'padding': 'valid',
+            'activation': 'linear',
+            'data_format': data_format,
+            'independent_north_pole': independent_north_pole,
+            'flip_north_pole': not independent_north_pole
+        }
+        self.convs = {name: CubeSphereConv2D(f, 3, **conv_kwargs) for name, f in filters.items()}
+        self.output_conv = CubeSphereConv2D(output_channels, 1, name='output', **conv_kwargs)
+
+    def conv(self, name, x):
+        return self.relu(self.convs[name](self.padding(x)))
+
+    def output(self, x):
+        return self.output_conv(x)
+
+    def pool(self, x):
+        return self.pooling(x)
+
+    def up(self, x):
+        return self.up_sampling(x)
+
+    def concat(self, xs):
+        return self._concatenate(axis=self.channel_axis)(xs)
+
+
+def cube_sphere_model(name, input_shape, output_channels, base_filter_number=32, integration_steps=1,
+                      time_steps=1, insolation=False, constants=0, data_format='channels_last',
+                      independent_north_pole=False):
+    """
+    Build a Keras model of a cubed-sphere architecture, optionally unrolled over several integration steps that share
+    weights, as trained in Azure/train_cs.py. The inputs and outputs match those produced by the ArrayDataGenerator
+    and SeriesDataGenerator with rank=3 and the same data_format: the inputs are the main input ('main_input'), then
+    the insolation for integration steps 2 onwards ('solar_1', ...) if insolation is True, then the constant fields
+    ('constants') if constants > 0. Outputs are one for each integration step.
+
+    :param name: str: name of the architecture; one of 'basic', 'unet', 'unet2', 'unet3', 'unet4'
+    :param input_shape: tuple: shape of the main input, e.g. the generator's convolution_shape: (6, height, width,
+        channels) for channels_last or (channels, 6, height, width) for channels_first. The channels include
+        insolation but not the constants.
+    :param output_channels: int: number of output channels
+    :param base_filter_number: int: number of filters in the first layers
+    :param integration_steps: int: number of steps to unroll the model over
+    :param time_steps: int: number of input/output time steps; used to add insolation to the outputs fed back into
+        the model
+    :param insolation: bool: if True and integration_steps > 1, add inputs for the insolation of subsequent steps
+    :param constants: int: number of constant fields concatenated to the input of every step
+    :param data_format: str: 'channels_last' or 'channels_first'
+    :param independent_north_pole: bool: if True, learn separate weights for the north pole face
+    :return: tensorflow.keras.models.Model
+    """
+    from tensorflow.keras.layers import Input, Reshape, Concatenate, Permute
+    from tensorflow.keras.models import Model
+
+    architecture = get_architecture(name)
+    if data_format not in ['channels_last', 'channels_first']:
+        raise ValueError("'data_format' must be 'channels_last' or 'channels_first'")
+    channels_last = data_format == 'channels_last'
+    input_shape = tuple(input_shape)
+    spatial_shape = input_shape[:-1] if channels_last else input_shape[1:]
+    channel_axis = -1 if channels_last else 1
+    input_solar = integration_steps > 1 and insolation
+    layers = _KerasLayers(conv_filters(name, base_filter_number), output_channels, data_format=data_format,
+                          independent_north_pole=independent_north_pole)
+
+    inputs = [Input(shape=input_shape, name='main_input')]
+    if input_solar:
+        solar_shape = (time_steps,) + spatial_shape + (1,) if channels_last else (time_steps, 1) + spatial_shape
+        inputs += [Input(shape=solar_shape, name='solar_%d' % d) for d in range(1, integration_steps)]
+    if constants > 0:
+        constants_shape = spatial_shape + (constants,) if channels_last else (constants,) + spatial_shape
+        inputs += [Input(shape=constants_shape, name='constants')]
+
+    outputs = []
+    x = inputs[0]
+    for step in range(integration_steps):
+        if step > 0:
+            x = outputs[step - 1]
+            if input_solar:
+                # Add the insolation to each time step of the previous output
+                if channels_last:
+                    x = Reshape(spatial_shape + (time_steps, -1))(x)
+                    x = Concatenate(axis=-1)([x, Permute((2, 3, 4, 1, 5))(inputs[step])])
+                else:
+                    x = Reshape((time_steps, -1) + spatial_shape)(x)
+                    x = Concatenate(axis=2)([x, inputs[step]])
+                x = Reshape(input_shape)(x)
+        if constants > 0:
+            x = Concatenate(axis=channel_axis)([x, inputs[-1]])
+        outputs.append(architecture(layers, x))
+
+    return Model(inputs=inputs if len(inputs) > 1 else inputs[0],
+                 outputs=outputs if len(outputs) > 1 else outputs[0])
@@ -0,0 +1,187 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+PyTorch ports of the cubed-sphere layers and the model zoo in .zoo. Data are channels_first, (batch, channels, 6,
+height, width), and the modules reproduce DLWP.custom.CubeSpherePadding2D and CubeSphereConv2D.
+"""
+
+import warnings
+from .zoo import get_architecture, conv_filters, cube_sphere_complexity
+
+try:
+    import torch
+    import torch.nn as nn
+    import torch.nn.functional as F
+except ImportError:
+    warnings.warn('the PyTorch model zoo is not available because PyTorch is not installed.')
+    nn = None
+
+
+class TorchCubeSpherePadding2D(nn.Module if nn is not None else object):
+    """
+    Pads each face of cubed-sphere data with the adjacent rows and columns of the neighbouring faces. Port of
+    DLWP.custom.CubeSpherePadding2D for channels_first data.
+    """
+
+    def __init__(self, padding=1):
+        """
+        :param padding: int: number of points to pad on each side of each face
+        """
+        super(TorchCubeSpherePadding2D, self).__init__()
+        self.padding = int(padding)
+
+    def forward(self, x):
+        p = self.padding
+        f = [x[:, :, i] for i in range(6)]
+
+        # Pad the equatorial upper/lower boundaries and the polar upper/lower boundaries
+        out1 = [
+            torch.cat([f[4][:, :, -p:, :], f[0], f[5][:, :, :p, :]], dim=2),
+            torch.cat([torch.flip(f[4], [2])[:, :, :, -p:].transpose(2, 3), f[1],
+                       torch.flip(f[5][:, :, :, -p:], [3]).transpose(2, 3)], dim=2),
+            torch.cat([torch.flip(f[4][:, :, :p], [2, 3]), f[2], torch.flip(f[5][:, :, -p:], [2, 3])], dim=2),
+            torch.cat([torch.flip(f[4][:, :, :, :p], [3]).transpose(2, 3), f[3],
+                       torch.flip(f[5], [2])[:, :, :, :p].transpose(2, 3)], dim=2),
+            torch.cat([torch.flip(f[2][:, :, :p], [2, 3]), f[4], f[0][:, :, :p, :]], dim=2),
+            torch.cat([f[0][:, :, -p:, :], f[5], torch.flip(f[2][:, :, -p:], [2, 3])], dim=2),
+        ]
+
+        # Pad the equatorial periodic lateral boundaries and the polar left/right boundaries
+        out = [torch.cat([out1[(i - 1) % 4][:, :, :, -p:], out1[i], out1[(i + 1) % 4][:, :, :, :p]], dim=3)
+               for i in range(4)]
+        out.append(torch.cat([torch.flip(out[3][:, :, p:2 * p, :], [2]).transpose(2, 3), out1[4],
+                              torch.flip(out[1][:, :, p:2 * p, :], [3]).transpose(2, 3)], dim=3))
+        out.append(torch.cat([torch.flip(out[3][:, :, -2 * p:-p, :], [3]).transpose(2, 3), out1[5],
+                              torch.flip(out[1][:, :, -2 * p:-p, :], [2]).transpose(2, 3)], dim=3))
+        return torch.stack(out, dim=2)
+
+
+class TorchCubeSphereConv2D(nn.Module if nn is not None else object):
+    """
+    2D convolution on cubed-sphere data with one kernel for the equatorial faces and one for the polar faces (or one
+    for each pole). Port of DLWP.custom.CubeSphereConv2D for channels_first data with 'valid' padding.
+    """
+
+    def __init__(self, in_channels, filters, kernel_size, flip_north_pole=True, independent_north_pole=False):
+        """
+        :param in_channels: int: number of input channels
+        :param filters: int: number of output channels
+        :param kernel_size: int: size of the square kernel
+        :param flip_north_pole: bool: reverse the height dimension of the north pole face to match the rotation of
+            the south pole
+        :param independent_north_pole: bool: if True, learn separate weights for the north pole
+        """
+        super(TorchCubeSphereConv2D, self).__init__()
+        self.filters = filters
+        self.flip_north_pole = flip_north_pole
+        self.independent_north_pole = independent_north_pole
+        self.equatorial = nn.Conv2d(in_channels, filters, kernel_size)
+        self.polar = nn.Conv2d(in_channels, filters, kernel_size)
+        self.north_pole = nn.Conv2d(in_channels, filters, kernel_size) if independent_north_pole else None
+
+    @staticmethod
+    def _faces(conv, x):
+        # Fold the faces into the batch dimension: (batch, channels, faces, h, w) -> (batch * faces, channels, h, w)
+        n, c, n_faces, h, w = x.shape
+        y = conv(x.transpose(1, 2).reshape(n * n_faces, c, h, w))
+        return y.reshape((n, n_faces) + y.shape[1:]).transpose(1, 2)
+
+    def forward(self, x):
+        north = x[:, :, 5:]
+        if self.flip_north_pole:
+            north = torch.flip(north, [3])
+        if self.independent_north_pole:
+            south = self._faces(self.polar, x[:, :, 4:5])
+            north = self._faces(self.north_pole, north)
+        else:
+            south, north = self._faces(self.polar, torch.cat([x[:, :, 4:5], north], dim=2)).split(1, dim=2)
+        if self.flip_north_pole:
+            north = torch.flip(north, [3])
+        return torch.cat([self._faces(self.equatorial, x[:, :, :4]), south, north], dim=2)
+
+
+class _TorchLayers(object):
+    """
+    Layer provider for torch, bound to the modules of a TorchCubeSphereNet.
+    """
+
+    def __init__(self, net):
+        self.net = net
+
+    def conv(self, name, x):
+        return torch.clamp(F.leaky_relu(self.net.convs[name](self.net.padding(x)), 0.1), max=10.)
+
+    def output(self, x):
+        return self.net.output_conv(x)
+
+    def pool(self, x):
+        return F.avg_pool3d(x, (1, 2, 2))
+
+    def up(self, x):
+        return F.interpolate(x, scale_factor=(1, 2, 2), mode='nearest')
+
+    def concat(self, xs):
+        return torch.cat(xs, dim=1)
+
+
+class TorchCubeSphereNet(nn.Module if nn is not None else object):
+    """
+    PyTorch version of DLWP.model.zoo.cube_sphere_model. The forward method takes the same inputs as the Keras model
+    in channels_first format: the main input, then the insolation for integration steps 2 onwards if insolation is
+    True, then the constants if constants > 0. It returns a list of outputs, one for each integration step, or a
+    single output if integration_steps is 1.
+    """
+
+    def __init__(self, name, input_channels, output_channels, base_filter_number=32, integration_steps=1,
+                 time_steps=1, insolation=False, constants=0, independent_north_pole=False):
+        """
+        :param name: str: name of the architecture; one of 'basic', 'unet', 'unet2', 'unet3', 'unet4'
+        :param input_channels: int: number of channels of the main input, including insolation but not constants
+        :param output_channels: int: number of output channels
+        :param base_filter_number: int: number of filters in the first layers
+        :param integration_steps: int: number of steps to unroll the model over
+        :param time_steps: int: number of input/output time steps
+        :param insolation: bool: if True and integration_steps > 1, take insolation inputs for subsequent steps
+        :param constants: int: number of constant fields concatenated to the input of every step
+        :param independent_north_pole: bool: if True, learn separate weights for the north pole face
+        """
+        super(TorchCubeSphereNet, self).__init__()
+        self.architecture = get_architecture(name)
+        self.integration_steps = integration_steps
+        self.time_steps = time_steps
+        self.input_solar = integration_steps > 1 and insolation
+        self.constants = constants
+
+        # Find the input channels of each layer from the analytic shapes; any face size divisible by 8 will do
+        layers = cube_sphere_complexity(name, input_channels + constants, output_channels, 8,
+                                        base_filter_number)['layers']
+        filters = conv_filters(name, base_filter_number)
+        conv_kwargs = {'flip_north_pole': not independent_north_pole, 'independent_north_pole': independent_north_pole}
+        self.padding = TorchCubeSpherePadding2D(1)
+        self.convs = nn.ModuleDict({
+            layer: TorchCubeSphereConv2D(shape['input_channels'], filters[layer], 3, **conv_kwargs)
+            for layer, shape in layers.items() if layer != 'output'
+        })
+        self.output_conv = TorchCubeSphereConv2D(layers['output']['input_channels'], output_channels, 1,
+                                                 **conv_kwargs)
+        self._layers = _TorchLayers(self)
+
+    def forward(self, *inputs):
+        outputs = []
+        x = inputs[0]
+        for step in range(self.integration_steps):
+            if step > 0:
+                x = outputs[step - 1]
+                if self.input_solar:
+                    # Add the insolation to each time step of the previous output
+                    shape = x.shape
+                    x = x.reshape((shape[0], self.time_steps, -1) + shape[2:])
+                    x = torch.cat([x, inputs[step]], dim=2).reshape((shape[0], -1) + shape[2:])
+            if self.constants > 0:
+                x = torch.cat([x, inputs[-1]], dim=1)
+            outputs.append(self.architecture(self._layers, x))
+        return outputs if len(outputs) > 1 else outputs[0]
@@ -9,6 +9,13 @@ Collection of random plotting functions. Unfortunately these are not very robust
 a bit cleaner to place them here than have plotting functions defined in every user-facing script.
 """
 
+import multiprocessing
+import shutil
+import subprocess
+import warnings
+import weakref
+from functools import lru_cache
+
 import numpy as np
 from matplotlib import pyplot as plt
 from ..util import remove_chars
@@ -64,71 +71,412 @@ def plot_basemap(basemap, lon, lat, z=None, plot_type='contourf', plot_kwargs=No
     return fig
 
 
-def slp_contour(fig, m, slp, lons, lats, window=100):
+@lru_cache(maxsize=16)
+def _cube_sphere_polygons(n, lon_0):
     """
-    Add sea-level pressure labels to a contour map. I don't remember where I found the code for this function
-    some time in the past, but I wish I could attribute it.
+    Cell polygons of a cubed sphere in longitude-latitude, for a map centred on lon_0. Vertices at a pole are split
+    into two polar vertices at the longitudes of the neighbouring vertices, the cell around a pole (n odd) is closed
+    along the pole, and cells crossing the map edge are repeated on both sides.
 
-    :param fig:
-    :param m:
-    :param slp:
-    :param lons:
-    :param lats:
-    :param window:
-    :return:
+    :return: (list, ndarray): (k, 2) vertex arrays of (lon, lat) and the index of the cell of each polygon
     """
-    def extrema(mat, mode='wrap', w=10):
+    from ..remap.gnomonic import cube_sphere_corners
+    lat, lon = cube_sphere_corners(n)
+    corner_lat = np.stack([lat[:, :-1, :-1], lat[:, :-1, 1:], lat[:, 1:, 1:], lat[:, 1:, :-1]], axis=-1).reshape(-1, 4)
+    corner_lon = np.stack([lon[:, :-1, :-1], lon[:, :-1, 1:], lon[:, 1:, 1:], lon[:, 1:, :-1]], axis=-1).reshape(-1, 4)
+    pole = np.abs(corner_lat) > 90. - 1e-9
+    # Unwrap the longitudes of each cell about its first corner that is not a pole
+    first = np.argmax(~pole, axis=1)
+    reference = corner_lon[np.arange(len(corner_lon)), first][:, np.newaxis]
+    corner_lon = reference + (corner_lon - reference + 180.) % 360. - 180.
+    # Consecutive unwrapped longitudes of the cell around a pole turn by 360 degrees
+    turn = np.abs(np.sum((np.roll(corner_lon, -1, axis=1) - corner_lon + 180.) % 360. - 180., axis=1)) > 180.
+    turn &= ~pole.any(axis=1)
+    # Move each cell into the map, then copy those crossing its edges
+    shift = 360. * np.round((np.mean(corner_lon, axis=1) - lon_0) / 360.)
+    corner_lon -= shift[:, np.newaxis]
+
+    polygons = list(np.stack([corner_lon, corner_lat], axis=-1))
+    for c in np.nonzero(pole.any(axis=1))[0]:
+        k = np.argmax(pole[c])
+        before, after = polygons[c][k - 1], polygons[c][(k + 1) % 4]
+        polar = [[before[0], corner_lat[c, k]], [after[0], corner_lat[c, k]]]
+        polygons[c] = np.concatenate([polygons[c][:k], polar, polygons[c][k + 1:]])
+    for c in np.nonzero(turn)[0]:
+        # Close the cell around a pole along the edges of the map and the pole
+        vertex_lon = (corner_lon[c] - lon_0 + 180.) % 360. + lon_0 - 180.
+        order = np.argsort(vertex_lon)
+        polar = np.sign(corner_lat[c, 0]) * 90.
+        polygons[c] = np.concatenate([[[lon_0 - 180., corner_lat[c, order[0]]]],
+                                      np.stack([vertex_lon[order], corner_lat[c, order]], axis=-1),
+                                      [[lon_0 + 180., corner_lat[c, order[-1]]], [lon_0 + 180., polar],
+                                       [lon_0 - 180., polar]]])
+    index = list(range(len(polygons)))
+    for c in range(len(corner_lon)):
+        if turn[c]:
+            continue
+        if polygons[c][:, 0].min() < lon_0 - 180.:
+            polygons.append(polygons[c] + [360., 0.])
+            index.append(c)
+        if polygons[c][:, 0].max() > lon_0 + 180.:
+            polygons.append(polygons[c] - [360., 0.])
+            index.append(c)
+    for v in polygons:
+        v.flags.writeable = False
+    index = np.array(index)
+    index.flags.writeable = False
+    return polygons, index
+
+
+# Projected cubed-sphere polygons of each Basemap, by (n, lon_0)
+_projected_polygons = weakref.WeakKeyDictionary()
+
+
+def _cube_sphere_map_polygons(n, m=None, lon_0=None):
+    if lon_0 is None:
+        lon_0 = float(getattr(m, 'projparams', {}).get('lon_0', 180.))
+    polygons, index = _cube_sphere_polygons(n, lon_0)
+    if m is None:
+        return polygons, index
+    cache = _projected_polygons.setdefault(m, {})
+    if (n, lon_0) not in cache:
+        # Project all the vertices in one call
+        vertices = np.concatenate(polygons)
+        x, y = m(vertices[:, 0], vertices[:, 1])
+        splits = np.cumsum([len(v) for v in polygons])[:-1]
+        cache[(n, lon_0)] = (np.split(np.stack([x, y], axis=-1), splits), index)
+    return cache[(n, lon_0)]
+
+
+class CubeSpherePlot(object):
+    """
+    Plot of data on the cubed sphere, drawn directly from the cell polygons of each face without remapping to a
+    latitude-longitude grid. The polygons are computed once per resolution and map projection; update() only changes
+    the colours, so that it is cheap to plot many fields, e.g. every step of a forecast.
+    """
+
+    def __init__(self, n, m=None, ax=None, lon_0=None, plot_kwargs=None):
+        """
+        :param n: int: number of cells along each side of a face
+        :param m: Basemap object: if given, the polygons are projected with it; otherwise they are drawn in longitude
+            and latitude
+        :param ax: plt.Axes: axes in which to draw; defaults to the current axes
+        :param lon_0: float: central longitude of the map; defaults to the lon_0 of m, or 180
+        :param plot_kwargs: dict: passed to matplotlib.collections.PolyCollection, e.g. cmap, norm, vmin and vmax
         """
-        Find the indices of local extrema (min and max)
-        in the input array.
+        from matplotlib.collections import PolyCollection
+        plot_kwargs = dict(plot_kwargs or {})
+        self.n = int(n)
+        self.ax = ax or plt.gca()
+        polygons, self.index = _cube_sphere_map_polygons(self.n, m, lon_0)
+        vmin, vmax = plot_kwargs.pop('vmin', None), plot_kwargs.pop('vmax', None)
+        plot_kwargs.setdefault('edgecolors', 'face')
+        plot_kwargs.setdefault('antialiased', False)
+        self.collection = PolyCollection(polygons, **plot_kwargs)
+        self.collection.set_clim(vmin, vmax)
+        self.ax.add_collection(self.collection)
+        if m is None:
+            center = 180. if lon_0 is None else lon_0
+            self.ax.set_xlim(center - 180., center + 180.)
+            self.ax.set_ylim(-90., 90.)
+        else:
+            m.set_axes_limits(ax=self.ax)
+
+    def update(self, data):
+        """
+        Set the data of the plot.
+
+        :param data: ndarray or DataArray (face, height, width): data on the cubed sphere
+        :return: matplotlib.collections.PolyCollection: the collection of cells
         """
+        data = np.asarray(data)
+        if data.shape != (6, self.n, self.n):
+            raise ValueError("'data' must have shape (6, %d, %d); got %s" % (self.n, self.n, data.shape))
+        self.collection.set_array(data.reshape(-1)[self.index])
+        return self.collection
+
+
+def plot_cube_sphere(data, m=None, ax=None, lon_0=None, plot_kwargs=None, colorbar=True, colorbar_label=None,
+                     title=None):
+    """
+    Plot data on the cubed sphere directly from its faces, without remapping to a latitude-longitude grid.
+
+    :param data: ndarray or DataArray (face, height, width): data on the cubed sphere
+    :param m: Basemap object: if given, the cells are projected with it; otherwise they are drawn in longitude and
+        latitude
+    :param ax: plt.Axes: axes in which to draw; defaults to the current axes
+    :param lon_0: float: central longitude of the map; defaults to the lon_0 of m, or 180
+    :param plot_kwargs: dict: passed to matplotlib.collections.PolyCollection, e.g. cmap, norm, vmin and vmax
+    :param colorbar: bool: if True, plots a color bar
+    :param colorbar_label: str: name label for the color bar
+    :param title: str: title of plot
+    :return: CubeSpherePlot: call its update() method to plot other data with the same geometry
+    """
+    data = np.asarray(data)
+    if data.ndim != 3 or data.shape[0] != 6 or data.shape[1] != data.shape[2]:
+        raise ValueError("'data' must have dimensions (face, height, width) of shape (6, n, n)")
+    plot = CubeSpherePlot(data.shape[-1], m=m, ax=ax, lon_0=lon_0, plot_kwargs=plot_kwargs)
+    plot.update(data)
+    if colorbar:
+        cb = plot.ax.figure.colorbar(plot.collection, ax=plot.ax)
+        if colorbar_label is not None:
+            cb.set_label(colorbar_label)
+    if title is not None:
+        plot.ax.set_title(title)
+    return plot
+
+
+def find_extrema(field, window=10, mode='wrap'):
+    """
+    Find the local minima and maxima of a 2-D field: the points equal to the minimum or maximum of the window centred on
+    them.
+
+    :param field: ndarray (lat, lon): field
+    :param window: int: size of the window in grid points
+    :param mode: str: boundary mode of scipy.ndimage filters; 'wrap' suits global fields
+    :return: (tuple, tuple): indices (as from np.nonzero) of the minima and of the maxima
+    """
+    from scipy.ndimage import minimum_filter, maximum_filter
+    mn = minimum_filter(field, size=window, mode=mode)
+    mx = maximum_filter(field, size=window, mode=mode)
+    return np.nonzero(field == mn), np.nonzero(field == mx)
+
+
+def _suppress_nearby(points, min_distance):
+    """
+    Greedily select points, in order, that are farther than min_distance from all previously selected points. A KD-tree
+    of the points finds the neighbours of each selected point, so the cost is O(n log n) rather than O(n^2).
+
+    :param points: ndarray (n, d): coordinates of the points, in order of priority
+    :param min_distance: float: minimum distance between selected points
+    :return: ndarray: indices of the selected points
+    """
+    from scipy.spatial import cKDTree
+    if len(points) == 0:
+        return np.array([], dtype=int)
+    neighbours = cKDTree(points).query_ball_point(points, min_distance)
+    suppressed = np.zeros(len(points), dtype=bool)
+    selected = []
+    for i in range(len(points)):
+        if suppressed[i]:
+            continue
+        selected.append(i)
+        suppressed[neighbours[i]] = True
+    return np.array(selected, dtype=int)
+
 
-        from scipy.ndimage.filters import minimum_filter, maximum_filter
+def _unit_vectors(lat, lon):
+    # Points on the unit sphere, in which chord distances increase monotonically with great-circle distances
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
 
-        mn = minimum_filter(mat, size=w, mode=mode)
-        mx = maximum_filter(mat, size=w, mode=mode)
-        return np.nonzero(mat == mn), np.nonzero(mat == mx)
 
+def _chord(distance, radius=6371.):
+    # Chord length on the unit sphere of a great-circle distance
+    return 2. * np.sin(np.minimum(distance / radius, np.pi) / 2.)
+
+
+def slp_contour(fig, m, slp, lons, lats, window=100):
+    """
+    Add sea-level pressure labels to a contour map. I don't remember where I found the code for this function
+    some time in the past, but I wish I could attribute it.
+
+    Local extrema are found with find_extrema. Labels are placed at the deepest lows and strongest highs first, and
+    further extrema closer than a minimum distance to a placed label are suppressed.
+
+    :param fig: plt.Figure: figure to which to add the labels
+    :param m: Basemap object
+    :param slp: ndarray (lat, lon): sea-level pressure in hPa
+    :param lons: ndarray (lat, lon): longitude values
+    :param lats: ndarray (lat, lon): latitude values
+    :param window: int: size in grid points of the window in which highs and lows are extrema
+    :return: plt.Figure
+    """
     caxisP = np.arange(900, 1050, 4)
     c2 = m.contour(lons, lats, slp, caxisP, latlon=True, linewidth=1.0, colors='black')
     plt.clabel(c2, c2.levels, inline=True, fmt='%0.0f')
-    # Plot highs and lows for slp
-    local_min, local_max = extrema(slp, mode='wrap', w=window)
+    ax = plt.gca()
     x, y = m(lons, lats)
-    xlows = x[local_min]
-    xhighs = x[local_max]
-    ylows = y[local_min]
-    yhighs = y[local_max]
-    lowvals = slp[local_min]
-    highvals = slp[local_max]
-    # Plot lows
-    xyplotted = []
     yoffset = 0.022 * (m.ymax - m.ymin)
     dmin = 20.0 * yoffset
-    for x, y, p in zip(xlows, ylows, lowvals):
-        if (m.xmax - dmin > x > m.xmin + dmin and m.ymax - dmin > y > m.ymin + dmin):
-            dist = [np.sqrt((x - x0) ** 2 + (y - y0) ** 2) for x0, y0 in xyplotted]
-            if not dist or min(dist) > dmin:
-                plt.text(x, y, 'L', fontsize=14, fontweight='bold', ha='center', va='center', color='r')
-                plt.text(x, y - yoffset, repr(int(p)), fontsize=9, ha='center', va='top', color='r',
-                         bbox=dict(boxstyle="square", ec='None', fc=(1, 1, 1, 0.5)))
-                xyplotted.append((x, y))
-    # Plot highs
-    xyplotted = []
-    for x, y, p in zip(xhighs, yhighs, highvals):
-        if (m.xmax - dmin > x > m.xmin + dmin and m.ymax - dmin > y > m.ymin + dmin):
-            dist = [np.sqrt((x - x0) ** 2 + (y - y0) ** 2) for x0, y0 in xyplotted]
-            if not dist or min(dist) > dmin:
-                plt.text(x, y, 'H', fontsize=14, fontweight='bold', ha='center', va='center', color='b')
-                plt.text(x, y - yoffset, repr(int(p)), fontsize=9, ha='center', va='top', color='b',
-                         bbox=dict(boxstyle="square", ec='None', fc=(1, 1, 1, 0.5)))
-                xyplotted.append((x, y))
+    for indices, letter, color, sign in zip(find_extrema(slp, mode='wrap', window=window), 'LH', 'rb', [1., -1.]):
+        xe, ye, pe = x[indices], y[indices], slp[indices]
+        inside = (m.xmax - dmin > xe) & (xe > m.xmin + dmin) & (m.ymax - dmin > ye) & (ye > m.ymin + dmin)
+        xe, ye, pe = xe[inside], ye[inside], pe[inside]
+        order = np.argsort(sign * pe, kind='stable')
+        keep = order[_suppress_nearby(np.stack([xe[order], ye[order]], axis=-1), dmin)]
+        if len(keep) == 0:
+            continue
+        # All the letters of one kind are drawn as a single artist
+        ax.scatter(xe[keep], ye[keep], s=14. ** 2, marker=r'$\mathbf{%s}$' % letter, c=color, linewidths=0,
+                   zorder=10)
+        for xk, yk, pk in zip(xe[keep], ye[keep], pe[keep]):
+            ax.text(xk, yk - yoffset, repr(int(pk)), fontsize=9, ha='center', va='top', color=color,
+                    bbox=dict(boxstyle="square", ec='None', fc=(1, 1, 1, 0.5)))
     return fig
 
 
-def plot_movie(m, lat, lon, val, pred, dates, model_title='', plot_kwargs=None, out_directory=None):
+def track_pressure_centers(slp, lat, lon, kind='low', window=10, min_separation=500., max_distance=1000.,
+                           min_length=2, mode='wrap'):
+    """
+    Detect the pressure centres of each step of a forecast and link them into tracks, e.g. for cyclone-track
+    products. Centres are local extrema (see find_extrema); within one step, centres closer than min_separation to a
+    more intense one are dropped. At each step, centres are joined to the tracks of the previous step greedily, closest
+    pairs first, if they are within max_distance; other centres start new tracks.
+
+    :param slp: ndarray (time, lat, lon): sea-level pressure
+    :param lat: ndarray: latitudes in degrees, either 1-D or 2-D (lat, lon)
+    :param lon: ndarray: longitudes in degrees, either 1-D or 2-D (lat, lon)
+    :param kind: str: 'low' or 'high'
+    :param window: int: size in grid points of the window in which centres are extrema
+    :param min_separation: float: minimum distance in km between centres at the same step
+    :param max_distance: float: maximum distance in km a centre may move in one step
+    :param min_length: int: minimum number of steps of the returned tracks
+    :param mode: str: boundary mode of scipy.ndimage filters; 'wrap' suits global fields
+    :return: pandas.DataFrame: columns 'track', 'step', 'lat', 'lon', and 'value', sorted by track and step
+    """
+    import pandas as pd
+    from scipy.spatial import cKDTree
+    if kind not in ['low', 'high']:
+        raise ValueError("'kind' must be 'low' or 'high'")
+    slp = np.asarray(slp)
+    if slp.ndim != 3:
+        raise ValueError("'slp' must have dimensions (time, lat, lon)")
+    lat, lon = np.asarray(lat), np.asarray(lon)
+    if lat.ndim == 1:
+        lat, lon = np.meshgrid(lat, lon, indexing='ij')
+    sign = 1. if kind == 'low' else -1.
+
+    rows = []
+    n_tracks = 0
+    last_points = np.empty((0, 3))
+    last_tracks = np.array([], dtype=int)
+    for step, field in enumerate(slp):
+        indices = find_extrema(field, window=window, mode=mode)[0 if kind == 'low' else 1]
+        values = field[indices]
+        order = np.argsort(sign * values, kind='stable')
+        points = _unit_vectors(lat[indices][order], lon[indices][order])
+        keep = order[_suppress_nearby(points, _chord(min_separation))]
+        points = _unit_vectors(lat[indices][keep], lon[indices][keep])
+        tracks = np.full(len(keep), -1, dtype=int)
+        if len(last_points) > 0 and len(points) > 0:
+            pairs = cKDTree(last_points).sparse_distance_matrix(cKDTree(points), _chord(max_distance),
+                                                                output_type='ndarray')
+            used = np.zeros(len(last_points), dtype=bool)
+            for pair in pairs[np.argsort(pairs['v'], kind='stable')]:
+                if not used[pair['i']] and tracks[pair['j']] < 0:
+                    used[pair['i']] = True
+                    tracks[pair['j']] = last_tracks[pair['i']]
+        new = tracks < 0
+        tracks[new] = np.arange(n_tracks, n_tracks + new.sum())
+        n_tracks += new.sum()
+        rows.append(pd.DataFrame({'track': tracks, 'step': step, 'lat': lat[indices][keep],
+                                  'lon': lon[indices][keep], 'value': values[keep]}))
+        last_points, last_tracks = points, tracks
+
+    result = pd.concat(rows, ignore_index=True)
+    length = result.groupby('track')['step'].transform('size')
+    result = result[length >= min_length].sort_values(['track', 'step'], kind='stable')
+    return result.reset_index(drop=True)
+
+
+class _MovieRenderer(object):
+    """
+    Renders the frames of plot_movie. The figure, with its coastlines and grid lines, is drawn once; each frame then
+    restores the saved background and redraws only the data, the lines over them, and the titles (blitting). Frames
+    are cropped to the drawn content, as by savefig(bbox_inches='tight').
+    """
+
+    def __init__(self, m, x, y, val, pred, dates, model_title, plot_kwargs, dpi):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.dates = dates
+        self.model_title = model_title
+        self.dt = dates[1] - dates[0]
+        self.fig = Figure(figsize=(6, 4), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.panels = []
+        for p, (data, title) in enumerate(zip([val, pred], self.titles(0))):
+            ax = self.fig.add_subplot(2, 1, p + 1)
+            mesh = m.pcolormesh(x, y, data[0], ax=ax, **plot_kwargs)
+            before = set(ax.get_children())
+            m.drawcoastlines(ax=ax)
+            m.drawparallels(np.arange(0., 91., 45.), ax=ax)
+            m.drawmeridians(np.arange(0., 361., 90.), ax=ax)
+            # Lines drawn over the data, including the axes frame
+            overlays = [a for a in ax.get_children() if a not in before] + list(ax.spines.values())
+            overlays = sorted(overlays, key=lambda a: a.get_zorder())
+            text = ax.set_title(title)
+            for artist in [mesh, text] + overlays:
+                artist.set_animated(True)
+            self.panels.append((ax, data, mesh, overlays, text))
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        # Pixel rows and columns of the tight bounding box, with the default padding and the image size of savefig
+        bbox = self.fig.get_tightbbox(self.canvas.get_renderer()).padded(0.1)
+        width, height = self.canvas.get_width_height()
+        bottom, left = int(round(height - bbox.y0 * dpi)), int(round(bbox.x0 * dpi))
+        self.crop = (slice(max(0, bottom - int(bbox.height * dpi)), min(height, bottom)),
+                     slice(max(0, left), min(width, left + int(bbox.width * dpi))))
+
+    def titles(self, d):
+        hours = (d + 1) * self.dt.total_seconds() / 60 / 60
+        return ['Verification (%s)' % self.dates[d],
+                '%s at $t=%d$ (%s)' % (self.model_title, hours, self.dates[d])]
+
+    def render(self, d):
+        """
+        :param d: int: index of the frame
+        :return: ndarray: RGBA image of shape (height, width, 4)
+        """
+        self.canvas.restore_region(self.background)
+        for (ax, data, mesh, overlays, text), title in zip(self.panels, self.titles(d)):
+            shape = mesh.get_array().shape
+            if len(shape) == 2:
+                mesh.set_array(data[d][:shape[0], :shape[1]])
+            else:
+                mesh.set_array(data[d].ravel() if data[d].size == shape[0] else data[d][:-1, :-1].ravel())
+            text.set_text(title)
+            for artist in [mesh] + overlays + [text]:
+                ax.draw_artist(artist)
+        return np.array(np.asarray(self.canvas.buffer_rgba())[self.crop])
+
+
+# Renderer and outputs of a plot_movie worker process
+_movie = {}
+
+
+def _init_movie_worker(renderer_args, out_directory, return_frames):
+    _movie['renderer'] = _MovieRenderer(*renderer_args)
+    _movie['out_directory'] = out_directory
+    _movie['return_frames'] = return_frames
+
+
+def _render_movie_frame(d):
+    frame = _movie['renderer'].render(d)
+    if _movie['out_directory'] is not None:
+        from matplotlib.image import imsave
+        imsave('%s/%05d.png' % (_movie['out_directory'], d), frame)
+    return frame if _movie['return_frames'] else None
+
+
+def _ffmpeg_command(out_file, width, height, fps):
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+               '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-']
+    if out_file.lower().endswith('.gif'):
+        command += ['-vf', 'split[a][b];[a]palettegen[p];[b][p]paletteuse']
+    else:
+        # H.264 in yuv420p, playable almost everywhere, needs even dimensions
+        command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-vcodec', 'libx264', '-pix_fmt', 'yuv420p']
+    return command + [out_file]
+
+
+def plot_movie(m, lat, lon, val, pred, dates, model_title='', plot_kwargs=None, out_directory=None, out_file=None,
+               fps=4, dpi=150, n_workers=1):
     """
-    Plot a series of images for a forecast and the verification.
+    Plot a series of images for a forecast and the verification. The map background is drawn once and only the data
+    and titles are redrawn for each frame. Frames can be rendered in parallel processes and are written as image files,
+    encoded into a movie by ffmpeg, or both.
 
     :param m: Basemap object
     :param lat: ndarray (lat, lon): latitude values
@@ -137,32 +485,65 @@ def plot_movie(m, lat, lon, val, pred, dates, model_title='', plot_kwargs=None,
     :param pred: ndarray (t, lat, lon): predicted forecast
     :param dates: array-like: datetime objects of verification datetimes
     :param model_title: str: name of the model, e.g., 'Neural net prediction'
-    :param plot_kwargs: dict: passed to the plot pcolormesh() method
+    :param plot_kwargs: dict: passed to the plot pcolormesh() method. Unless a norm or vmin and vmax are given, the
+        color scale spans the range of val and pred over all frames.
     :param out_directory: str: folder in which to save image files
+    :param out_file: str: movie file (.mp4 or .gif) to which the frames are piped through ffmpeg
+    :param fps: int or float: frames per second of the movie
+    :param dpi: int: resolution of the frames
+    :param n_workers: int: number of processes rendering frames; uses fork, so is only available on POSIX systems
     """
     if (len(dates) != val.shape[0]) and (len(dates) != pred.shape[0]):
         raise ValueError("'val' and 'pred' must have the same first (time) dimension as 'dates'")
-    plot_kwargs = plot_kwargs or {}
-    fig = plt.figure()
-    fig.set_size_inches(6, 4)
+    if out_directory is None and out_file is None:
+        raise ValueError("at least one of 'out_directory' or 'out_file' must be given")
+    if out_file is not None and shutil.which('ffmpeg') is None:
+        raise OSError("ffmpeg is required to write the movie file '%s'" % out_file)
+    plot_kwargs = dict(plot_kwargs or {})
+    if 'norm' not in plot_kwargs:
+        plot_kwargs.setdefault('vmin', min(np.nanmin(val), np.nanmin(pred)))
+        plot_kwargs.setdefault('vmax', max(np.nanmax(val), np.nanmax(pred)))
     x, y = m(lon, lat)
-    dt = dates[1] - dates[0]
-    for d, date in enumerate(dates):
-        hours = (d + 1) * dt.total_seconds() / 60 / 60
-        ax = plt.subplot(211)
-        m.pcolormesh(x, y, val[d], **plot_kwargs)
-        m.drawcoastlines()
-        m.drawparallels(np.arange(0., 91., 45.))
-        m.drawmeridians(np.arange(0., 361., 90.))
-        ax.set_title('Verification (%s)' % date)
-        ax = plt.subplot(212)
-        m.pcolormesh(x, y, pred[d], **plot_kwargs)
-        m.drawcoastlines()
-        m.drawparallels(np.arange(0., 91., 45.))
-        m.drawmeridians(np.arange(0., 361., 90.))
-        ax.set_title('%s at $t=%d$ (%s)' % (model_title, hours, date))
-        plt.savefig('%s/%05d.png' % (out_directory, d), bbox_inches='tight', dpi=150)
-        fig.clear()
+    init_args = ((m, x, y, val, pred, dates, model_title, plot_kwargs, dpi), out_directory, out_file is not None)
+
+    n_workers = min(n_workers, len(dates))
+    if n_workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Forked workers inherit the Basemap and the data without pickling them
+        pool = multiprocessing.get_context('fork').Pool(n_workers, initializer=_init_movie_worker,
+                                                        initargs=init_args)
+        frames = pool.imap(_render_movie_frame, range(len(dates)), chunksize=max(1, len(dates) // (4 * n_workers)))
+    else:
+        pool = None
+        _init_movie_worker(*init_args)
+        frames = map(_render_movie_frame, range(len(dates)))
+
+    encoder = None
+    completed = False
+    try:
+        for frame in frames:
+            if out_file is None:
+                continue
+            if encoder is None:
+                height, width = frame.shape[:2]
+                encoder = subprocess.Popen(_ffmpeg_command(out_file, width, height, fps), stdin=subprocess.PIPE)
+            encoder.stdin.write(frame.tobytes())
+        completed = True
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        _movie.clear()
+        if encoder is not None:
+            try:
+                encoder.stdin.close()
+            except BrokenPipeError:
+                # ffmpeg exited early; reported by its return code
+                pass
+            if encoder.wait() != 0:
+                # Do not replace an exception raised while rendering or writing the frames
+                if completed:
+                    raise OSError("ffmpeg failed to write '%s'" % out_file)
+                warnings.warn("ffmpeg failed to write '%s'" % out_file)
 
 
 def history_plot(train_hist, val_hist, model_name='', out_directory=None):
@@ -8,4 +8,8 @@
 Re-mapping tools for processing data on different coordinate projections.
 """
 
+from .cache import MapCache
 from .cubesphere import CubeSphereRemap
+from .gnomonic import cube_sphere_centers, cube_sphere_corners, cube_sphere_cell_areas, cube_sphere_weights, \
+    cube_sphere_locate
+from .gnomonic_remap import GnomonicRemap, gnomonic_weights
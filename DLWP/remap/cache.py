@@ -0,0 +1,322 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Content-addressed cache of offline remapping maps.
+
+Maps are stored in a cache directory under the SHA-1 hash of the parameters that define them (e.g. grid sizes,
+resolution, order of the transformation, and a hash of the source-grid coordinates), so that identical maps are
+generated once and reused by every script and job. Maps are generated in a temporary directory inside the cache and
+moved into place with an atomic rename, under an exclusive per-map file lock, so that concurrent jobs never see
+partial files and only one of them generates a given map. Jobs using the maps of an entry hold a shared lock on it,
+and entries are only evicted, by the time since their last use or by the total size of the cache, under the
+exclusive lock, so that maps in use are never removed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; concurrent jobs may then generate the same map twice
+    fcntl = None
+
+
+def coordinate_hash(values):
+    """
+    SHA-1 hash of the values of a coordinate array, for use in cache keys.
+
+    :param values: array-like: coordinate values
+    :return: str: hexadecimal hash
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    return hashlib.sha1(values.tobytes() + str(values.shape).encode()).hexdigest()
+
+
+def _open_lock(path, blocking=True, shared=False):
+    """
+    Open and lock a lock file, exclusively or shared. Returns the open file, which holds the lock until it is closed,
+    or None if blocking is False and another process holds a conflicting lock.
+    """
+    while True:
+        f = open(path, 'a')
+        if fcntl is None:
+            return f
+        try:
+            fcntl.flock(f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            f.close()
+            return None
+        # Lock files are removed with their entry, under the exclusive lock. If that happened between opening and
+        # locking the file, the lock is on a file no other process can open, so lock the new file instead.
+        try:
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+@contextmanager
+def _file_lock(path, blocking=True, shared=False):
+    """
+    Lock on a lock file. Yields True if the lock was acquired, or False if blocking is False and another process holds
+    a conflicting lock.
+    """
+    f = _open_lock(path, blocking=blocking, shared=shared)
+    if f is None:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        f.close()
+
+
+class MapLease(object):
+    """
+    The maps of a cache entry, protected from eviction by a shared lock until release() is called, the lease is used
+    as a context manager, or the lease is garbage-collected.
+    """
+
+    def __init__(self, key, forward, inverse, lock_file):
+        self.key = key
+        self.forward = forward
+        self.inverse = inverse
+        self._lock_file = lock_file
+
+    def release(self):
+        """
+        Release the shared lock; the maps may then be evicted by any process.
+        """
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class MapCache(object):
+    """
+    Content-addressed, process-safe cache of pairs of forward and inverse offline maps.
+    """
+
+    def __init__(self, directory=None, max_age=None, max_size=None, verbose=True):
+        """
+        :param directory: str: cache directory. Defaults to the DLWP_MAP_CACHE environment variable, or to
+            ~/.cache/dlwp/maps.
+        :param max_age: float: if given, entries not used for this many seconds are evicted whenever a map is added
+        :param max_size: int: if given, the least-recently used entries are evicted whenever a map is added, until the
+            cache is at most this many bytes
+        :param verbose: bool: print cache hits, misses and evictions
+        """
+        if directory is None:
+            directory = os.environ.get('DLWP_MAP_CACHE',
+                                       os.path.join(os.path.expanduser('~'), '.cache', 'dlwp', 'maps'))
+        self.directory = os.path.abspath(directory)
+        self.max_age = max_age
+        self.max_size = max_size
+        self.verbose = verbose
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(**params):
+        """
+        Cache key of a map: the SHA-1 hash of its parameters in canonical JSON form.
+
+        :param params: JSON-serializable parameters that define the map
+        :return: str: hexadecimal key
+        """
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def paths(self, key):
+        """
+        :param key: str: cache key
+        :return: (str, str): paths of the forward and inverse maps of an entry
+        """
+        return (os.path.join(self.directory, '%s_forward.nc' % key),
+                os.path.join(self.directory, '%s_inverse.nc' % key))
+
+    def _metadata_path(self, key):
+        return os.path.join(self.directory, '%s.json' % key)
+
+    def _lock_path(self, key):
+        return os.path.join(self.directory, '%s.lock' % key)
+
+    def __contains__(self, key):
+        return all(os.path.exists(p) for p in self.paths(key) + (self._metadata_path(key),))
+
+    def acquire(self, key, generate, params=None):
+        """
+        Return a lease on the maps of an entry, generating them first if they are not in the cache. The maps are not
+        evicted by any process until the lease is released.
+
+        :param key: str: cache key, as from MapCache.key()
+        :param generate: callable: generate(forward_path, inverse_path, work_dir) writes both maps; work_dir is a
+            temporary directory inside the cache, removed afterwards, for intermediate files such as meshes
+        :param params: dict: parameters of the map, stored with the entry for reference
+        :return: MapLease: lease with the paths of the forward and inverse maps
+        """
+        forward, inverse = self.paths(key)
+        while True:
+            lock_file = _open_lock(self._lock_path(key), shared=True)
+            if key in self:
+                if self.verbose:
+                    print('MapCache: using cached maps %s' % key)
+                # Record the use, for eviction of the least-recently used entries
+                os.utime(self._metadata_path(key))
+                lease = MapLease(key, forward, inverse, lock_file)
+                if self.max_age is not None or self.max_size is not None:
+                    self.evict(exclude=[key])
+                return lease
+            lock_file.close()
+            with _file_lock(self._lock_path(key)):
+                if key not in self:
+                    self._generate(key, generate, params)
+            # Take the shared lock on the complete entry; if another process evicted it in the meantime, it is
+            # generated again
+
+    def _generate(self, key, generate, params):
+        forward, inverse = self.paths(key)
+        if self.verbose:
+            print('MapCache: generating maps %s' % key)
+        work_dir = tempfile.mkdtemp(prefix='.%s_' % key, dir=self.directory)
+        try:
+            work_forward = os.path.join(work_dir, os.path.basename(forward))
+            work_inverse = os.path.join(work_dir, os.path.basename(inverse))
+            generate(work_forward, work_inverse, work_dir)
+            os.replace(work_forward, forward)
+            os.replace(work_inverse, inverse)
+            work_metadata = os.path.join(work_dir, 'metadata.json')
+            with open(work_metadata, 'w') as f:
+                json.dump({'key': key, 'params': params, 'created': time.time()}, f)
+            # The metadata marks the entry as complete, so it is moved last
+            os.replace(work_metadata, self._metadata_path(key))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def get(self, key, generate, params=None):
+        """
+        Return the paths of the maps of an entry, generating them first if they are not in the cache. The maps are
+        not protected from eviction by other processes once this returns; use acquire() to use them safely while
+        other jobs may evict entries.
+
+        :param key: str: cache key, as from MapCache.key()
+        :param generate: callable: generate(forward_path, inverse_path, work_dir) writes both maps; work_dir is a
+            temporary directory inside the cache, removed afterwards, for intermediate files such as meshes
+        :param params: dict: parameters of the map, stored with the entry for reference
+        :return: (str, str): paths of the forward and inverse maps
+        """
+        with self.acquire(key, generate, params=params) as lease:
+            return lease.forward, lease.inverse
+
+    def entries(self):
+        """
+        :return: list of dict: the complete entries of the cache, with their key, parameters, size in bytes, and time
+            of last use, sorted from the least recently used
+        """
+        result = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            try:
+                with open(self._metadata_path(key)) as f:
+                    metadata = json.load(f)
+                last_used = os.path.getmtime(self._metadata_path(key))
+                size = sum(os.path.getsize(p) for p in self.paths(key) + (self._metadata_path(key),))
+                if os.path.exists(self._lock_path(key)):
+                    size += os.path.getsize(self._lock_path(key))
+            except (OSError, ValueError):
+                # Being evicted or written by another process
+                continue
+            result.append({'key': key, 'params': metadata.get('params'), 'size': size, 'last_used': last_used})
+        return sorted(result, key=lambda e: e['last_used'])
+
+    def _remove(self, key):
+        # Entries in use hold a shared lock, so the exclusive lock is only acquired for entries not in use
+        with _file_lock(self._lock_path(key), blocking=False) as locked:
+            if not locked:
+                return False
+            # The metadata is removed first, so the entry is no longer considered complete, and the lock file last.
+            # Without file locks, lock files are kept, since they may be open in other processes.
+            lock_paths = (self._lock_path(key),) if fcntl is not None else ()
+            for path in (self._metadata_path(key),) + self.paths(key) + lock_paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        if self.verbose:
+            print('MapCache: evicted maps %s' % key)
+        return True
+
+    def _remove_orphaned_locks(self):
+        # Lock files of entries which are not complete, left by removed entries or failed generation
+        if fcntl is None:
+            return
+        for name in os.listdir(self.directory):
+            if not name.endswith('.lock'):
+                continue
+            key = name[:-len('.lock')]
+            if key in self:
+                continue
+            with _file_lock(self._lock_path(key), blocking=False) as locked:
+                if locked and key not in self:
+                    os.remove(self._lock_path(key))
+
+    def evict(self, max_age=None, max_size=None, exclude=()):
+        """
+        Remove entries not used for more than max_age seconds, then the least-recently used entries until the cache
+        is at most max_size bytes, and the lock files of incomplete entries. Entries in use, i.e., held by a
+        MapLease in any process, or being generated, are skipped.
+
+        :param max_age: float: maximum time in seconds since the last use; defaults to the max_age of the cache
+        :param max_size: int: maximum total size in bytes; defaults to the max_size of the cache
+        :param exclude: iterable of str: keys never to evict
+        :return: list of str: keys of the evicted entries
+        """
+        max_age = self.max_age if max_age is None else max_age
+        max_size = self.max_size if max_size is None else max_size
+        all_entries = self.entries()
+        entries = [e for e in all_entries if e['key'] not in exclude]
+        total = sum(e['size'] for e in all_entries)
+        evicted = []
+        now = time.time()
+        for entry in entries:
+            too_old = max_age is not None and now - entry['last_used'] > max_age
+            too_big = max_size is not None and total > max_size
+            if not (too_old or too_big):
+                continue
+            if self._remove(entry['key']):
+                evicted.append(entry['key'])
+                total -= entry['size']
+        self._remove_orphaned_locks()
+        if max_size is not None and total > max_size:
+            warnings.warn('MapCache: cache size %d bytes exceeds max_size %d bytes after eviction' % (total, max_size))
+        return evicted
+
+    def clear(self):
+        """
+        Remove all the entries of the cache that are not in use, and the lock files of incomplete entries.
+
+        :return: list of str: keys of the removed entries
+        """
+        removed = [e['key'] for e in self.entries() if self._remove(e['key'])]
+        self._remove_orphaned_locks()
+        return removed
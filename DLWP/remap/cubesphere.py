@@ -12,9 +12,11 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 import os
+import shutil
 import subprocess
 import warnings
 from .base import _BaseRemap
+from .cache import MapCache, coordinate_hash
 
 
 def to_chunked_dataset(ds, chunking):
@@ -40,13 +42,16 @@ class CubeSphereRemap(_BaseRemap):
     Implement tools for remapping to and from a cubed sphere using TempestRemap executables.
     """
 
-    def __init__(self, path_to_remapper=None, to_netcdf4=True, verbose=True):
+    def __init__(self, path_to_remapper=None, to_netcdf4=True, verbose=True, cache=None):
         """
         Initialize a CubeSphereRemap object.
 
         :param path_to_remapper: str: path to the TempestRemap executables
         :param to_netcdf4: bool: if True, also use 'ncks' command to convert remapped files to netCDF4
         :param verbose: bool: print commands and progress
+        :param cache: str or DLWP.remap.MapCache: if given, a MapCache or the directory of one. Offline maps are then
+            generated once into the cache, keyed by their parameters and source grid, and reused by later calls. Maps
+            used in place in the cache are protected from eviction until new maps are assigned or close() is called.
         """
         super(CubeSphereRemap, self).__init__(path_to_remapper=path_to_remapper)
         self.remapper = os.path.join(self.path_to_remapper, 'ApplyOfflineMap')
@@ -54,6 +59,10 @@ class CubeSphereRemap(_BaseRemap):
         self.inverse_map = None
         self.to_netcdf4 = to_netcdf4
         self.verbose = verbose
+        if cache is not None and not isinstance(cache, MapCache):
+            cache = MapCache(cache, verbose=verbose)
+        self.cache = cache
+        self._cache_lease = None
         self._lat = None
         self._lon = None
         self._res = None
@@ -67,6 +76,8 @@ class CubeSphereRemap(_BaseRemap):
         :param map_name: str: path to forward remapping map
         :param inverse_map_name: str: path to inverse remapping map
         """
+        if map_name is not None and inverse_map_name is not None:
+            self.close()
         if map_name is not None:
             self.map = map_name
             self._map_exists = True
@@ -74,18 +85,29 @@ class CubeSphereRemap(_BaseRemap):
             self.inverse_map = inverse_map_name
             self._inverse_map_exists = True
 
+    def close(self):
+        """
+        Release the maps used in place in the cache, if any, so that they may be evicted.
+        """
+        if self._cache_lease is not None:
+            self._cache_lease.release()
+            self._cache_lease = None
+
     def generate_offline_maps(self, lat, lon, res, map_name=None, inverse_map_name=None, inverse_lat=False,
                               remove_meshes=True, in_np=1):
         """
-        Generate offline maps for cubed sphere remapping.
+        Generate offline maps for cubed sphere remapping. If the object has a cache, existing maps with the same
+        parameters are reused instead.
 
         :param lat: int: number of points in the latitude dimension
         :param lon: int: number of points in the longitude dimension
         :param res: int: number of points on a side of each cube face
-        :param map_name: str: file name of the forward map
+        :param map_name: str: file name of the forward map. With a cache, the cached map is copied to this file if
+            given, and used in place otherwise.
         :param inverse_map_name: str: file name of the inverse map
         :param inverse_lat: if True, then the latitudes in the data file are monotonically decreasing
-        :param remove_meshes: if True, remove the temporary meshes generated while making the offline maps
+        :param remove_meshes: if True, remove the temporary meshes generated while making the offline maps. Meshes
+            are always removed when using a cache.
         :param in_np: int: order of transformation. Should be int in range 1 to 4.
         :return:
         """
@@ -96,116 +118,28 @@ class CubeSphereRemap(_BaseRemap):
         self._lat = lat
         self._lon = lon
         self._res = res
-        if map_name is None:
-            self.map = 'map_LL%dx%d_CS%d.nc' % (self._lat, self._lon, self._res)
-        else:
-            self.map = map_name
-        if inverse_map_name is None:
-            self.inverse_map = 'map_CS%d_LL%dx%d.nc' % (self._res, self._lat, self._lon)
-        else:
-            self.inverse_map = None
 
-        if self.verbose:
-            print('CubeSphereRemap: generating offline forward map...')
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateRLLMesh'),
-                   '--lat', str(self._lat), '--lon', str(self._lon), '--file', 'outLL.g']
-            if inverse_lat:
-                cmd = cmd + ['--lat_begin', '90', '--lat_end', '-90']
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the lat-lon mesh.')
-            print(e.output)
-            raise
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateCSMesh'),
-                   '--res', str(self._res), '--file', 'outCS.g']
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the cube sphere mesh.')
-            print(e.output)
-            raise
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateOverlapMesh'),
-                   '--a', 'outLL.g', '--b', 'outCS.g', '--out', 'ov_LL_CS.g']
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the overlap mesh.')
-            print(e.output)
-            raise
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateOfflineMap'),
-                   '--in_mesh', 'outLL.g', '--out_mesh', 'outCS.g', '--ov_mesh', 'ov_LL_CS.g',
-                   '--in_np', str(in_np), '--in_type', 'FV', '--out_type', 'FV', '--out_map', self.map]
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the offline map.')
-            print(e.output)
-            raise
-        self._map_exists = True
-
-        print('CubeSphereRemap: generating offline inverse map...')
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateOverlapMesh'),
-                   '--a', 'outCS.g', '--b', 'outLL.g', '--out', 'ov_CS_LL.g']
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the overlap mesh.')
-            print(e.output)
-            raise
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateOfflineMap'),
-                   '--in_mesh', 'outCS.g', '--out_mesh', 'outLL.g', '--ov_mesh', 'ov_CS_LL.g',
-                   '--in_np', str(in_np), '--in_type', 'FV', '--out_type', 'FV', '--out_map', self.inverse_map]
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the offline map.')
-            print(e.output)
-            raise
-
-        if remove_meshes:
-            for f in ['outLL.g', 'outCS.g', 'ov_LL_CS.g', 'ov_CS_LL.g']:
-                os.remove(f)
-
-        self._inverse_map_exists = True
-        if self.verbose:
-            print('CubeSphereRemap: successfully generated offline maps (%s, %s)' % (self.map, self.inverse_map))
+        rll_args = ['--lat', str(self._lat), '--lon', str(self._lon)]
+        if inverse_lat:
+            rll_args = rll_args + ['--lat_begin', '90', '--lat_end', '-90']
+        params = {'lat': int(lat), 'lon': int(lon), 'res': int(res), 'in_np': int(in_np),
+                  'inverse_lat': bool(inverse_lat), 'netcdf4': bool(self.to_netcdf4)}
+        self._generate_or_reuse(rll_args, params, map_name, inverse_map_name, remove_meshes, in_np)
 
     def generate_offline_maps_from_file(self, in_file, res, map_name=None, inverse_map_name=None,
                                         remove_meshes=True, in_np=1):
         """
         Generate offline maps for cubed sphere remapping, using a netCDF file name to generate the lat-lon grid.
-        Requires most recent version of TempestRemap.
+        Requires most recent version of TempestRemap. If the object has a cache, existing maps with the same
+        parameters and the same latitude and longitude values are reused instead.
 
         :param in_file: str: name of input netCDF file for latitude/longitude coordinates
         :param res: int: number of points on a side of each cube face
-        :param map_name: str: file name of the forward map
+        :param map_name: str: file name of the forward map. With a cache, the cached map is copied to this file if
+            given, and used in place otherwise.
         :param inverse_map_name: str: file name of the inverse map
-        :param remove_meshes: if True, remove the temporary meshes generated while making the offline maps
+        :param remove_meshes: if True, remove the temporary meshes generated while making the offline maps. Meshes
+            are always removed when using a cache.
         :param in_np: int: order of transformation. Should be int in range 1 to 4.
         :return:
         """
@@ -225,105 +159,91 @@ class CubeSphereRemap(_BaseRemap):
                              list(ds.dims.keys()))
         self._lat = ds.dims[file_lat]
         self._lon = ds.dims[file_lon]
+        params = {'lat_values': coordinate_hash(ds[file_lat].values),
+                  'lon_values': coordinate_hash(ds[file_lon].values),
+                  'res': int(res), 'in_np': int(in_np), 'netcdf4': bool(self.to_netcdf4)}
         ds.close()
 
-        if map_name is None:
-            self.map = 'map_LL%dx%d_CS%d.nc' % (self._lat, self._lon, self._res)
-        else:
+        rll_args = ['--in_file', in_file, '--in_file_lat', file_lat, '--in_file_lon', file_lon]
+        self._generate_or_reuse(rll_args, params, map_name, inverse_map_name, remove_meshes, in_np)
+
+    def _generate_or_reuse(self, rll_args, params, map_name, inverse_map_name, remove_meshes, in_np):
+        """
+        Generate the forward and inverse maps, or take them from the cache.
+        """
+        self.close()
+        if self.cache is None:
+            if map_name is None:
+                map_name = 'map_LL%dx%d_CS%d.nc' % (self._lat, self._lon, self._res)
+            if inverse_map_name is None:
+                inverse_map_name = 'map_CS%d_LL%dx%d.nc' % (self._res, self._lat, self._lon)
+            self._generate_maps(rll_args, map_name, inverse_map_name, in_np, remove_meshes=remove_meshes)
             self.map = map_name
-        if inverse_map_name is None:
-            self.inverse_map = 'map_CS%d_LL%dx%d.nc' % (self._res, self._lat, self._lon)
+            self.inverse_map = inverse_map_name
         else:
-            self.inverse_map = None
+            def generate(forward, inverse, work_dir):
+                self._generate_maps(rll_args, forward, inverse, in_np, work_dir=work_dir)
+
+            lease = self.cache.acquire(MapCache.key(**params), generate, params=params)
+            for cached, name in [(lease.forward, map_name), (lease.inverse, inverse_map_name)]:
+                if name is not None:
+                    shutil.copyfile(cached, name)
+            self.map = lease.forward if map_name is None else map_name
+            self.inverse_map = lease.inverse if inverse_map_name is None else inverse_map_name
+            # Keep the lease while either map is used in place
+            if map_name is None or inverse_map_name is None:
+                self._cache_lease = lease
+            else:
+                lease.release()
+        self._map_exists = True
+        self._inverse_map_exists = True
+        if self.verbose:
+            print('CubeSphereRemap: successfully generated offline maps (%s, %s)' % (self.map, self.inverse_map))
 
+    def _run_tool(self, cmd, description):
+        if self.to_netcdf4:
+            cmd = cmd + ['--out_format', 'Netcdf4']
         if self.verbose:
-            print('CubeSphereRemap: generating offline forward map...')
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateRLLMesh'),
-                   '--in_file', in_file, '--in_file_lat', file_lat, '--in_file_lon', file_lon, '--file', 'outLL.g']
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the lat-lon mesh.')
-            print(e.output)
-            raise
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateCSMesh'),
-                   '--res', str(self._res), '--file', 'outCS.g']
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the cube sphere mesh.')
-            print(e.output)
-            raise
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateOverlapMesh'),
-                   '--a', 'outLL.g', '--b', 'outCS.g', '--out', 'ov_LL_CS.g']
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the overlap mesh.')
-            print(e.output)
-            raise
+            print(' '.join(cmd))
         try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateOfflineMap'),
-                   '--in_mesh', 'outLL.g', '--out_mesh', 'outCS.g', '--ov_mesh', 'ov_LL_CS.g',
-                   '--in_np', str(in_np), '--in_type', 'FV', '--out_type', 'FV', '--out_map', self.map]
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
             subprocess.check_output(cmd)
         except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the offline map.')
+            print('An error occurred while generating the %s.' % description)
             print(e.output)
             raise
-        self._map_exists = True
 
-        print('CubeSphereRemap: generating offline inverse map...')
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateOverlapMesh'),
-                   '--a', 'outCS.g', '--b', 'outLL.g', '--out', 'ov_CS_LL.g']
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the overlap mesh.')
-            print(e.output)
-            raise
-        try:
-            cmd = [os.path.join(self.path_to_remapper, 'GenerateOfflineMap'),
-                   '--in_mesh', 'outCS.g', '--out_mesh', 'outLL.g', '--ov_mesh', 'ov_CS_LL.g',
-                   '--in_np', str(in_np), '--in_type', 'FV', '--out_type', 'FV', '--out_map', self.inverse_map]
-            if self.to_netcdf4:
-                cmd = cmd + ['--out_format', 'Netcdf4']
-            if self.verbose:
-                print(' '.join(cmd))
-            subprocess.check_output(cmd)
-        except subprocess.CalledProcessError as e:
-            print('An error occurred while generating the offline map.')
-            print(e.output)
-            raise
+    def _generate_maps(self, rll_args, map_name, inverse_map_name, in_np, remove_meshes=True, work_dir='.'):
+        """
+        Run the TempestRemap executables to generate the meshes, in work_dir, and the forward and inverse maps.
+        """
+        ll_mesh, cs_mesh, ov_ll_cs, ov_cs_ll = [os.path.join(work_dir, f) for f in
+                                                ['outLL.g', 'outCS.g', 'ov_LL_CS.g', 'ov_CS_LL.g']]
+        if self.verbose:
+            print('CubeSphereRemap: generating offline forward map...')
+        self._run_tool([os.path.join(self.path_to_remapper, 'GenerateRLLMesh')] + rll_args + ['--file', ll_mesh],
+                       'lat-lon mesh')
+        self._run_tool([os.path.join(self.path_to_remapper, 'GenerateCSMesh'),
+                        '--res', str(self._res), '--file', cs_mesh], 'cube sphere mesh')
+        self._run_tool([os.path.join(self.path_to_remapper, 'GenerateOverlapMesh'),
+                        '--a', ll_mesh, '--b', cs_mesh, '--out', ov_ll_cs], 'overlap mesh')
+        self._run_tool([os.path.join(self.path_to_remapper, 'GenerateOfflineMap'),
+                        '--in_mesh', ll_mesh, '--out_mesh', cs_mesh, '--ov_mesh', ov_ll_cs,
+                        '--in_np', str(in_np), '--in_type', 'FV', '--out_type', 'FV', '--out_map', map_name],
+                       'offline map')
+
+        if self.verbose:
+            print('CubeSphereRemap: generating offline inverse map...')
+        self._run_tool([os.path.join(self.path_to_remapper, 'GenerateOverlapMesh'),
+                        '--a', cs_mesh, '--b', ll_mesh, '--out', ov_cs_ll], 'overlap mesh')
+        self._run_tool([os.path.join(self.path_to_remapper, 'GenerateOfflineMap'),
+                        '--in_mesh', cs_mesh, '--out_mesh', ll_mesh, '--ov_mesh', ov_cs_ll,
+                        '--in_np', str(in_np), '--in_type', 'FV', '--out_type', 'FV', '--out_map', inverse_map_name],
+                       'offline map')
 
         if remove_meshes:
-            for f in ['outLL.g', 'outCS.g', 'ov_LL_CS.g', 'ov_CS_LL.g']:
+            for f in [ll_mesh, cs_mesh, ov_ll_cs, ov_cs_ll]:
                 os.remove(f)
 
-        self._inverse_map_exists = True
-        if self.verbose:
-            print('CubeSphereRemap: successfully generated offline maps (%s, %s)' % (self.map, self.inverse_map))
-
     def remap(self, input_file, output_file, *args):
         """
         Apply the forward remapping to data in an input_file, saved to output_file.
@@ -0,0 +1,177 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Geometry of the equiangular gnomonic cubed sphere used by DLWP-CS.
+
+Data on the cubed sphere have dimensions (face, height, width). Faces 0-3 are the equatorial faces centred on longitudes
+0, 90, 180 and 270, with height increasing northward and width increasing eastward; face 4 is the south pole and face 5
+the north pole. The orientation of the polar faces is the one assumed by the cube sphere padding in DLWP.custom: the
+first row of the north pole face borders face 0 and its first column borders face 3, while the last row of the south
+pole face borders face 0 and its first column borders face 3.
+
+Results are cached per resolution and returned as read-only arrays.
+"""
+
+import numpy as np
+import xarray as xr
+from functools import lru_cache
+
+
+def _face_vectors(face, xi, eta):
+    """
+    Unnormalized Cartesian vectors of points with gnomonic coordinates (xi, eta) = (tan(alpha), tan(beta)) on a face.
+    """
+    if face < 4:
+        lon = np.deg2rad(90. * face)
+        return np.cos(lon) - xi * np.sin(lon), np.sin(lon) + xi * np.cos(lon), eta
+    elif face == 4:
+        return eta, xi, -np.ones_like(xi)
+    elif face == 5:
+        return -eta, xi, np.ones_like(xi)
+    raise ValueError("'face' must be in the range 0-5")
+
+
+def _to_latlon(x, y, z):
+    lat = np.rad2deg(np.arctan2(z, np.sqrt(x ** 2. + y ** 2.)))
+    lon = np.rad2deg(np.arctan2(y, x)) % 360.
+    return lat, lon
+
+
+def _gnomonic_points(n, centers):
+    # Equiangular coordinates of the cell edges or centres along one side of a face
+    edges = np.linspace(-np.pi / 4., np.pi / 4., n + 1)
+    angles = 0.5 * (edges[1:] + edges[:-1]) if centers else edges
+    eta, xi = np.meshgrid(np.tan(angles), np.tan(angles), indexing='ij')
+    lat, lon = zip(*[_to_latlon(*_face_vectors(f, xi, eta)) for f in range(6)])
+    lat, lon = np.stack(lat), np.stack(lon)
+    lat.flags.writeable = False
+    lon.flags.writeable = False
+    return lat, lon
+
+
+def _angles_to_latlon(face, alpha, beta):
+    """
+    Latitude and longitude of points with equiangular coordinates (alpha, beta) on the faces in the array face.
+    """
+    face, alpha, beta = np.broadcast_arrays(face, alpha, beta)
+    x, y, z = np.empty(face.shape), np.empty(face.shape), np.empty(face.shape)
+    for f in range(6):
+        on_face = face == f
+        x[on_face], y[on_face], z[on_face] = _face_vectors(f, np.tan(alpha[on_face]), np.tan(beta[on_face]))
+    return _to_latlon(x, y, z)
+
+
+def cube_sphere_locate(n, lat, lon):
+    """
+    Locate points on a cubed sphere: the inverse of cube_sphere_centers, for arbitrary points. The fractional indices
+    are in units of cells, with integers at the cell centres, so that cell (f, i, j) covers the indices i - 0.5 to
+    i + 0.5 and j - 0.5 to j + 0.5 of face f.
+
+    :param n: int: number of cells along each side of a face
+    :param lat: array-like: latitudes in degrees
+    :param lon: array-like: longitudes in degrees, of the same shape as lat
+    :return: (ndarray, ndarray, ndarray): face, fractional height index, and fractional width index of the points
+    """
+    lat, lon = np.deg2rad(np.asarray(lat, dtype=np.float64)), np.deg2rad(np.asarray(lon, dtype=np.float64))
+    x, y, z = np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)
+    # Each point is on the face whose centre direction has the largest projection on it
+    face = np.argmax(np.stack([x, y, -x, -y, -z, z]), axis=0)
+    face_lon = np.deg2rad(90. * np.minimum(face, 3))
+    normal = np.where(face < 4, x * np.cos(face_lon) + y * np.sin(face_lon), np.abs(z))
+    tangent = -x * np.sin(face_lon) + y * np.cos(face_lon)
+    xi = np.where(face < 4, tangent, y) / normal
+    eta = np.select([face < 4, face == 4], [z, x], -x) / normal
+    height = (np.arctan(eta) + np.pi / 4.) * 2. * n / np.pi - 0.5
+    width = (np.arctan(xi) + np.pi / 4.) * 2. * n / np.pi - 0.5
+    return face, height, width
+
+
+@lru_cache(maxsize=16)
+def cube_sphere_centers(n):
+    """
+    Latitude and longitude of the cell centres of a cubed sphere.
+
+    :param n: int: number of cells along each side of a face
+    :return: (ndarray, ndarray): latitude and longitude in degrees, each of shape (6, n, n)
+    """
+    n = int(n)
+    if n < 1:
+        raise ValueError("'n' must be a positive integer")
+    return _gnomonic_points(n, True)
+
+
+@lru_cache(maxsize=16)
+def cube_sphere_corners(n):
+    """
+    Latitude and longitude of the cell corners of a cubed sphere. The corners of cell (f, i, j) are the points
+    (f, i, j), (f, i, j + 1), (f, i + 1, j + 1), and (f, i + 1, j).
+
+    :param n: int: number of cells along each side of a face
+    :return: (ndarray, ndarray): latitude and longitude in degrees, each of shape (6, n + 1, n + 1)
+    """
+    n = int(n)
+    if n < 1:
+        raise ValueError("'n' must be a positive integer")
+    return _gnomonic_points(n, False)
+
+
+@lru_cache(maxsize=16)
+def cube_sphere_cell_areas(n):
+    """
+    Exact areas of the cells of a cubed sphere on the unit sphere. The cells of the equiangular gnomonic projection
+    have the same areas on every face, and sum to 4 pi.
+
+    :param n: int: number of cells along each side of a face
+    :return: ndarray: cell areas in steradians, of shape (6, n, n)
+    """
+    n = int(n)
+    if n < 1:
+        raise ValueError("'n' must be a positive integer")
+    t = np.tan(np.linspace(-np.pi / 4., np.pi / 4., n + 1))
+    y, x = np.meshgrid(t, t, indexing='ij')
+    # Spherical area between the face centre and the point (x, y) of the gnomonic plane
+    a = np.arctan(x * y / np.sqrt(1. + x ** 2. + y ** 2.))
+    area = a[1:, 1:] - a[1:, :-1] - a[:-1, 1:] + a[:-1, :-1]
+    area = np.ascontiguousarray(np.broadcast_to(area, (6, n, n)))
+    area.flags.writeable = False
+    return area
+
+
+@lru_cache(maxsize=16)
+def cube_sphere_weights(n, dims=('face', 'height', 'width')):
+    """
+    Area weights of the cells of a cubed sphere, normalized to a mean of 1 like the cosine-latitude weights used in
+    DLWP.verify.
+
+    :param n: int: number of cells along each side of a face
+    :param dims: tuple: names of the face, height, and width dimensions
+    :return: xarray.DataArray: weights with dimensions dims
+    """
+    area = cube_sphere_cell_areas(n)
+    weights = area / area.mean()
+    weights.flags.writeable = False
+    return xr.DataArray(weights, dims=list(dims), name='weights')
+
+
+def cube_sphere_areas_from_map(map_file, grid='b'):
+    """
+    Read the cell areas of a cubed sphere from a TempestRemap offline map file, such as those generated by
+    CubeSphereRemap.
+
+    :param map_file: str: path to the map file
+    :param grid: str: 'a' for the source grid of the map or 'b' for the target grid; use 'b' for a forward (lat-lon to
+        cubed sphere) map and 'a' for an inverse map
+    :return: ndarray: cell areas in steradians, of shape (6, n, n)
+    """
+    if grid not in ['a', 'b']:
+        raise ValueError("'grid' must be 'a' or 'b'")
+    with xr.open_dataset(map_file) as ds:
+        area = ds['area_%s' % grid].values
+    n = int(round(np.sqrt(area.size / 6)))
+    if 6 * n * n != area.size:
+        raise ValueError("grid '%s' of the map file is not a cubed sphere; it has %d cells" % (grid, area.size))
+    return area.reshape((6, n, n))
@@ -0,0 +1,391 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Remapping between regular latitude-longitude grids and the gnomonic cubed sphere in NumPy, without TempestRemap.
+
+The weights are sparse matrices acting on flattened fields: lat-lon fields are flattened in (lat, lon) order, in the
+order of the given coordinates, and cubed-sphere fields in (face, height, width) order, the order of the 'ncol'
+dimension of TempestRemap cubed-sphere meshes. The cubed sphere is the one in DLWP.remap.gnomonic, so remapped data
+have the face orientation expected by the cube sphere padding in DLWP.custom. Two methods are available:
+
+    - 'bilinear': bilinear interpolation from the four nearest cell centres. Across the edges of a cube face, the
+      missing centres are replaced by linear interpolation along the edge of the neighbouring face.
+    - 'conservative': first-order conservative remapping, from the areas of overlap between the cells of the two
+      grids. The overlaps are integrated by splitting each cube cell into equiangular sub-cells of exact area.
+
+The longitudes of the lat-lon grid must span the globe.
+"""
+
+import numpy as np
+import xarray as xr
+from .base import _BaseRemap
+from .cache import MapCache, coordinate_hash
+from .gnomonic import _angles_to_latlon, cube_sphere_cell_areas, cube_sphere_centers, cube_sphere_locate
+
+
+def _bracket(points, targets, periodic):
+    """
+    Indices of the grid points to either side of the targets and the linear weight of the second one. Points need not
+    be sorted; indices refer to their original order. Non-periodic targets outside the points are clamped.
+    """
+    order = np.argsort(points)
+    sorted_points = points[order]
+    size = len(points)
+    if periodic:
+        sorted_points = sorted_points % 360.
+        targets = targets % 360.
+        k = np.searchsorted(sorted_points, targets, side='right') - 1
+        left = sorted_points[k % size] - 360. * (k == -1)
+        right = sorted_points[(k + 1) % size] + 360. * (k == size - 1)
+        k0, k1 = k % size, (k + 1) % size
+    else:
+        k0 = np.clip(np.searchsorted(sorted_points, targets, side='right') - 1, 0, max(size - 2, 0))
+        k1 = np.minimum(k0 + 1, size - 1)
+        left, right = sorted_points[k0], sorted_points[k1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(right > left, (targets - left) / (right - left), 0.)
+    return order[k0], order[k1], np.clip(weight, 0., 1.)
+
+
+def _face_bilinear(n, face, height, width):
+    """
+    Flat indices and weights of the four cell centres around points on their own faces, clamped at the face edges.
+    """
+    height, width = np.clip(height, 0., n - 1.), np.clip(width, 0., n - 1.)
+    i0, j0 = np.floor(height).astype(int), np.floor(width).astype(int)
+    i1, j1 = np.minimum(i0 + 1, n - 1), np.minimum(j0 + 1, n - 1)
+    wi, wj = height - i0, width - j0
+    index = np.stack([i0 * n + j0, i0 * n + j1, i1 * n + j0, i1 * n + j1], axis=-1) + (face * n * n)[..., None]
+    weight = np.stack([(1. - wi) * (1. - wj), (1. - wi) * wj, wi * (1. - wj), wi * wj], axis=-1)
+    return index, weight
+
+
+def _sparse(rows, cols, values, shape):
+    from scipy.sparse import coo_matrix
+    matrix = coo_matrix((values, (rows, cols)), shape=shape).tocsr()
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def _latlon_bilinear_weights(lat, lon, n):
+    """
+    Bilinear weights from a lat-lon grid to the cell centres of a cubed sphere.
+    """
+    target_lat, target_lon = [c.ravel() for c in cube_sphere_centers(n)]
+    i0, i1, wi = _bracket(lat, target_lat, False)
+    j0, j1, wj = _bracket(lon, target_lon, True)
+    cols = np.stack([i0 * len(lon) + j0, i0 * len(lon) + j1, i1 * len(lon) + j0, i1 * len(lon) + j1], axis=-1)
+    values = np.stack([(1. - wi) * (1. - wj), (1. - wi) * wj, wi * (1. - wj), wi * wj], axis=-1)
+    rows = np.broadcast_to(np.arange(6 * n * n)[:, None], cols.shape)
+    return _sparse(rows.ravel(), cols.ravel(), values.ravel(), (6 * n * n, len(lat) * len(lon)))
+
+
+def _cube_bilinear_weights(lat, lon, n):
+    """
+    Bilinear weights from the cell centres of a cubed sphere to a lat-lon grid.
+    """
+    target_lat, target_lon = [c.ravel() for c in np.meshgrid(lat, lon, indexing='ij')]
+    face, height, width = cube_sphere_locate(n, target_lat, target_lon)
+    i0, j0 = np.floor(height).astype(int), np.floor(width).astype(int)
+    wi, wj = height - i0, width - j0
+    rows, cols, values = [], [], []
+    for di, dj, w in [(0, 0, (1. - wi) * (1. - wj)), (0, 1, (1. - wi) * wj), (1, 0, wi * (1. - wj)), (1, 1, wi * wj)]:
+        i, j = i0 + di, j0 + dj
+        inside = (i >= 0) & (i < n) & (j >= 0) & (j < n)
+        rows.append(np.flatnonzero(inside))
+        cols.append((face * n * n + i * n + j)[inside])
+        values.append(w[inside])
+        # Centres beyond the face edge lie on a neighbouring face, between its cell centres along the edge
+        outside = ~inside
+        ghost_lat, ghost_lon = _angles_to_latlon(face[outside], (j[outside] + 0.5) * np.pi / (2. * n) - np.pi / 4.,
+                                                 (i[outside] + 0.5) * np.pi / (2. * n) - np.pi / 4.)
+        ghost_index, ghost_weight = _face_bilinear(n, *cube_sphere_locate(n, ghost_lat, ghost_lon))
+        rows.append(np.repeat(np.flatnonzero(outside), 4))
+        cols.append(ghost_index.ravel())
+        values.append((ghost_weight * w[outside][:, None]).ravel())
+    return _sparse(np.concatenate(rows), np.concatenate(cols), np.concatenate(values),
+                   (len(lat) * len(lon), 6 * n * n))
+
+
+def _overlap_areas(lat, lon, n, subdivisions):
+    """
+    Sparse matrix of the areas of overlap, in steradians, between the cells of a cubed sphere (rows) and of a lat-lon
+    grid (columns), whose cells are bounded by the midpoints between grid points.
+    """
+    nk = n * subdivisions
+    angles = (np.arange(nk) + 0.5) * np.pi / (2. * nk) - np.pi / 4.
+    t = np.tan(np.linspace(-np.pi / 4., np.pi / 4., nk + 1))
+    y, x = np.meshgrid(t, t, indexing='ij')
+    a = np.arctan(x * y / np.sqrt(1. + x ** 2. + y ** 2.))
+    sub_area = (a[1:, 1:] - a[1:, :-1] - a[:-1, 1:] + a[:-1, :-1]).ravel()
+    beta, alpha = [c.ravel() for c in np.meshgrid(angles, angles, indexing='ij')]
+    parent = (np.arange(nk)[:, None] // subdivisions * n + np.arange(nk)[None, :] // subdivisions).ravel()
+    rows, cols, values = [], [], []
+    for face in range(6):
+        sub_lat, sub_lon = _angles_to_latlon(face, alpha, beta)
+        # The lat-lon cell containing each sub-cell centre is that of the nearest grid point
+        i0, i1, wi = _bracket(lat, sub_lat, False)
+        j0, j1, wj = _bracket(lon, sub_lon, True)
+        rows.append(face * n * n + parent)
+        cols.append(np.where(wi < 0.5, i0, i1) * len(lon) + np.where(wj < 0.5, j0, j1))
+        values.append(sub_area)
+    return _sparse(np.concatenate(rows), np.concatenate(cols), np.concatenate(values),
+                   (6 * n * n, len(lat) * len(lon)))
+
+
+def _latlon_cell_areas(lat, lon):
+    """
+    Areas in steradians of the cells of a lat-lon grid bounded by the midpoints between grid points, flattened.
+    """
+    def edges(points, periodic):
+        order = np.argsort(points)
+        p = points[order]
+        if periodic:
+            mid = 0.5 * (p + np.roll(p, -1) + 360. * (np.arange(len(p)) == len(p) - 1))
+            lower, upper = np.roll(mid, 1) - 360. * (np.arange(len(p)) == 0), mid
+        else:
+            mid = 0.5 * (p[1:] + p[:-1])
+            lower, upper = np.concatenate([[-90.], mid]), np.concatenate([mid, [90.]])
+        result = np.empty((len(p), 2))
+        result[order] = np.stack([lower, upper], axis=-1)
+        return np.deg2rad(result)
+
+    lat_edges, lon_edges = edges(np.asarray(lat, dtype=np.float64), False), edges(np.asarray(lon) % 360., True)
+    return np.outer(np.sin(lat_edges[:, 1]) - np.sin(lat_edges[:, 0]), lon_edges[:, 1] - lon_edges[:, 0]).ravel()
+
+
+def gnomonic_weights(lat, lon, res, method='conservative', subdivisions=None):
+    """
+    Compute sparse remapping weights between a lat-lon grid and a gnomonic cubed sphere.
+
+    :param lat: array-like: latitudes of the lat-lon grid in degrees, in any monotonic order
+    :param lon: array-like: longitudes of the lat-lon grid in degrees, spanning the globe
+    :param res: int: number of points on a side of each cube face
+    :param method: str: 'bilinear' or 'conservative'
+    :param subdivisions: int: for conservative weights, number of sub-cells along each side of a cube cell used to
+        integrate the overlaps. The default makes the sub-cells about 4 times smaller than the lat-lon cells.
+    :return: (scipy.sparse.csr_matrix, scipy.sparse.csr_matrix): forward weights, of shape (6 * res * res, nlat * nlon),
+        and inverse weights, of shape (nlat * nlon, 6 * res * res)
+    """
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    if lat.ndim != 1 or lon.ndim != 1 or len(lat) < 2 or len(lon) < 2:
+        raise ValueError("'lat' and 'lon' must be 1-dimensional with at least 2 points")
+    res = int(res)
+    if res < 1:
+        raise ValueError("'res' must be a positive integer")
+    if method == 'bilinear':
+        return _latlon_bilinear_weights(lat, lon, res), _cube_bilinear_weights(lat, lon, res)
+    elif method == 'conservative':
+        if subdivisions is None:
+            spacing = min(np.min(np.abs(np.diff(np.sort(lat)))), np.min(np.diff(np.sort(lon % 360.))))
+            subdivisions = max(2, int(np.ceil(4. * 90. / res / spacing)))
+        overlap = _overlap_areas(lat, lon, res, int(subdivisions))
+        from scipy.sparse import diags
+        forward = diags(1. / np.asarray(overlap.sum(axis=1)).ravel()) @ overlap
+        covered = np.asarray(overlap.sum(axis=0)).ravel()
+        missed = covered == 0.
+        inverse = diags(np.where(missed, 0., 1. / np.where(missed, 1., covered))) @ overlap.T.tocsr()
+        if np.any(missed):
+            # Lat-lon cells smaller than the sub-cells, such as the half cells at the poles, are interpolated instead
+            inverse = inverse + diags(missed.astype(np.float64)) @ _cube_bilinear_weights(lat, lon, res)
+        return forward.tocsr(), inverse.tocsr()
+    raise ValueError("'method' must be 'bilinear' or 'conservative'")
+
+
+def _write_map(path, weights, area_a, area_b, lat_a, lon_a, lat_b, lon_b):
+    """
+    Write sparse weights to a netCDF file with the variables of TempestRemap offline maps.
+    """
+    weights = weights.tocoo()
+    ds = xr.Dataset({
+        'S': (('n_s',), weights.data),
+        'row': (('n_s',), weights.row.astype(np.int32) + 1),
+        'col': (('n_s',), weights.col.astype(np.int32) + 1),
+        'area_a': (('n_a',), area_a),
+        'area_b': (('n_b',), area_b),
+        'yc_a': (('n_a',), lat_a),
+        'xc_a': (('n_a',), lon_a),
+        'yc_b': (('n_b',), lat_b),
+        'xc_b': (('n_b',), lon_b),
+    })
+    ds.to_netcdf(path)
+
+
+def _read_map(path):
+    from scipy.sparse import coo_matrix
+    with xr.open_dataset(path) as ds:
+        shape = (ds.sizes['n_b'], ds.sizes['n_a'])
+        return coo_matrix((ds['S'].values, (ds['row'].values - 1, ds['col'].values - 1)), shape=shape).tocsr()
+
+
+class GnomonicRemap(_BaseRemap):
+    """
+    Remap between a lat-lon grid and the gnomonic cubed sphere with weights computed in NumPy. Unlike CubeSphereRemap,
+    no external executables are needed, and the remapped data have (face, height, width) dimensions directly.
+    """
+
+    def __init__(self, lat, lon, res, method='conservative', subdivisions=None, cache=None, verbose=True):
+        """
+        Initialize a GnomonicRemap object and compute its weights.
+
+        :param lat: array-like: latitudes of the lat-lon grid in degrees
+        :param lon: array-like: longitudes of the lat-lon grid in degrees, spanning the globe
+        :param res: int: number of points on a side of each cube face
+        :param method: str: 'bilinear' or 'conservative'
+        :param subdivisions: int: see gnomonic_weights
+        :param cache: str or DLWP.remap.MapCache: if given, a MapCache or the directory of one, from which weights with
+            the same parameters and coordinates are reused
+        :param verbose: bool: print progress
+        """
+        super(GnomonicRemap, self).__init__()
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.res = int(res)
+        self.method = method
+        self.subdivisions = subdivisions
+        self.verbose = verbose
+        if cache is not None and not isinstance(cache, MapCache):
+            cache = MapCache(cache, verbose=verbose)
+        self.cache = cache
+        self.lat_dim = 'lat'
+        self.lon_dim = 'lon'
+        self.map = None
+        self.inverse_map = None
+        self.generate_weights()
+
+    @classmethod
+    def from_file(cls, in_file, res, **kwargs):
+        """
+        Initialize a GnomonicRemap object from the latitude and longitude coordinates of a netCDF file.
+
+        :param in_file: str: name of input netCDF file for latitude/longitude coordinates
+        :param res: int: number of points on a side of each cube face
+        :param kwargs: passed to GnomonicRemap()
+        :return: GnomonicRemap
+        """
+        with xr.open_dataset(in_file) as ds:
+            lat_dim, lon_dim = cls._latlon_dims(ds)
+            remap = cls(ds[lat_dim].values, ds[lon_dim].values, res, **kwargs)
+        remap.lat_dim, remap.lon_dim = lat_dim, lon_dim
+        return remap
+
+    @staticmethod
+    def _latlon_dims(ds):
+        for file_lon in ['longitude', 'long', 'lon', None]:
+            if file_lon in ds.dims:
+                break
+        for file_lat in ['latitude', 'lat', None]:
+            if file_lat in ds.dims:
+                break
+        if file_lon is None or file_lat is None:
+            raise ValueError("cannot find standard names for latitude and longitude coordinates. Found %s" %
+                             list(ds.dims))
+        return file_lat, file_lon
+
+    def generate_weights(self):
+        """
+        Compute the forward and inverse weights, or read them from the cache.
+        """
+        if self.cache is None:
+            if self.verbose:
+                print('GnomonicRemap: computing %s weights...' % self.method)
+            self.map, self.inverse_map = gnomonic_weights(self.lat, self.lon, self.res, self.method, self.subdivisions)
+            return
+
+        def generate(forward, inverse, work_dir):
+            forward_weights, inverse_weights = gnomonic_weights(self.lat, self.lon, self.res, self.method,
+                                                                self.subdivisions)
+            cube_lat, cube_lon = [c.ravel() for c in cube_sphere_centers(self.res)]
+            grid_lat, grid_lon = [c.ravel() for c in np.meshgrid(self.lat, self.lon, indexing='ij')]
+            grid_area, cube_area = _latlon_cell_areas(self.lat, self.lon), cube_sphere_cell_areas(self.res).ravel()
+            _write_map(forward, forward_weights, grid_area, cube_area, grid_lat, grid_lon, cube_lat, cube_lon)
+            _write_map(inverse, inverse_weights, cube_area, grid_area, cube_lat, cube_lon, grid_lat, grid_lon)
+
+        params = {'generator': 'gnomonic', 'method': self.method, 'res': self.res, 'subdivisions': self.subdivisions,
+                  'lat_values': coordinate_hash(self.lat), 'lon_values': coordinate_hash(self.lon)}
+        with self.cache.acquire(MapCache.key(**params), generate, params=params) as lease:
+            self.map, self.inverse_map = _read_map(lease.forward), _read_map(lease.inverse)
+
+    def _apply(self, da, weights, in_dims, out_dims, out_shape):
+        other_dims = [d for d in da.dims if d not in in_dims]
+        values = da.transpose(*(other_dims + list(in_dims))).values
+        flat = values.reshape((-1, weights.shape[1]))
+        result = (weights @ flat.T).T.reshape(values.shape[:len(other_dims)] + out_shape)
+        coords = {c: v for c, v in da.coords.items() if not set(v.dims) & set(in_dims)}
+        return xr.DataArray(result, dims=other_dims + list(out_dims), coords=coords, attrs=da.attrs, name=da.name)
+
+    def remap_dataset(self, ds):
+        """
+        Remap the variables of a Dataset or DataArray on the lat-lon grid to the cubed sphere. Variables without both
+        latitude and longitude dimensions are kept unchanged.
+
+        :param ds: xarray.Dataset or xarray.DataArray: data with the latitudes and longitudes of the object
+        :return: xarray.Dataset or xarray.DataArray: data with (face, height, width) dimensions
+        """
+        lat_dim, lon_dim = self._latlon_dims(ds)
+        if not (np.allclose(ds[lat_dim].values, self.lat) and np.allclose(ds[lon_dim].values, self.lon)):
+            raise ValueError('the latitudes and longitudes of the data do not match those of the remapper')
+        return self._map_variables(ds, (lat_dim, lon_dim), self.map, ('face', 'height', 'width'),
+                                   (6, self.res, self.res))
+
+    def inverse_remap_dataset(self, ds):
+        """
+        Remap the variables of a Dataset or DataArray with (face, height, width) dimensions to the lat-lon grid.
+        Variables without these dimensions are kept unchanged.
+
+        :param ds: xarray.Dataset or xarray.DataArray: data on the cubed sphere of the object
+        :return: xarray.Dataset or xarray.DataArray: data with latitude and longitude dimensions
+        """
+        if any(ds.sizes.get(d) != s for d, s in zip(('face', 'height', 'width'), (6, self.res, self.res))):
+            raise ValueError('the data must have (face, height, width) dimensions of sizes (6, %d, %d)' %
+                             (self.res, self.res))
+        result = self._map_variables(ds, ('face', 'height', 'width'), self.inverse_map, (self.lat_dim, self.lon_dim),
+                                     (len(self.lat), len(self.lon)))
+        return result.assign_coords(**{self.lat_dim: self.lat, self.lon_dim: self.lon})
+
+    def _map_variables(self, ds, in_dims, weights, out_dims, out_shape):
+        if isinstance(ds, xr.DataArray):
+            return self._apply(ds, weights, in_dims, out_dims, out_shape)
+        variables = {}
+        for name, da in ds.data_vars.items():
+            if all(d in da.dims for d in in_dims):
+                variables[name] = self._apply(da, weights, in_dims, out_dims, out_shape)
+            else:
+                variables[name] = da
+        coords = {c: v for c, v in ds.coords.items() if not set(v.dims) & set(in_dims)}
+        return xr.Dataset(variables, coords=coords, attrs=ds.attrs)
+
+    def remap(self, input_file, output_file):
+        """
+        Apply the forward remapping to data in an input_file, saved to output_file with (face, height, width)
+        dimensions.
+
+        :param input_file: str: path to input data file
+        :param output_file: str: path to output data file
+        """
+        if self.verbose:
+            print('GnomonicRemap: applying forward map...')
+        with xr.open_dataset(input_file) as ds:
+            self.remap_dataset(ds).to_netcdf(output_file)
+        if self.verbose:
+            print('GnomonicRemap: successfully remapped data into %s' % output_file)
+
+    def inverse_remap(self, input_file, output_file):
+        """
+        Apply the inverse remapping to data with (face, height, width) dimensions in an input_file, saved to
+        output_file.
+
+        :param input_file: str: path to input data file
+        :param output_file: str: path to output data file
+        """
+        if self.verbose:
+            print('GnomonicRemap: applying inverse map...')
+        with xr.open_dataset(input_file) as ds:
+            self.inverse_remap_dataset(ds).to_netcdf(output_file)
+        if self.verbose:
+            print('GnomonicRemap: successfully inverse remapped data into %s' % output_file)
@@ -0,0 +1,286 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Lightweight, opt-in profiling of named stages in DLWP hot paths.
+
+The data generators and the TimeSeriesEstimator record the time spent in each stage of their work into the module-level
+`profiler`. Profiling is disabled by default, in which case recording costs one attribute check per stage. Enable it
+with `DLWP.timing.enable()`, then print `profiler.summary()`, export `profiler.to_chrome_trace(file)` for
+chrome://tracing or Perfetto, or add DLWP.custom.ProfilerCallback to a Keras fit to log per-epoch breakdowns.
+
+Note that stages executed in other processes (e.g. Keras generator workers with use_multiprocessing=True) are recorded
+in the profiler of that process and are not visible here.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class _NullTimer(object):
+    """
+    Does nothing, quickly. Returned by a disabled Profiler.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def lap(self, name):
+        pass
+
+    def stop(self):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+class _Timer(object):
+    """
+    Context manager that records the time spent in its block.
+    """
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, time.perf_counter() - self.start, start=self.start)
+        return False
+
+
+class _Stopwatch(object):
+    """
+    Records consecutive stages of a function without nesting its code in context managers. Each call to lap(name)
+    records the time since the previous lap as '<prefix>/<name>'; stop() records the total as '<prefix>'.
+    """
+    __slots__ = ('profiler', 'prefix', 'start', 'last')
+
+    def __init__(self, profiler, prefix):
+        self.profiler = profiler
+        self.prefix = prefix
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.profiler.record(self.prefix + '/' + name, now - self.last, start=self.last)
+        self.last = now
+
+    def stop(self):
+        now = time.perf_counter()
+        self.profiler.record(self.prefix, now - self.start, start=self.start)
+
+
+class Profiler(object):
+    """
+    Collects named timers and counters. Thread-safe; a disabled profiler returns shared no-op timers.
+    """
+
+    def __init__(self, enabled=False, trace=False, max_events=1000000):
+        """
+        :param enabled: bool: if False, timers and counters are not recorded
+        :param trace: bool: if True, also keep every timed event for export with to_chrome_trace()
+        :param max_events: int: maximum number of trace events to keep
+        """
+        self.enabled = enabled
+        self.trace = trace
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self.times = {}
+        self.counters = {}
+        self.events = []
+        self._origin = time.perf_counter()
+
+    def enable(self, trace=None):
+        """
+        Start recording.
+
+        :param trace: bool: if not None, set whether to keep trace events
+        """
+        if trace is not None:
+            self.trace = trace
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop recording. Recorded times are kept.
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Clear all recorded times, counters and trace events.
+        """
+        with self._lock:
+            self.times = {}
+            self.counters = {}
+            self.events = []
+            self._origin = time.perf_counter()
+
+    def timer(self, name):
+        """
+        Context manager recording the time spent in its block under name.
+
+        :param name: str: name of the timer
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name)
+
+    def stopwatch(self, prefix):
+        """
+        Stopwatch recording consecutive stages under '<prefix>/<stage>' with lap(stage), and the total under prefix
+        with stop().
+
+        :param prefix: str: name of the function or block being timed
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Stopwatch(self, prefix)
+
+    def record(self, name, seconds, start=None):
+        """
+        Add a measured time to a timer.
+
+        :param name: str: name of the timer
+        :param seconds: float: elapsed time
+        :param start: float: time.perf_counter() at the start of the event, used for trace events
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self.times.get(name)
+            if entry is None:
+                self.times[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+            if self.trace and start is not None and len(self.events) < self.max_events:
+                self.events.append((name, start, seconds, threading.get_ident()))
+
+    def count(self, name, n=1):
+        """
+        Add to a counter.
+
+        :param name: str: name of the counter
+        :param n: int or float: amount to add
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        """
+        :return: a copy of the current timers and counters, to be passed to stats(since=...)
+        """
+        with self._lock:
+            return {'times': {k: tuple(v) for k, v in self.times.items()}, 'counters': dict(self.counters)}
+
+    def stats(self, since=None):
+        """
+        Flat dictionary of the total seconds of each timer, as 'time/<name>', and the value of each counter, as
+        'count/<name>', suitable for training logs.
+
+        :param since: dict: result of snapshot(); if given, report only what was recorded after it was taken
+        :return: dict
+        """
+        current = self.snapshot()
+        since = since or {'times': {}, 'counters': {}}
+        result = {}
+        for name, (calls, total, _) in sorted(current['times'].items()):
+            result['time/' + name] = total - since['times'].get(name, (0, 0., 0.))[1]
+        for name, value in sorted(current['counters'].items()):
+            result['count/' + name] = value - since['counters'].get(name, 0)
+        return result
+
+    def summary(self, sort='total'):
+        """
+        Table of timers and counters.
+
+        :param sort: str: sort timers by 'total', 'calls', 'mean', or 'name'
+        :return: str
+        """
+        current = self.snapshot()
+        rows = [(name, calls, total, total / calls, maximum)
+                for name, (calls, total, maximum) in current['times'].items()]
+        if sort == 'name':
+            rows.sort(key=lambda r: r[0])
+        else:
+            key = {'calls': 1, 'total': 2, 'mean': 3}
+            if sort not in key:
+                raise ValueError("'sort' must be one of 'total', 'calls', 'mean', or 'name'")
+            rows.sort(key=lambda r: r[key[sort]], reverse=True)
+        width = max([len(r[0]) for r in rows] + [len(n) for n in current['counters']] + [5])
+        lines = ['%-*s %10s %12s %12s %12s' % (width, 'timer', 'calls', 'total (s)', 'mean (ms)', 'max (ms)')]
+        for name, calls, total, mean, maximum in rows:
+            lines.append('%-*s %10d %12.4f %12.3f %12.3f' % (width, name, calls, total, mean * 1e3, maximum * 1e3))
+        if len(current['counters']) > 0:
+            lines.append('')
+            lines.append('%-*s %10s' % (width, 'counter', 'value'))
+            for name, value in sorted(current['counters'].items()):
+                lines.append('%-*s %10g' % (width, name, value))
+        return '\n'.join(lines)
+
+    def to_chrome_trace(self, file=None):
+        """
+        Export the trace events in the Chrome trace event format, viewable in chrome://tracing or Perfetto. Events are
+        only kept while the profiler is enabled with trace=True.
+
+        :param file: str: if given, write the JSON trace to this file
+        :return: dict: the trace
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+            origin = self._origin
+        trace_events = [{'name': name, 'cat': name.split('/')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                         'ts': (start - origin) * 1e6, 'dur': seconds * 1e6}
+                        for name, start, seconds, tid in events]
+        if len(counters) > 0:
+            end = max([e['ts'] + e['dur'] for e in trace_events] + [0.])
+            trace_events += [{'name': name, 'ph': 'C', 'pid': pid, 'ts': end, 'args': {'value': value}}
+                             for name, value in counters.items()]
+        trace = {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+        if file is not None:
+            with open(file, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+
+# Default profiler shared by the DLWP hot paths
+profiler = Profiler()
+
+
+def enable(trace=False):
+    """
+    Enable the default profiler.
+
+    :param trace: bool: if True, also keep every timed event for export with to_chrome_trace()
+    """
+    profiler.enable(trace=trace)
+
+
+def disable():
+    """
+    Disable the default profiler.
+    """
+    profiler.disable()
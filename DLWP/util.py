@@ -8,6 +8,7 @@
 DLWP utilities.
 """
 
+import os
 import pickle
 import random
 import re
@@ -16,8 +17,6 @@ from importlib import import_module
 from copy import copy
 import numpy as np
 import pandas as pd
-from tensorflow.keras import models as keras_models
-from tensorflow.keras.utils import multi_gpu_model
 
 
 # ==================================================================================================================== #
@@ -29,6 +28,7 @@ def make_keras_picklable():
     """
     Thanks to http://zachmoshe.com/2017/04/03/pickling-keras-models.html
     """
+    from tensorflow.keras import models as keras_models
 
     def __getstate__(self):
         model_str = ""
@@ -128,13 +128,20 @@ def save_model(model, file_name, history=None):
     """
     Saves a class instance with a 'model' attribute to disk. Creates two files: one pickle file containing no model
     saved as ${file_name}.pkl and one for the model saved as ${file_name}.keras. Use the `load_model()` method to load
-    a model saved with this method.
+    a model saved with this method. In multi-worker training, this must be called on every worker, since saving
+    synchronizes the workers, but only the chief worker keeps the files.
 
     :param model: model instance (with a 'model' attribute) to save
     :param file_name: str: base name of save files
     :param history: history from Keras fitting, or None
     :return:
     """
+    from .model.distribute import is_chief
+    if not is_chief():
+        with tempfile.TemporaryDirectory() as temp_dir:
+            keras_model = model.base_model if hasattr(model, 'base_model') else model.model
+            keras_model.save(os.path.join(temp_dir, 'model.keras'))
+        return
     # Save the model structure and weights
     if hasattr(model, 'base_model'):
         model.base_model.save('%s.keras' % file_name)
@@ -145,6 +152,8 @@ def save_model(model, file_name, history=None):
     model_copy.model = None
     if hasattr(model, 'base_model'):
         model_copy.base_model = None
+    if hasattr(model, 'strategy'):
+        model_copy.strategy = None
     # Save the pickled DLWP object
     with open('%s.pkl' % file_name, 'wb') as f:
         pickle.dump(model_copy, f, protocol=pickle.HIGHEST_PROTOCOL)
@@ -154,7 +163,7 @@ def save_model(model, file_name, history=None):
             pickle.dump(history.history, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
-def load_model(file_name, history=False, custom_objects=None, gpus=1):
+def load_model(file_name, history=False, custom_objects=None, gpus=1, strategy=None):
     """
     Loads a model saved to disk with the `save_model()` method.
 
@@ -162,28 +171,27 @@ def load_model(file_name, history=False, custom_objects=None, gpus=1):
     :param history: bool: if True, loads the history file along with the model
     :param custom_objects: dict: any custom functions or classes to be included when Keras loads the model. There is
         no need to add objects in DLWP.custom as those are added automatically.
-    :param gpus: int: load the model onto this number of GPUs
+    :param gpus: int: load the model onto this number of GPUs with a MirroredStrategy
+    :param strategy: str or tf.distribute.Strategy: load the model under the scope of this strategy, to continue
+        training it in parallel; see DLWP.model.distribute.get_strategy
     :return: model [, dict]: loaded object [, dictionary of training history]
     """
+    from tensorflow.keras import models as keras_models
+    from .model.distribute import get_strategy
     # Load the pickled DLWP object
     with open('%s.pkl' % file_name, 'rb') as f:
         model = pickle.load(f)
-    # Load the saved keras model weights
+    # Load the saved keras model weights, with its variables distributed by the strategy
     custom_objects = custom_objects or {}
     custom_objects.update(get_classes('DLWP.custom'))
     custom_objects.update(get_methods('DLWP.custom'))
-    loaded_model = keras_models.load_model('%s.keras' % file_name, custom_objects=custom_objects, compile=True)
-    # If multiple GPUs are requested, copy the model to the GPUs
-    if gpus > 1:
-        import tensorflow as tf
-        with tf.device('/cpu:0'):
-            model.base_model = keras_models.clone_model(loaded_model)
-            model.base_model.set_weights(loaded_model.get_weights())
-        model.model = multi_gpu_model(model.base_model, gpus=gpus)
-        model.gpus = gpus
-    else:
-        model.base_model = loaded_model
-        model.model = model.base_model
+    strategy = get_strategy(strategy, gpus)
+    with strategy.scope():
+        loaded_model = keras_models.load_model('%s.keras' % file_name, custom_objects=custom_objects, compile=True)
+    model.base_model = loaded_model
+    model.model = model.base_model
+    model.gpus = gpus
+    model.strategy = strategy
     # Also load the history file, if requested
     if history:
         with open('%s.history' % file_name, 'rb') as f:
@@ -236,7 +244,65 @@ def load_torch_model(file_name, history=False):
         return model
 
 
-def delete_nan_samples(predictors, targets, large_fill_value=False, threshold=None):
+def nan_sample_mask(array, threshold=None):
+    """
+    Return a boolean mask of the samples (first axis) of an array which contain missing values.
+
+    :param array: ndarray, shape [num_samples,...]: data array
+    :param threshold: float 0-1: if not None, then only flags samples with a fraction of NaN at least this large
+    :return: ndarray of bool, shape [num_samples]: True where the sample contains NaN
+    """
+    array = array.reshape((array.shape[0], -1))
+    if threshold is None:
+        return np.isnan(array).any(axis=1)
+    else:
+        return np.isnan(array).mean(axis=1) >= threshold
+
+
+def valid_sample_mask(array, item=(), chunk_size=256):
+    """
+    Return a boolean mask of the samples (first axis) of an array which contain no missing values. The array is read
+    in chunks of samples, so that disk-backed arrays (dask arrays, netCDF4 variables) are never fully loaded to memory.
+
+    :param array: array-like, shape [num_samples,...]: data array supporting basic slicing along the first axis
+    :param item: tuple: additional index applied to the remaining axes of each chunk, e.g. a variable selection
+    :param chunk_size: int: number of samples to read at a time
+    :return: ndarray of bool, shape [num_samples]: True where the sample contains no NaN
+    """
+    if not isinstance(item, tuple):
+        item = (item,)
+    n_sample = array.shape[0]
+    valid = np.empty(n_sample, dtype=bool)
+    for start in range(0, n_sample, chunk_size):
+        chunk = array[(slice(start, start + chunk_size),) + item]
+        if np.ma.isMaskedArray(chunk):
+            chunk = chunk.astype(np.float32).filled(np.nan)
+        valid[start:start + chunk_size] = ~nan_sample_mask(np.asarray(chunk))
+    return valid
+
+
+def compact_samples(keep, *arrays):
+    """
+    Move the samples (first axis) selected by `keep` to the front of each array, in place, and return views of the
+    compacted arrays. No copies of the arrays are made; the input arrays are overwritten.
+
+    :param keep: ndarray of int: sorted indices of the samples to keep
+    :param arrays: ndarrays, shape [num_samples,...]: arrays to compact
+    :return: list of ndarrays: views of the first len(keep) samples of each array
+    """
+    n_keep = len(keep)
+    moved = np.flatnonzero(keep != np.arange(n_keep))
+    first = moved[0] if len(moved) > 0 else n_keep
+    result = []
+    for array in arrays:
+        # Since keep is sorted, keep[i] >= i and moving samples forward never overwrites one still to be moved
+        for dst in range(first, n_keep):
+            array[dst] = array[keep[dst]]
+        result.append(array[:n_keep])
+    return result
+
+
+def delete_nan_samples(predictors, targets, large_fill_value=False, threshold=None, in_place=False):
     """
     Delete any samples from the predictor and target numpy arrays and return new, reduced versions.
 
@@ -244,6 +310,8 @@ def delete_nan_samples(predictors, targets, large_fill_value=False, threshold=No
     :param targets: ndarray, shape [num_samples,...]: target data
     :param large_fill_value: bool: if True, treats very large values (>= 1e20) as NaNs
     :param threshold: float 0-1: if not None, then removes any samples with a fraction of NaN larger than this
+    :param in_place: bool: if True, compact the input arrays in place and return views of them instead of copies.
+        The contents of the input arrays are then overwritten.
     :return: predictors, targets: ndarrays with samples removed
     """
     if threshold is not None and not (0 <= threshold <= 1):
@@ -251,22 +319,14 @@ def delete_nan_samples(predictors, targets, large_fill_value=False, threshold=No
     if large_fill_value:
         predictors[(predictors >= 1.e20) | (predictors <= -1.e20)] = np.nan
         targets[(targets >= 1.e20) | (targets <= -1.e20)] = np.nan
-    p_shape = predictors.shape
-    t_shape = targets.shape
-    predictors = predictors.reshape((p_shape[0], -1))
-    targets = targets.reshape((t_shape[0], -1))
-    if threshold is None:
-        p_ind = list(np.where(np.isnan(predictors))[0])
-        t_ind = list(np.where(np.isnan(targets))[0])
+    bad = nan_sample_mask(predictors, threshold) | nan_sample_mask(targets, threshold)
+    if not np.any(bad):
+        return predictors, targets
+    if in_place:
+        predictors, targets = compact_samples(np.flatnonzero(~bad), predictors, targets)
     else:
-        p_ind = list(np.where(np.mean(np.isnan(predictors), axis=1) >= threshold)[0])
-        t_ind = list(np.where(np.mean(np.isnan(targets), axis=1) >= threshold)[0])
-    bad_ind = list(set(p_ind + t_ind))
-    predictors = np.delete(predictors, bad_ind, axis=0)
-    targets = np.delete(targets, bad_ind, axis=0)
-    new_p_shape = (predictors.shape[0],) + p_shape[1:]
-    new_t_shape = (targets.shape[0],) + t_shape[1:]
-    return predictors.reshape(new_p_shape), targets.reshape(new_t_shape)
+        predictors, targets = predictors[~bad], targets[~bad]
+    return predictors, targets
 
 
 def train_test_split_ind(n_sample, test_size, method='random'):
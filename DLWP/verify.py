@@ -11,8 +11,47 @@ Methods for validating DLWP forecasts.
 import numpy as np
 import pandas as pd
 import xarray as xr
-from datetime import timedelta
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from .remap.gnomonic import cube_sphere_weights
+
+
+def get_weights(da, weighted):
+    """
+    Get the weights of the grid points of data for area-weighted error metrics.
+
+    :param da: ndarray or DataArray: data to weight
+    :param weighted: bool, str, or array: one of
+        False: no weighting
+        True: weight by the cosine of latitude if 'lat' is a dimension of da, or by the cell areas if da is on a cubed
+            sphere with ('face', 'height', 'width') or ('x0', 'x1', 'x2') dimensions
+        'lat': weight by the cosine of latitude
+        'cs': weight by the cubed-sphere cell areas (see DLWP.remap.gnomonic)
+        ndarray or DataArray: use these weights, which must broadcast against da
+    :return: float, ndarray, or DataArray: weights with a mean of 1
+    """
+    if isinstance(weighted, (np.ndarray, xr.DataArray)):
+        return weighted / weighted.mean()
+    if weighted is None or weighted is False:
+        return 1.
+    if not isinstance(da, xr.DataArray):
+        raise TypeError("weighting by latitude or cubed-sphere area requires DataArray inputs; pass an array of "
+                        "weights instead")
+    cs_dims = [dims for dims in [('face', 'height', 'width'), ('x0', 'x1', 'x2')] if all(d in da.dims for d in dims)]
+    if weighted is True:
+        weighted = 'lat' if 'lat' in da.dims else 'cs' if len(cs_dims) > 0 else None
+    if weighted == 'lat':
+        if 'lat' not in da.dims:
+            raise ValueError("latitude weighting requires 'lat' to be a dimension of the data")
+        weights = np.cos(np.deg2rad(da.lat))
+        return weights / weights.mean()
+    elif weighted == 'cs':
+        if len(cs_dims) == 0 or da.sizes[cs_dims[0][0]] != 6 or da.sizes[cs_dims[0][1]] != da.sizes[cs_dims[0][2]]:
+            raise ValueError("cubed-sphere weighting requires (face, height, width) or (x0, x1, x2) dimensions of "
+                             "sizes (6, n, n)")
+        return cube_sphere_weights(da.sizes[cs_dims[0][1]], cs_dims[0])
+    raise ValueError("'weighted' must be a bool, 'lat', 'cs', or an array of weights; got %s for data with "
+                     "dimensions %s" % (weighted, da.dims))
 
 
 def forecast_error(forecast, valid, method='mse', axis=None, weighted=False, climatology=None):
@@ -30,8 +69,7 @@ def forecast_error(forecast, valid, method='mse', axis=None, weighted=False, cli
     :param axis: int, tuple, or None: take the mean of the error along this axis. Regardless of this setting, the
         forecast hour will be the first dimension. Note that for cosine similarity it is recommended to explicitly
         specify the spatial axes.
-    :param weighted: bool: if True, expects inputs to be DataArrays with 'lat' as one of the dimensions, and weights
-        according to the latitude
+    :param weighted: bool, str, or array: weighting of the grid points; see get_weights
     :param climatology: ndarray or DataArray: mean climatology state for computing the ACC score. Dimensions other than
         axis 0 (forecast hour) and axis 1 (time) must match that of the forecast/valid arrays. If either of the first
         two axes are included, they must be size 1 or (for time) match the time dimension.
@@ -43,11 +81,7 @@ def forecast_error(forecast, valid, method='mse', axis=None, weighted=False, cli
                       "unexpected results.")
         climatology = 0.
     n_f = forecast.shape[0]
-    if weighted:
-        weights = np.cos(np.deg2rad(valid.lat))
-        weights /= weights.mean()
-    else:
-        weights = 1.
+    weights = get_weights(valid, weighted)
     if len(forecast.shape) == len(valid.shape):
         # valid provided with a forecast hour dimension 0
         if axis is None:
@@ -95,6 +129,299 @@ def forecast_error(forecast, valid, method='mse', axis=None, weighted=False, cli
         return np.array(me)
 
 
+class OnlineScorer(object):
+    """
+    Accumulates the error of a forecast against verification data as the forecast is produced, using running sums, so
+    that the forecast and verification fields do not need to be kept. An instance can be passed as a handler to
+    DLWP.model.TimeSeriesEstimator.predict:
+
+        scorer = OnlineScorer(validation_ds.predictors, climatology=climo, weighted=True)
+        for samples in chunks:
+            estimator.predict(steps, samples=samples, handlers=scorer)
+        rmse = scorer.result('rmse')
+
+    Forecasts may be passed in any number of blocks of forecast hours and initialization times; the scores of each
+    forecast hour are accumulated over all the blocks.
+    """
+
+    def __init__(self, valid, climatology=None, weighted=False, dims=None):
+        """
+        :param valid: DataArray: verification data as a continuous time series with a 'time' or 'sample' dimension
+            and the same other dimensions as the forecast (cubed-sphere forecasts with x0, x1, x2 dimensions are
+            matched to the spatial dimensions of valid in order). Only the times needed are read, so this may be
+            backed by dask or a file.
+        :param climatology: float or DataArray: climatology for computing the ACC score. May have a 'dayofyear' or
+            'month' dimension, which is selected by the verification time, or a 'time' dimension, which is reindexed
+            to the verification time.
+        :param weighted: bool, str, or DataArray: weighting of the grid points of valid; see get_weights
+        :param dims: iterable of str: dimensions to average over. By default, all dimensions except f_hour and the
+            variable dimensions ('varlev', 'variable', 'level').
+        """
+        if not isinstance(valid, xr.DataArray):
+            raise TypeError("'valid' must be an xarray DataArray")
+        if 'sample' in valid.dims:
+            valid = valid.rename({'sample': 'time'})
+        if 'time' not in valid.dims:
+            raise ValueError("'valid' must have a 'time' or 'sample' dimension")
+        self.valid = valid
+        self.climatology = 0. if climatology is None else climatology
+        self.weights = None if weighted is None or weighted is False else get_weights(valid, weighted)
+        self.dims = None if dims is None else list(dims)
+        self._spatial_dims = [d for d in valid.dims if d not in ['time', 'time_step', 'varlev', 'variable', 'level']]
+        self._sums = {}
+
+    def reset(self):
+        """
+        Discard the accumulated scores.
+        """
+        self._sums = {}
+
+    def _climatology(self, valid_times):
+        climo = self.climatology
+        if not isinstance(climo, xr.DataArray):
+            return climo
+        times = pd.DatetimeIndex(valid_times)
+        if 'dayofyear' in climo.dims:
+            climo = climo.sel(dayofyear=xr.DataArray(times.dayofyear, dims=['time']))
+        elif 'month' in climo.dims:
+            climo = climo.sel(month=xr.DataArray(times.month, dims=['time']))
+        elif 'time' in climo.dims or 'sample' in climo.dims:
+            climo = climo.rename({'sample': 'time'}) if 'sample' in climo.dims else climo
+            return climo.reindex(time=valid_times, method=None).drop_vars('time')
+        else:
+            return climo
+        return climo.drop_vars([c for c in ['dayofyear', 'month'] if c in climo.coords])
+
+    def update(self, forecast):
+        """
+        Add the errors of a block of forecasts to the running sums.
+
+        :param forecast: DataArray: forecast with 'f_hour' and 'time' (initialization) dimensions, as returned by
+            TimeSeriesEstimator.predict with keep_time_dim=False
+        """
+        if 'f_hour' not in forecast.dims or 'time' not in forecast.dims:
+            raise ValueError("'forecast' must have 'f_hour' and 'time' dimensions")
+        if 'time_step' in forecast.dims:
+            raise ValueError("'forecast' must not have a 'time_step' dimension; predict with keep_time_dim=False")
+        spatial_dims = [d for d in forecast.dims if d not in ['f_hour', 'time', 'varlev', 'variable', 'level']]
+        if spatial_dims != self._spatial_dims:
+            if len(spatial_dims) != len(self._spatial_dims):
+                raise ValueError("the spatial dimensions of 'forecast' %s do not match those of 'valid' %s" %
+                                 (spatial_dims, self._spatial_dims))
+            forecast = forecast.rename(dict(zip(spatial_dims, self._spatial_dims)))
+            forecast = forecast.drop_vars([d for d in self._spatial_dims if d in forecast.coords])
+        dims = self.dims or [d for d in forecast.dims if d not in ['f_hour', 'varlev', 'variable', 'level']]
+        init_times = forecast.time.values
+        for f_hour in forecast.f_hour.values:
+            f = forecast.sel(f_hour=f_hour).drop_vars('f_hour')
+            lead = f_hour if isinstance(f_hour, np.timedelta64) else pd.Timedelta(hours=float(f_hour))
+            valid_times = init_times + np.timedelta64(lead)
+            v = self.valid.reindex(time=valid_times, method=None).assign_coords(time=init_times)
+            climo = self._climatology(valid_times)
+            if isinstance(climo, xr.DataArray) and 'time' in climo.dims:
+                climo = climo.assign_coords(time=init_times)
+            error = f - v
+            mask = error.notnull()
+            w = mask * (1. if self.weights is None else self.weights)
+            fa = (f - climo).where(mask, 0.)
+            va = (v - climo).where(mask, 0.)
+            error = error.where(mask, 0.)
+            sums = {
+                'w': w.sum(dims),
+                'se': (error ** 2. * w).sum(dims),
+                'ae': (np.abs(error) * w).sum(dims),
+                'fv': (fa * va * w).sum(dims),
+                'ff': (fa ** 2. * w).sum(dims),
+                'vv': (va ** 2. * w).sum(dims),
+            }
+            sums = {k: v.load() for k, v in sums.items()}
+            if f_hour in self._sums:
+                for k in sums:
+                    self._sums[f_hour][k] = self._sums[f_hour][k] + sums[k]
+            else:
+                self._sums[f_hour] = sums
+
+    __call__ = update
+
+    def result(self, method='rmse'):
+        """
+        Scores of the forecasts accumulated so far.
+
+        :param method: str: 'mse', 'mae', 'rmse', or 'acc'
+        :return: DataArray: scores with forecast hour as the first dimension
+        """
+        if method not in ['mse', 'mae', 'rmse', 'acc']:
+            raise ValueError("'method' must be one of 'mse', 'mae', 'rmse', 'acc'")
+        if len(self._sums) == 0:
+            raise ValueError('no forecasts have been scored')
+        scores = []
+        f_hours = sorted(self._sums.keys())
+        for f_hour in f_hours:
+            sums = self._sums[f_hour]
+            if method == 'acc':
+                scores.append(sums['fv'] / np.sqrt(sums['ff'] * sums['vv']))
+            else:
+                score = sums['ae' if method == 'mae' else 'se'] / sums['w']
+                scores.append(np.sqrt(score) if method == 'rmse' else score)
+        return xr.concat(scores, dim='f_hour').assign_coords(f_hour=f_hours).rename(method)
+
+
+def _ensemble_arrays(forecast, valid, member_axis):
+    """
+    Return the forecast as an ndarray with the ensemble member as the last axis, and the verification as a DataArray or
+    ndarray with the same remaining axes.
+    """
+    if isinstance(forecast, xr.DataArray):
+        if not isinstance(member_axis, str):
+            member_axis = forecast.dims[member_axis]
+        if member_axis not in forecast.dims:
+            raise ValueError("ensemble member dimension '%s' not found in forecast dimensions %s" %
+                             (member_axis, forecast.dims))
+        dims = [d for d in forecast.dims if d != member_axis]
+        x = forecast.transpose(*(dims + [member_axis])).values
+        if isinstance(valid, xr.DataArray):
+            valid = valid.transpose(*dims)
+    else:
+        if isinstance(member_axis, str):
+            raise TypeError("'member_axis' must be an integer for ndarray forecasts")
+        x = np.moveaxis(np.asarray(forecast), member_axis, -1)
+    y = valid.values if isinstance(valid, xr.DataArray) else np.asarray(valid)
+    if x.shape[:-1] != y.shape:
+        raise ValueError('forecast shape without the member axis %s does not match verification shape %s' %
+                         (x.shape[:-1], y.shape))
+    if len(y.shape) < 2:
+        raise ValueError('verification must have forecast hour and time as the first two axes')
+    return x, valid, y
+
+
+def _ensemble_map(func, x, y, out_dtype, chunk_size, n_jobs, out_suffix=()):
+    """
+    Apply func(x_chunk, y_chunk) to chunks of the time axis (axis 1) of x and y, in parallel threads. The result of func
+    has the shape of y_chunk plus out_suffix.
+    """
+    out = np.empty(y.shape + tuple(out_suffix), dtype=out_dtype)
+    n_time = y.shape[1]
+    if chunk_size is None:
+        # About 64 MB of forecast per chunk
+        chunk_size = max(1, int(2 ** 26 // max(1, x[:, :1].nbytes)))
+    chunks = [slice(t, min(t + chunk_size, n_time)) for t in range(0, n_time, chunk_size)]
+
+    def run(chunk):
+        out[:, chunk] = func(x[:, chunk], y[:, chunk])
+
+    if n_jobs is None or n_jobs == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            run(chunk)
+    else:
+        # NumPy releases the GIL in sorting and arithmetic
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(run, chunks))
+    return out
+
+
+def _crps(fair):
+    def crps(x, y):
+        m = x.shape[-1]
+        x = np.sort(x, axis=-1)
+        absolute = np.mean(np.abs(x - y[..., np.newaxis]), axis=-1)
+        # The mean absolute difference between pairs of members, from the sorted members in O(M log M)
+        coefficients = (2. * np.arange(1, m + 1) - m - 1.) / (m * (m - 1) if fair else m ** 2.)
+        return absolute - np.dot(x, coefficients)
+    return crps
+
+
+def _spread_skill(x, y):
+    return np.stack([np.var(x, axis=-1, ddof=1), (np.mean(x, axis=-1) - y) ** 2.], axis=-1)
+
+
+def ensemble_error(forecast, valid, method='crps', member_axis='member', axis=None, weighted=False, chunk_size=None,
+                   n_jobs=1):
+    """
+    Calculate the error of an ensemble forecast.
+
+    :param forecast: ndarray or DataArray: ensemble forecast with forecast hour as the first dimension and time as the
+        second dimension, and an ensemble member dimension
+    :param valid: ndarray or DataArray: verification with the same dimensions as the forecast, except the member
+        dimension, as returned by verification_from_series
+    :param method: str: method for computing the error. Options are:
+        'crps': continuous ranked probability score of the ensemble
+        'fcrps': fair CRPS, an unbiased estimate of the CRPS of an infinite ensemble
+        'spread': root of the mean ensemble variance
+        'skill': root-mean-squared error of the ensemble mean
+        'ssr': spread-skill ratio, scaled by sqrt((M + 1) / M) so that it is 1 for a statistically consistent ensemble
+            of M members
+    :param member_axis: str or int: name of the member dimension of a DataArray forecast, or its axis in an ndarray
+    :param axis: int, tuple, or None: take the mean of the error along these axes of valid. Regardless of this setting,
+        the forecast hour will be the first dimension.
+    :param weighted: bool, str, or array: weighting of the grid points; see get_weights
+    :param chunk_size: int: number of times (axis 1) to process at once. By default chunks hold about 64 MB of the
+        forecast.
+    :param n_jobs: int: number of threads to process chunks in
+    :return: ndarray: ensemble forecast error with forecast hour as the first dimension
+    """
+    if method not in ['crps', 'fcrps', 'spread', 'skill', 'ssr']:
+        raise ValueError("'method' must be one of 'crps', 'fcrps', 'spread', 'skill', 'ssr'")
+    x, valid, y = _ensemble_arrays(forecast, valid, member_axis)
+    m = x.shape[-1]
+    if m < 2:
+        raise ValueError('ensemble verification requires at least 2 members')
+    if axis is None:
+        axis = tuple(range(1, len(y.shape)))
+    weights = get_weights(valid, weighted)
+
+    def to_valid(a):
+        # Restore the verification metadata so that DataArray weights broadcast correctly
+        if isinstance(valid, xr.DataArray):
+            return xr.DataArray(a, coords=valid.coords, dims=valid.dims)
+        return a
+
+    if method in ['crps', 'fcrps']:
+        score = to_valid(_ensemble_map(_crps(method == 'fcrps'), x, y, np.result_type(x.dtype, np.float32),
+                                       chunk_size, n_jobs))
+        return np.nanmean(score * weights, axis=axis)
+    spread_skill = _ensemble_map(_spread_skill, x, y, np.result_type(x.dtype, np.float32), chunk_size, n_jobs,
+                                 out_suffix=(2,))
+    spread = np.sqrt(np.nanmean(to_valid(spread_skill[..., 0]) * weights, axis=axis))
+    if method == 'spread':
+        return spread
+    skill = np.sqrt(np.nanmean(to_valid(spread_skill[..., 1]) * weights, axis=axis))
+    if method == 'skill':
+        return skill
+    return np.sqrt((m + 1.) / m) * spread / skill
+
+
+def rank_histogram(forecast, valid, member_axis='member', chunk_size=None, n_jobs=1, random_state=None):
+    """
+    Calculate the rank histogram (Talagrand diagram) of an ensemble forecast: the frequency of the rank of the
+    verification among the sorted ensemble members, for each forecast hour. Ties are broken at random. Points where the
+    verification or any member is missing are ignored.
+
+    :param forecast: ndarray or DataArray: ensemble forecast with forecast hour as the first dimension and time as the
+        second dimension, and an ensemble member dimension
+    :param valid: ndarray or DataArray: verification with the same dimensions as the forecast, except the member
+        dimension
+    :param member_axis: str or int: name of the member dimension of a DataArray forecast, or its axis in an ndarray
+    :param chunk_size: int: number of times (axis 1) to process at once. By default chunks hold about 64 MB of the
+        forecast.
+    :param n_jobs: int: number of threads to process chunks in
+    :param random_state: int or np.random.RandomState: seed or generator for breaking ties
+    :return: ndarray: counts of each rank, of shape (forecast hour, members + 1)
+    """
+    x, valid, y = _ensemble_arrays(forecast, valid, member_axis)
+    m = x.shape[-1]
+    rng = random_state if isinstance(random_state, np.random.RandomState) else np.random.RandomState(random_state)
+
+    def ranks(xc, yc):
+        below = np.sum(xc < yc[..., np.newaxis], axis=-1)
+        ties = np.sum(xc == yc[..., np.newaxis], axis=-1)
+        rank = below + np.floor(rng.uniform(size=below.shape) * (ties + 1)).astype(below.dtype)
+        rank[np.isnan(yc) | np.any(np.isnan(xc), axis=-1)] = m + 1
+        return rank
+
+    rank = _ensemble_map(ranks, x, y, np.int64, chunk_size, n_jobs)
+    return np.stack([np.bincount(r.ravel(), minlength=m + 2)[:m + 1] for r in rank])
+
+
 def persistence_error(predictors, valid, n_fhour, method='mse', axis=None, weighted=False):
     """
     Calculate the error of a persistence forecast out to n_fhour forecast hours.
@@ -107,8 +434,7 @@ def persistence_error(predictors, valid, n_fhour, method='mse', axis=None, weigh
     :param method: str: 'mse' for mean squared error, 'mae' for mean absolute error, 'rmse' for root-mean-square
     :param axis: int, tuple, or None: take the mean of the error along this axis. Regardless of this setting, the
         forecast hour will be the first dimension.
-    :param weighted: bool: if True, expects inputs to be DataArrays with 'lat' as one of the dimensions, and weights
-        according to the latitude
+    :param weighted: bool, str, or array: weighting of the grid points; see get_weights
     :return: ndarray: persistence error with forecast hour as the first dimension
     """
     warnings.warn("'persistence_error' is deprecated as of version 0.8.4. Use 'forecast_error' with an "
@@ -117,11 +443,7 @@ def persistence_error(predictors, valid, n_fhour, method='mse', axis=None, weigh
         raise ValueError("'method' must be 'mse', 'rmse', or 'mae'")
     n_f = valid.shape[0]
     me = []
-    if weighted:
-        weights = np.cos(np.deg2rad(valid.lat))
-        weights /= weights.mean()
-    else:
-        weights = 1.
+    weights = get_weights(valid, weighted)
     for f in range(n_fhour):
         if method == 'mse':
             me.append(np.nanmean((valid[f:] - predictors[:(n_f - f)]) ** 2. * weights, axis=axis))
@@ -141,19 +463,14 @@ def climo_error(valid, n_fhour, method='mse', axis=None, weighted=False):
     :param method: str: 'mse' for mean squared error, 'mae' for mean absolute error, 'rmse' for root-mean-square
     :param axis: int, tuple, or None: take the mean of the error along this axis. Regardless of this setting, the
         forecast hour will be the first dimension.
-    :param weighted: bool: if True, expects inputs to be DataArrays with 'lat' as one of the dimensions, and weights
-        according to the latitude
+    :param weighted: bool, str, or array: weighting of the grid points; see get_weights
     :return: ndarray: persistence error with forecast hour as the first dimension
     """
     if method not in ['mse', 'mae', 'rmse']:
         raise ValueError("'method' must be 'mse', 'rmse', or 'mae'")
     n_f = valid.shape[0]
     me = []
-    if weighted:
-        weights = np.cos(np.deg2rad(valid.lat))
-        weights /= weights.mean()
-    else:
-        weights = 1.
+    weights = get_weights(valid, weighted)
     for f in range(n_fhour):
         if method == 'mse':
             me.append(np.nanmean((valid[:(n_f - f)] - np.nanmean(valid, axis=0)) ** 2. * weights, axis=axis))
@@ -181,8 +498,7 @@ def monthly_climo_error(da, val_set, n_fhour=None, method='mse', climo_da=None,
     :param climo_da: xarray DataArray: if provided, contains a pre-computed monthly or daily climatology
     :param by_day_of_year: bool: of True, computes climatology by day of year instead of monthly
     :param return_da: bool: if True, also returns a DataArray of the error from climatology
-    :param weighted: bool: if True, expects inputs to be DataArrays with 'lat' as one of the dimensions, and weights
-        according to the latitude
+    :param weighted: bool, str, or array: weighting of the grid points; see get_weights
     :return: (int or list[, DataArray])
     """
     assert method in ['mse', 'mae', 'rmse', 'acc', 'cos'], "'method' must be one of 'mse', 'mae', 'rmse', 'acc', 'cos'"
@@ -191,11 +507,7 @@ def monthly_climo_error(da, val_set, n_fhour=None, method='mse', climo_da=None,
     if climo_da is None:
         climo_da = da.groupby('%s.%s' % (time_dim, parameter)).mean(time_dim)
     anomaly = da.sel(**{time_dim: val_set}).groupby('%s.%s' % (time_dim, parameter)) - climo_da
-    if weighted:
-        weights = np.cos(np.deg2rad(da.lat))
-        weights /= weights.mean()
-    else:
-        weights = 1.
+    weights = get_weights(da, weighted)
     if method == 'mse':
         me = float((anomaly ** 2. * weights).mean().values)
     elif method == 'mae':
@@ -325,21 +637,44 @@ def add_metadata_to_forecast_cs(forecast, f_hour, meta_ds, f_hour_timedelta_type
     return forecast
 
 
-def verification_from_samples(ds, all_ds=None, init_times=None, forecast_steps=1, dt=6, f_hour_timedelta_type=True,
-                              include_zero=False):
+def _strided_verification(valid_da, init_times, n_f, first, dt):
     """
-    Generate a DataArray of forecast verification from a validation DataSet built using Preprocessor.data_to_samples().
+    Read-only strided view of a verification time series as a (f_hour, time, ...) array, or None if the
+    initialization times are not evenly spaced in the series. Verification times past the end of the series are NaN,
+    as in the copy: the series is then padded once with NaN rows, rather than copied for every forecast hour.
+    """
+    sample = valid_da.sample.values
+    if len(sample) < 2 or len(init_times) < 1:
+        return None
+    spacing = np.diff(sample)
+    if not np.all(spacing == spacing[0]) or spacing[0] <= np.timedelta64(0):
+        return None
+    k = np.timedelta64(dt, 'h') / spacing[0]
+    if k != int(k):
+        return None
+    k = int(k)
+    index = pd.Index(sample).get_indexer(init_times)
+    step = index[1] - index[0] if len(index) > 1 else 1
+    if np.any(index < 0) or step < 1 or np.any(np.diff(index) != step):
+        return None
+    values = np.asarray(valid_da.transpose('sample', ...).values)
+    start = index[0] + first * k
+    pad = index[-1] + (first + n_f - 1) * k + 1 - len(sample)
+    if pad > 0:
+        base = np.full((len(sample) - start + pad,) + values.shape[1:], np.nan,
+                       dtype=np.result_type(values.dtype, np.float32))
+        base[:len(sample) - start] = values[start:]
+    else:
+        base = values[start:]
+    return np.lib.stride_tricks.as_strided(
+        base, shape=(n_f, len(init_times)) + base.shape[1:],
+        strides=(k * base.strides[0], step * base.strides[0]) + base.strides[1:], writeable=False
+    )
 
-    :param ds: xarray.Dataset: dataset of verification data. Time is the first dimension.
-    :param all_ds: xarray.Dataset: optional Dataset containing the same variables/levels/lat/lon as val_ds but
-        including more time steps for more robust handling of data at times outside of the validation selection
-    :param init_times: iterable of Timestamps: optional list of verification initialization times
-    :param forecast_steps: int: number of forward forecast iterations
-    :param dt: int: forecast time step in hours
-    :param f_hour_timedelta_type: bool: if True, converts f_hour dimension into a timedelta type. May not always be
-        compatible with netCDF applications.
-    :param include_zero: bool: if True, include the 0 forecast hour (initialization)
-    :return: xarray.DataArray: verification with forecast hour as the first dimension
+
+def _verification(valid_da, ds, init_times, forecast_steps, dt, f_hour_timedelta_type, include_zero, view):
+    """
+    Shared implementation of verification_from_samples and verification_from_series.
     """
     forecast_steps = int(forecast_steps)
     if forecast_steps < 1:
@@ -349,33 +684,63 @@ def verification_from_samples(ds, all_ds=None, init_times=None, forecast_steps=1
         raise ValueError("'dt' must be an integer >= 1")
     if init_times is None:
         init_times = ds.sample.values
+    init_times = np.array(init_times, dtype='datetime64[ns]')
     dims = [d for d in ds.predictors.dims if d.lower() not in ['time_step', 'sample', 'time']]
     f_hour = np.arange(0 if include_zero else dt, dt * forecast_steps + 1, dt)
     if f_hour_timedelta_type:
         f_hour = np.array(f_hour).astype('timedelta64[h]')
-    verification = xr.DataArray(
-        np.full([forecast_steps + int(include_zero), len(init_times)] + [ds.dims[d] for d in dims],
-                np.nan, dtype=np.float32),
+    n_f = forecast_steps + int(include_zero)
+    first = 0 if include_zero else 1
+
+    verification = None
+    if view:
+        verification = _strided_verification(valid_da.transpose('sample', *dims), init_times, n_f, first, dt)
+        if verification is None:
+            warnings.warn('cannot create a strided view of the verification because the initialization times are not '
+                          'evenly spaced in the data; creating a copy instead')
+    if verification is None:
+        verification = np.full([n_f, len(init_times)] + [ds.dims[d] for d in dims], np.nan, dtype=np.float32)
+        lead_times = np.arange(first, forecast_steps + 1) * np.timedelta64(dt, 'h')
+        for d, date in enumerate(init_times):
+            verification[:, d] = valid_da.reindex(sample=date + lead_times, method=None).transpose(
+                'sample', *dims).values
+    return xr.DataArray(
+        verification,
         coords=[f_hour, init_times] + [ds[d] for d in dims],
         dims=['f_hour', 'time'] + dims,
         name='verification'
     )
+
+
+def verification_from_samples(ds, all_ds=None, init_times=None, forecast_steps=1, dt=6, f_hour_timedelta_type=True,
+                              include_zero=False, view=False):
+    """
+    Generate a DataArray of forecast verification from a validation DataSet built using Preprocessor.data_to_samples().
+
+    :param ds: xarray.Dataset: dataset of verification data. Time is the first dimension.
+    :param all_ds: xarray.Dataset: optional Dataset containing the same variables/levels/lat/lon as val_ds but
+        including more time steps for more robust handling of data at times outside of the validation selection
+    :param init_times: iterable of Timestamps: optional list of verification initialization times
+    :param forecast_steps: int: number of forward forecast iterations
+    :param dt: int: forecast time step in hours
+    :param f_hour_timedelta_type: bool: if True, converts f_hour dimension into a timedelta type. May not always be
+        compatible with netCDF applications.
+    :param include_zero: bool: if True, include the 0 forecast hour (initialization)
+    :param view: bool: if True, return a read-only strided view of the verification time series, in which each
+        forecast hour is an offset window into the same memory, instead of a copy for every forecast hour. Requires
+        evenly-spaced initialization times; otherwise falls back to a copy with a warning. Verification times past
+        the end of the data are NaN, for which the data are padded once.
+    :return: xarray.DataArray: verification with forecast hour as the first dimension
+    """
     if all_ds is not None:
         valid_da = all_ds.predictors.isel(time_step=-1)
     else:
         valid_da = ds.predictors.isel(time_step=-1)
-    for d, date in enumerate(init_times):
-        verification[:, d] = valid_da.reindex(
-            sample=pd.date_range(date if include_zero else date + np.timedelta64(timedelta(hours=dt)),
-                                 date + np.timedelta64(timedelta(hours=dt * forecast_steps)),
-                                 freq='%sH' % int(dt)),
-            method=None
-        ).values
-    return verification
+    return _verification(valid_da, ds, init_times, forecast_steps, dt, f_hour_timedelta_type, include_zero, view)
 
 
 def verification_from_series(ds, all_ds=None, init_times=None, forecast_steps=1, dt=6, f_hour_timedelta_type=True,
-                             include_zero=False):
+                             include_zero=False, view=False):
     """
     Generate a DataArray of forecast verification from a validation DataSet built using Preprocessor.data_to_series().
 
@@ -388,39 +753,17 @@ def verification_from_series(ds, all_ds=None, init_times=None, forecast_steps=1,
     :param f_hour_timedelta_type: bool: if True, converts f_hour dimension into a timedelta type. May not always be
         compatible with netCDF applications.
     :param include_zero: bool: if True, include the 0 forecast hour (initialization)
+    :param view: bool: if True, return a read-only strided view of the verification time series, in which each
+        forecast hour is an offset window into the same memory, instead of a copy for every forecast hour. Requires
+        evenly-spaced initialization times; otherwise falls back to a copy with a warning. Verification times past
+        the end of the data are NaN, for which the data are padded once.
     :return: xarray.DataArray: verification with forecast hour as the first dimension
     """
-    forecast_steps = int(forecast_steps)
-    if forecast_steps < 1:
-        raise ValueError("'forecast_steps' must be an integer >= 1")
-    dt = int(dt)
-    if dt < 1:
-        raise ValueError("'dt' must be an integer >= 1")
-    if init_times is None:
-        init_times = ds.sample.values
-    dims = [d for d in ds.predictors.dims if d.lower() not in ['time_step', 'sample', 'time']]
-    f_hour = np.arange(0 if include_zero else dt, dt * forecast_steps + 1, dt)
-    if f_hour_timedelta_type:
-        f_hour = np.array(f_hour).astype('timedelta64[h]')
-    verification = xr.DataArray(
-        np.full([forecast_steps + int(include_zero), len(init_times)] + [ds.dims[d] for d in dims],
-                np.nan, dtype=np.float32),
-        coords=[f_hour, init_times] + [ds[d] for d in dims],
-        dims=['f_hour', 'time'] + dims,
-        name='verification'
-    )
     if all_ds is not None:
         valid_da = all_ds.predictors
     else:
         valid_da = ds.predictors
-    for d, date in enumerate(init_times):
-        verification[:, d] = valid_da.reindex(
-            sample=pd.date_range(date if include_zero else date + np.timedelta64(timedelta(hours=dt)),
-                                 date + np.timedelta64(timedelta(hours=dt * forecast_steps)),
-                                 freq='%sH' % int(dt)),
-            method=None
-        ).values
-    return verification
+    return _verification(valid_da, ds, init_times, forecast_steps, dt, f_hour_timedelta_type, include_zero, view)
 
 
 def daily_climatology(ds):
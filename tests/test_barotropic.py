@@ -0,0 +1,79 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Tests for DLWP.barotropic.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+from DLWP.barotropic import BarotropicModel
+
+
+def _rossby_haurwitz(nlat, nlon, radius=6371200., omega=7.848e-6, amplitude=7.848e-6, wavenumber=4):
+    lat = np.deg2rad(np.linspace(90., -90., nlat))[:, np.newaxis]
+    lon = np.deg2rad(np.arange(0., 360., 360. / nlon))[np.newaxis, :]
+    return radius ** 2. * (-omega * np.sin(lat) + amplitude * np.cos(lat) ** wavenumber * np.sin(lat) *
+                           np.cos(wavenumber * lon))
+
+
+def test_rk3_is_stable_at_long_time_steps():
+    z0 = _rossby_haurwitz(37, 72)
+    z = {}
+    for integrator in ['rk3', 'rk4']:
+        model = BarotropicModel(z0, 24, 3600., datetime(2000, 1, 1), integrator=integrator)
+        for _ in range(24):
+            model.step_forward()
+        z[integrator] = model.z_grid
+    assert np.all(np.isfinite(z['rk3']))
+    error = np.sqrt(np.mean((z['rk3'] - z['rk4']) ** 2.))
+    assert error < 2e-3 * np.std(z['rk4'])
+
+
+def _harmonic_field(engine):
+    # cos(lat) ** 2 sin(lat) cos(2 lon), a multiple of the spherical harmonic of degree 3 and order 2
+    # grid_latlon gives the gaussian latitudes for either grid type
+    if engine.gridtype == 'regular':
+        lat = np.deg2rad(np.linspace(90., -90., engine.nlat))[:, np.newaxis]
+    else:
+        lat = np.deg2rad(engine.grid_latlon[0])[:, np.newaxis]
+    lon = np.deg2rad(engine.grid_latlon[1])[np.newaxis, :]
+    return np.cos(lat) ** 2. * np.sin(lat) * np.cos(2. * lon), lat
+
+
+def test_numpy_engine_round_trip():
+    from DLWP.barotropic import NumpyTransformsEngine
+
+    rs = np.random.RandomState(0)
+    for gridtype in ['regular', 'gaussian']:
+        engine = NumpyTransformsEngine(72, 37, 24, gridtype=gridtype)
+        spec = rs.randn(engine.nspec, 2) + 1j * rs.randn(engine.nspec, 2)
+        # The m = 0 coefficients of a real field are real
+        spec[engine.wavenumbers[0] == 0] = spec[engine.wavenumbers[0] == 0].real
+        grid = engine.spec_to_grid(spec)
+        assert grid.shape == (37, 72, 2)
+        np.testing.assert_allclose(engine.grid_to_spec(grid), spec, atol=1e-10)
+        np.testing.assert_allclose(engine.spec_to_grid(spec[:, 1]), grid[..., 1], atol=1e-10)
+
+
+def test_numpy_engine_laplacian_and_gradient():
+    from DLWP.barotropic import NumpyTransformsEngine
+
+    for gridtype in ['regular', 'gaussian']:
+        engine = NumpyTransformsEngine(72, 37, 24, gridtype=gridtype)
+        field, lat = _harmonic_field(engine)
+        spec = engine.grid_to_spec(field)
+        n = engine.wavenumbers[1]
+        laplacian = engine.spec_to_grid(-n * (n + 1.) / engine.radius ** 2. * spec)
+        np.testing.assert_allclose(laplacian, -12. / engine.radius ** 2. * field, atol=1e-12 / engine.radius ** 2.)
+        dsdx, dsdy = engine.grad_of_spec(spec)
+        lon = np.deg2rad(engine.grid_latlon[1])[np.newaxis, :]
+        np.testing.assert_allclose(dsdx * engine.radius, -2. * np.cos(lat) * np.sin(lat) * np.sin(2. * lon),
+                                   atol=1e-10)
+        np.testing.assert_allclose(dsdy * engine.radius, (np.cos(lat) ** 3. - 2. * np.cos(lat) * np.sin(lat) ** 2.)
+                                   * np.cos(2. * lon), atol=1e-10)
@@ -0,0 +1,42 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Tests for DLWP.remap.cache.
+"""
+
+import os
+
+from DLWP.remap import MapCache
+
+
+def _generate(forward, inverse, work_dir):
+    for path in (forward, inverse):
+        with open(path, 'w') as f:
+            f.write('map')
+
+
+def test_leased_entry_is_not_evicted(tmp_path):
+    # Locks of different MapCache objects conflict even within one process
+    cache, other = MapCache(str(tmp_path), verbose=False), MapCache(str(tmp_path), verbose=False)
+    with cache.acquire('leased', _generate) as lease:
+        other.get('free', _generate)
+        assert other.clear() == ['free']
+        assert other.evict(max_age=0) == []
+        assert os.path.exists(lease.forward) and os.path.exists(lease.inverse)
+    assert other.evict(max_age=0) == ['leased']
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_orphaned_locks_are_removed(tmp_path):
+    cache = MapCache(str(tmp_path), verbose=False)
+    try:
+        cache.get('failed', lambda forward, inverse, work_dir: 1 / 0)
+    except ZeroDivisionError:
+        pass
+    assert os.listdir(str(tmp_path)) == ['failed.lock']
+    cache.evict()
+    assert os.listdir(str(tmp_path)) == []
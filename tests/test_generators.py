@@ -0,0 +1,93 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Tests for DLWP.model.generators.
+"""
+
+import numpy as np
+import xarray as xr
+
+from DLWP.model import DLWPNeuralNet, DataGenerator, generator_moments
+
+
+def _dataset_with_nan():
+    rs = np.random.RandomState(0)
+    predictors = rs.randn(20, 2, 3, 4).astype(np.float32)
+    targets = rs.randn(20, 2, 3, 4).astype(np.float32)
+    predictors[3, 0, 1, 1] = np.nan
+    targets[11, 1, 2, 0] = np.nan
+    return xr.Dataset({'predictors': (('sample', 'varlev', 'lat', 'lon'), predictors),
+                       'targets': (('sample', 'varlev', 'lat', 'lon'), targets)})
+
+
+def test_generate_all_samples_leaves_dataset_unchanged():
+    ds = _dataset_with_nan()
+    original = ds.copy(deep=True)
+    for impute in [False, True]:
+        model = DLWPNeuralNet(is_convolutional=True, scaler_type=None, impute_missing=impute)
+        if impute:
+            model.imputer_fit(ds.predictors.values, ds.targets.values)
+        generator = DataGenerator(model, ds, batch_size=4, remove_nan=not impute)
+        p, t = generator.generate([], scale_and_impute=False)
+        assert p.shape[0] == (20 if impute else 18)
+        generator.generate([])
+        xr.testing.assert_identical(ds, original)
+
+
+def test_generator_moments_match_init_fit():
+    ds = _dataset_with_nan()
+    for impute, same_y in [(False, True), (True, True), (True, False)]:
+        kwargs = dict(is_convolutional=True, impute_missing=impute, apply_same_y_scaling=same_y)
+        streamed, reference = DLWPNeuralNet(**kwargs), DLWPNeuralNet(**kwargs)
+        generator = DataGenerator(streamed, ds, batch_size=3, remove_nan=not impute)
+        streamed.init_fit_generator(generator, n_jobs=2)
+        p, t = generator.generate([], scale_and_impute=False)
+        reference.init_fit(p, t)
+        if impute:
+            for imputer in ['imputer', 'imputer_y']:
+                np.testing.assert_allclose(getattr(streamed, imputer).statistics_,
+                                           getattr(reference, imputer).statistics_, rtol=1e-6)
+        for scaler in ['scaler', 'scaler_y']:
+            np.testing.assert_allclose(getattr(streamed, scaler).mean_, getattr(reference, scaler).mean_,
+                                       rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(getattr(streamed, scaler).scale_, getattr(reference, scaler).scale_, rtol=1e-5)
+        moments, moments_y = generator_moments(generator, batch_size=7)
+        assert moments.n_samples_seen == p.shape[0]
+        np.testing.assert_allclose(moments_y.mean, np.nanmean(t.reshape((t.shape[0], -1)), axis=0), rtol=1e-5,
+                                   atol=1e-6)
+
+
+class _ConstantModel(DLWPNeuralNet):
+    """
+    Inference model predicting ones for every step of a sequence.
+    """
+
+    def __init__(self, sequence):
+        super(_ConstantModel, self).__init__(is_convolutional=True, scaler_type=None)
+        self.sequence = sequence
+
+    def predict(self, p, **kwargs):
+        p = p[0] if isinstance(p, list) else p
+        return [np.ones_like(p) for _ in range(self.sequence)]
+
+
+def test_inference_generators_index_batches():
+    from DLWP.model.extensions import ArrayDataGeneratorWithInference, SeriesDataGeneratorWithInference
+
+    ds = _dataset_with_nan()
+    array = ds.predictors.values
+    series = xr.Dataset({'predictors': (('sample', 'varlev', 'lat', 'lon'), array)},
+                        coords={'sample': np.arange(20), 'varlev': ['a', 'b']})
+    model = DLWPNeuralNet(is_convolutional=True, scaler_type=None)
+    for generator in [ArrayDataGeneratorWithInference(_ConstantModel(2), [0], model, array, batch_size=4, sequence=2),
+                      SeriesDataGeneratorWithInference(_ConstantModel(2), [0], model, series, batch_size=4,
+                                                       sequence=2)]:
+        p, t = generator[0]
+        assert len(t) == 2
+        assert np.all(t[0] == 1.)
+        assert not np.any(np.isnan(p))
+        assert not np.all(t[1] == 1.)
@@ -0,0 +1,62 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Tests for DLWP.remap.gnomonic and DLWP.remap.gnomonic_remap.
+"""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from DLWP.remap import GnomonicRemap, cube_sphere_cell_areas
+
+LAT = np.linspace(90., -90., 46)
+LON = np.arange(0., 360., 4.)
+RES = 12
+
+
+def _field(values):
+    return xr.DataArray(values, dims=('lat', 'lon'), coords={'lat': LAT, 'lon': LON})
+
+
+def _smooth_field():
+    lat, lon = np.meshgrid(np.deg2rad(LAT), np.deg2rad(LON), indexing='ij')
+    return np.cos(lat) ** 2. * np.cos(2. * lon) + np.sin(lat)
+
+
+def test_cell_areas_cover_the_sphere():
+    assert np.isclose(cube_sphere_cell_areas(RES).sum(), 4. * np.pi)
+
+
+@pytest.mark.parametrize('method', ['bilinear', 'conservative'])
+def test_weight_rows_sum_to_one(method):
+    remap = GnomonicRemap(LAT, LON, RES, method=method, verbose=False)
+    assert remap.map.shape == (6 * RES * RES, LAT.size * LON.size)
+    assert remap.inverse_map.shape == (LAT.size * LON.size, 6 * RES * RES)
+    for weights in (remap.map, remap.inverse_map):
+        assert weights.min() >= 0.
+        np.testing.assert_allclose(np.asarray(weights.sum(axis=1)).ravel(), 1., atol=1e-12)
+
+
+@pytest.mark.parametrize('method', ['bilinear', 'conservative'])
+def test_constant_field_is_reproduced(method):
+    remap = GnomonicRemap(LAT, LON, RES, method=method, verbose=False)
+    cube = remap.remap_dataset(_field(np.full((LAT.size, LON.size), 3.)))
+    assert cube.dims == ('face', 'height', 'width')
+    assert cube.shape == (6, RES, RES)
+    np.testing.assert_allclose(cube.values, 3., atol=1e-12)
+    np.testing.assert_allclose(remap.inverse_remap_dataset(cube).values, 3., atol=1e-12)
+
+
+@pytest.mark.parametrize('method, tolerance', [('bilinear', 0.03), ('conservative', 0.15)])
+def test_round_trip_of_smooth_field(method, tolerance):
+    remap = GnomonicRemap(LAT, LON, RES, method=method, verbose=False)
+    field = _smooth_field()
+    result = remap.inverse_remap_dataset(remap.remap_dataset(_field(field))).values
+    assert result.shape == field.shape
+    assert np.max(np.abs(result - field)) < tolerance
+    assert np.sqrt(np.mean((result - field) ** 2.)) < tolerance / 3.
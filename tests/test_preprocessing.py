@@ -0,0 +1,82 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Tests for DLWP.model.preprocessing.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from sklearn.preprocessing import StandardScaler
+
+from DLWP.model.preprocessing import AffineScaler, MeanImputer, RunningMoments, prepare_data_array
+
+
+def _predictors():
+    rs = np.random.RandomState(0)
+    return xr.Dataset({'predictors': (('sample', 'varlev', 'lat', 'lon'), rs.randn(6, 3, 4, 5).astype(np.float32))},
+                      coords={'sample': pd.date_range('2000-01-01', periods=6, freq='6h'),
+                              'varlev': ['z/500', 't/850', 'z/1000'], 'lat': np.linspace(60., 0., 4),
+                              'lon': np.linspace(0., 80., 5)})
+
+
+def test_prepare_data_array_with_scalar_scaler():
+    ds = _predictors()
+    sel = {'varlev': ['t/850', 'z/500']}
+    raw, _, _, _ = prepare_data_array(ds, input_sel=sel, output_sel=sel)
+    data, _, _, _ = prepare_data_array(ds, input_sel=sel, output_sel=sel, scaler=AffineScaler(2., 1.))
+    np.testing.assert_allclose(data, raw * 2. + 1., rtol=1e-6)
+
+
+def test_prepare_data_array_reorders_per_channel_scaler():
+    ds = _predictors()
+    sel = {'varlev': ['t/850', 'z/500']}
+    raw, _, _, _ = prepare_data_array(ds, input_sel=sel, output_sel=sel)
+    data, _, _, _ = prepare_data_array(ds, input_sel=sel, output_sel=sel, scaler=AffineScaler([1., 2., 3.], 0.))
+    np.testing.assert_allclose(data, raw * np.array([2., 1.])[:, None, None], rtol=1e-6)
+
+
+def _data_with_nan():
+    rs = np.random.RandomState(1)
+    data = (rs.randn(50, 6) * [1., 2., 3., 4., 5., 6.] + 1000.).astype(np.float32)
+    data[rs.rand(50, 6) < 0.1] = np.nan
+    data[:, 5] = np.nan
+    return data
+
+
+def test_running_moments_match_standard_scaler():
+    data = _data_with_nan()[:, :5]
+    moments = RunningMoments()
+    for start in range(0, 30, 7):
+        moments.partial_fit(data[start:min(start + 7, 30)])
+    moments.merge(RunningMoments().partial_fit(data[30:]))
+    reference = StandardScaler().fit(data.astype(np.float64))
+    assert moments.n_samples_seen == 50
+    np.testing.assert_array_equal(moments.count, np.sum(~np.isnan(data), axis=0))
+    np.testing.assert_allclose(moments.mean, reference.mean_, rtol=1e-12)
+    np.testing.assert_allclose(moments.var, reference.var_, rtol=1e-9)
+    np.testing.assert_array_equal(moments.min, np.nanmin(data, axis=0))
+    np.testing.assert_array_equal(moments.max, np.nanmax(data, axis=0))
+    scaler = moments.to_scaler()
+    np.testing.assert_allclose(scaler.scale_, reference.scale_, rtol=1e-9)
+    np.testing.assert_allclose(scaler.transform(data), reference.transform(data), rtol=1e-5, atol=1e-5)
+
+
+def test_mean_imputer_matches_imputed_moments():
+    data = _data_with_nan()
+    moments = RunningMoments().partial_fit(data[:20]).merge(RunningMoments().partial_fit(data[20:]))
+    imputer = MeanImputer(fill_value=-1.).fit(data)
+    np.testing.assert_allclose(MeanImputer.from_moments(moments, fill_value=-1.).statistics_, imputer.statistics_,
+                               rtol=1e-8)
+    imputed = imputer.transform(data)
+    assert imputed.shape == data.shape
+    assert not np.any(np.isnan(imputed))
+    assert np.all(imputed[:, 5] == -1.)
+    assert np.isnan(data).any()
+    reference = StandardScaler().fit(imputed.astype(np.float64))
+    np.testing.assert_allclose(moments.imputed(fill_value=-1.).mean, reference.mean_, rtol=1e-7)
+    np.testing.assert_allclose(moments.imputed(fill_value=-1.).var, reference.var_, rtol=1e-6, atol=1e-9)
@@ -0,0 +1,42 @@
+#
+# Copyright (c) 2020 Jonathan Weyn <jweyn@uw.edu>
+#
+# See the file LICENSE for your rights.
+#
+
+"""
+Tests for DLWP.verify.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from DLWP.verify import verification_from_series
+
+
+def _series():
+    rs = np.random.RandomState(0)
+    return xr.Dataset(
+        {'predictors': (('sample', 'varlev', 'lat', 'lon'), rs.randn(40, 2, 3, 4).astype(np.float32))},
+        coords={'sample': pd.date_range('2000-01-01', periods=40, freq='6h'), 'varlev': ['z500', 't850'],
+                'lat': np.arange(3.), 'lon': np.arange(4.)}
+    )
+
+
+def test_view_of_default_init_times():
+    ds = _series()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        view = verification_from_series(ds, forecast_steps=8, dt=12, view=True)
+    copy = verification_from_series(ds, forecast_steps=8, dt=12)
+    xr.testing.assert_identical(view, copy)
+    # The last initialization times verify past the end of the series, so the view is of a padded buffer, which holds
+    # the series only once rather than once per forecast hour
+    assert not view.values.flags.writeable
+    buffer = view.values
+    while buffer.base is not None:
+        buffer = buffer.base
+    assert buffer.nbytes < 2 * ds.predictors.nbytes